@@ -1,13 +1,101 @@
 import os
+import re
+import sys
 import textwrap
 import time
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Tuple
+
+_WHITESPACE = re.compile(r'\s')
+
+
+class _Canvas:
+    """The frame currently on screen.
+
+    Knows where each text cell lives so updates can be written as
+    cursor-addressed runs of changed characters instead of whole frames.
+    The cursor is assumed to rest at column 1 of the line below the frame.
+    """
+
+    def __init__(self, template: Tuple[str, ...], text_rows: int):
+        self.template = template
+        self.height = len(template)
+        self.text_rows = text_rows
+        self.lines: List[str] = []
+
+    def render(self) -> str:
+        return '\n'.join(self.template) + '\n'
+
+    def _goto(self, row: int, col: int) -> str:
+        # text row i lives on frame row i + 1, after "║ " (terminal columns are 1-based)
+        return f"\033[{self.height - row - 1}A\033[{col + 3}G"
+
+    def _back(self, row: int) -> str:
+        return f"\033[{self.height - row - 1}B\r"
+
+    def write_run(self, row: int, col: int, chars: str) -> str:
+        return self._goto(row, col) + chars + self._back(row)
+
+    def update(self, lines: List[str]) -> str:
+        """Escape sequence that turns the on-screen text into `lines`."""
+        out = []
+        for row, new in enumerate(lines):
+            old = self.lines[row] if row < len(self.lines) else ''
+            if new == old:
+                continue
+            col = 0
+            limit = min(len(old), len(new))
+            while col < limit and old[col] == new[col]:
+                col += 1
+            # pad with spaces to erase what is left of the old line
+            out.append(self.write_run(row, col, new[col:].ljust(len(old) - col)))
+        for row in range(len(lines), len(self.lines)):
+            if self.lines[row]:
+                out.append(self.write_run(row, 0, ' ' * len(self.lines[row])))
+        self.lines = list(lines)
+        return ''.join(out)
+
+
+class _StreamLayout:
+    """Word-wraps text that arrives in chunks without rewrapping all of it.
+
+    With greedy wrapping, appending text only changes the last line, or the
+    one before it when the last word grows long enough to be split. Each
+    append rewraps from the start of the earliest line that may still change.
+    """
+
+    def __init__(self, width: int):
+        self.width = width
+        self.text = ''
+        self.lines: List[str] = []
+        self._stable = 0   # lines that can no longer change
+        self._tail = 0     # offset in self.text where the first unstable line starts
+
+    def append(self, chunk: str) -> List[str]:
+        # textwrap turns whitespace into spaces; do it here so lines stay substrings of text
+        self.text += _WHITESPACE.sub(' ', chunk)
+        tail = textwrap.wrap(self.text[self._tail:], width=self.width)
+        if not tail:
+            return self.lines
+        self.lines = self.lines[:self._stable] + tail
+        # a line is final once it ends on whitespace and two more lines follow it
+        pos = self._tail
+        for i, line in enumerate(tail[:-2]):
+            pos = self.text.index(line, pos) + len(line)
+            if pos < len(self.text) and self.text[pos] == ' ':
+                self._tail = self.text.index(tail[i + 1], pos)
+                self._stable = len(self.lines) - len(tail) + i + 1
+        return self.lines
+
 
 class ChatboxRenderer:
-    def __init__(self, width: int = 50, height: int = 15):
+    def __init__(self, width: int = 50, height: int = 15, fps: float = 60.0, clear_screen: bool = True):
         self.width = width
         self.height = height
+        self.fps = fps
+        self.clear_screen = clear_screen
         self.emotions = self._load_emotions()
+        self._art_cache: Dict[str, List[str]] = {}
+        self._templates: Dict[Tuple[str, int], Tuple[str, ...]] = {}
 
     def _load_emotions(self) -> dict:
         """Load ASCII art emotions from the emotions.txt file."""
@@ -43,6 +131,10 @@ class ChatboxRenderer:
         
         return emotions
 
+    def _clear(self) -> None:
+        if self.clear_screen:
+            os.system('cls' if os.name == 'nt' else 'clear')
+
     def _create_border(self, width: int, height: int) -> List[str]:
         """Create a bordered box with the specified dimensions."""
         box = []
@@ -56,11 +148,38 @@ class ChatboxRenderer:
         """Wrap text to fit within the chatbox width."""
         return textwrap.wrap(text, width=self.width - 4)  # -4 for borders and padding
 
+    def _art_lines(self, emotion: str) -> List[str]:
+        """Emotion art split into lines, cached per emotion."""
+        key = emotion.lower()
+        art_lines = self._art_cache.get(key)
+        if art_lines is None:
+            art = self.emotions.get(key, self.emotions['happy'])
+            art_lines = self._art_cache[key] = art.split('\n')
+        return art_lines
+
+    def _frame_template(self, emotion: str, text_lines: int) -> Tuple[str, ...]:
+        """Empty frame (border + art) sized for `text_lines` lines, cached per emotion and size."""
+        art_lines = self._art_lines(emotion)
+        box_height = max(text_lines + 4, len(art_lines))
+        key = (emotion.lower(), box_height)
+        template = self._templates.get(key)
+        if template is None:
+            box = self._create_border(self.width, box_height)
+            template = tuple(
+                f'{box[i]}  {art_lines[i] if i < len(art_lines) else " " * len(art_lines[0])}'
+                for i in range(box_height)
+            )
+            self._templates[key] = template
+        return template
+
+    def _new_canvas(self, emotion: str, text_lines: int) -> _Canvas:
+        template = self._frame_template(emotion, text_lines)
+        return _Canvas(template, len(template) - 2)
+
     def _get_frame_lines(self, text: str, emotion: str, current_char_count: int) -> List[str]:
         """Generate the lines for a single frame of the animated text display."""
         # Get emotion art
-        art = self.emotions.get(emotion.lower(), self.emotions['happy'])
-        art_lines = art.split('\n')
+        art_lines = self._art_lines(emotion)
         
         # Create partial text for animation
         wrapped_full_text = self._wrap_text(text)
@@ -95,32 +214,97 @@ class ChatboxRenderer:
             
         return final_output
 
-    def display(self, text: str, emotion: str = 'neutral', typing_speed: float = 0.01) -> None:
-        """Display the chatbox with animated text typing effect."""
+    def display(self, text: str, emotion: str = 'neutral', typing_speed: float = 0.01, pause: float = 0.5) -> None:
+        """Display the chatbox with animated text typing effect.
+
+        The layout is computed once; each frame writes only the newly revealed
+        characters. Frames are paced at self.fps and reveal however many
+        characters are due by then, so a slow terminal drops frames instead
+        of slowing the text down.
+        """
         # Clear screen once at the start
-        os.system('cls' if os.name == 'nt' else 'clear')
-        
-        # Get the initial frame to calculate height
-        initial_frame = self._get_frame_lines(text, emotion, 0)
-        frame_height = len(initial_frame)
-        
-        # Print initial empty frame
-        print('\n'.join(initial_frame))
-        
-        total_chars = len(text)
-        current_chars = 0
-        
-        while current_chars <= total_chars:
-            # Move cursor up to the start of the frame
-            print(f"\033[{frame_height}A", end='')
-            
-            # Generate and print the new frame
-            frame = self._get_frame_lines(text, emotion, current_chars)
-            print('\n'.join(frame))
-            
-            current_chars += 1
-            if current_chars <= total_chars:
-                time.sleep(typing_speed)
-        
+        self._clear()
+
+        wrapped = self._wrap_text(text)
+        canvas = self._new_canvas(emotion, len(wrapped))
+        out = sys.stdout
+        out.write(canvas.render())
+        out.flush()
+
+        # reveal order: cell k is (row, col) of the k-th wrapped character
+        cells = [(row, col) for row, line in enumerate(wrapped) for col in range(len(line))]
+        total = len(cells)
+        revealed = 0
+        interval = 1.0 / self.fps if self.fps > 0 else 0.0
+        start = time.perf_counter()
+
+        while revealed < total:
+            if typing_speed > 0:
+                due = min(total, int((time.perf_counter() - start) / typing_speed) + 1)
+            else:
+                due = total
+            if due > revealed:
+                runs = []
+                k = revealed
+                while k < due:
+                    row, col = cells[k]
+                    end = min(due, k + len(wrapped[row]) - col)
+                    runs.append(canvas.write_run(row, col, wrapped[row][col:col + end - k]))
+                    k = end
+                out.write(''.join(runs))
+                out.flush()
+                revealed = due
+            if revealed < total and interval:
+                time.sleep(interval - (time.perf_counter() - start) % interval)
+        canvas.lines = list(wrapped)
+
         # Add a small pause after completing the text
-        time.sleep(0.5)
+        if pause:
+            time.sleep(pause)
+
+    def display_stream(self, chunks: Iterable[str], emotion: str = 'neutral') -> str:
+        """Display the chatbox, drawing text chunks as they arrive from a stream.
+
+        There is no artificial typing delay: chunks are drawn as soon as the
+        generator yields them, at most self.fps times per second, and only
+        the changed cells are written. Returns the full text that was displayed.
+        """
+        self._clear()
+
+        out = sys.stdout
+        layout = _StreamLayout(self.width - 4)
+        canvas = self._new_canvas(emotion, 0)
+        out.write(canvas.render())
+        out.flush()
+
+        interval = 1.0 / self.fps if self.fps > 0 else 0.0
+        last_draw = 0.0
+        pending = False
+        text = ''
+
+        def draw():
+            nonlocal canvas
+            lines = layout.lines
+            if len(lines) > canvas.text_rows:
+                # out of room: redraw a taller frame over the old one
+                taller = self._new_canvas(emotion, len(lines) + 4)
+                out.write(f"\033[{canvas.height}A" + taller.render())
+                canvas = taller
+            out.write(canvas.update(lines))
+            out.flush()
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+            text += chunk
+            layout.append(chunk)
+            pending = True
+            now = time.perf_counter()
+            if now - last_draw >= interval:
+                draw()
+                last_draw = now
+                pending = False
+
+        if pending:
+            draw()
+        return text
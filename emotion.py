@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+emotion.py
+
+Picks Ralsei's emotion (the chatbox art) while a reply is still streaming in.
+
+The Modelfile SYSTEM prompt asks the model to open every reply with one of
+EMOTIONS. Models write that tag in several ways ('happy Oh!', '"sad"\\n\\n',
+'*Surprised*', '[mad]', 'Emotion: happy'), so the start of the stream is held
+back only while it could still turn out to be a tag; a complete tag decides
+the emotion and is cut from the text. Without a tag, the first
+RALSEI_EMOTION_WORDS words (default 6) are scored against a small lexicon and
+the emotion is committed as soon as that many words have arrived, or when the
+reply ends. Either way the art is known a few tokens into the reply.
+
+Only the first words ever count, so a reply gets the same emotion however it
+was split into chunks (streamed, cached, or generated in one piece).
+
+Functions:
+ - EmotionStream(chunks): wraps a text stream; emotion() waits for the first
+   tokens and returns the emotion, iterating yields the text without the tag
+ - split_emotion(text): (emotion, text without the tag) for a finished reply
+ - lexicon_scores(text): {emotion: score} used when there is no tag
+"""
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import os
+import re
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+EMOTIONS = ('happy', 'sad', 'surprised', 'mad')
+DEFAULT_EMOTION = 'happy'
+
+# longest start of a reply held back while waiting for a tag to finish
+MAX_TAG_CHARS = 48
+
+LEXICON = {
+    'happy': ('happy', 'glad', 'great', 'wonderful', 'yay', 'love', 'lovely', 'friend', 'friends', 'hehe',
+              'smile', 'fun', 'nice', 'thanks', 'thank', 'welcome', 'hope', 'joy', 'delighted', 'excited',
+              'kind', 'sweet', 'cake', 'hug', 'together', 'best', 'fluffy', 'proud', 'enjoy'),
+    'sad': ('sad', 'sadly', 'sorry', 'unfortunately', 'miss', 'alone', 'lonely', 'cry', 'crying', 'tears',
+            'regret', 'hurt', 'lost', 'afraid', 'worried', 'sigh', 'apologize', 'fault', 'goodbye',
+            'forget', 'forgotten', 'empty'),
+    'surprised': ('surprised', 'oh', 'wow', 'whoa', 'really', 'huh', 'gasp', 'goodness', 'unexpected',
+                  'suddenly', 'amazing', 'incredible', 'wait', 'ah', 'eh', 'seriously'),
+    'mad': ('mad', 'angry', 'hate', 'annoying', 'annoyed', 'rude', 'furious', 'grr', 'ugh', 'mean', 'unfair',
+            'stop', 'enough', 'insult', 'jerk', 'stupid', 'shut', 'dare'),
+}
+# the emotion names themselves are the strongest evidence
+NAME_WEIGHT = 2.0
+
+_WORD = re.compile(r"[a-z']+")
+_VOCAB = {}
+for _col, _emotion in enumerate(EMOTIONS):
+    for _w in LEXICON[_emotion]:
+        _VOCAB.setdefault(_w, (_col, NAME_WEIGHT if _w == _emotion else 1.0))
+if np is not None:
+    # one row per lexicon word, one column per emotion: scoring is a gather and a sum
+    _WORD_INDEX = {w: i for i, w in enumerate(_VOCAB)}
+    _WEIGHTS = np.zeros((len(_VOCAB), len(EMOTIONS)), dtype=np.float32)
+    for _w, (_col, _weight) in _VOCAB.items():
+        _WEIGHTS[_WORD_INDEX[_w], _col] = _weight
+
+# a complete tag: wrappers, an optional "emotion:" label, the emotion, closing punctuation
+_OPEN = r'\s"\'`*_#\[(<{“‘'
+_LABEL = r'(?:emotion|mood|feeling)\s*[:=\-]?\s*'
+_TAG = re.compile(
+    rf'[{_OPEN}]*(?:{_LABEL})?({"|".join(EMOTIONS)})(?![a-z])'
+    r'["\'`*_\])>}”’]*[:;.!,\-—]*\s*',
+    re.IGNORECASE,
+)
+
+
+def _prefix_pattern(word: str) -> str:
+    """Regex matching every prefix of `word`, the empty one included."""
+    pattern = ''
+    for ch in reversed(word):
+        pattern = f'(?:{re.escape(ch)}{pattern})?'
+    return pattern
+
+
+# text that is not a tag yet but may still become one
+_PARTIAL_TAG = re.compile(
+    rf'[{_OPEN}]*(?:'
+    + '|'.join(_prefix_pattern(label) for label in ('emotion', 'mood', 'feeling'))
+    + rf'|(?:{_LABEL})?(?:' + '|'.join(_prefix_pattern(e) for e in EMOTIONS) + '))',
+    re.IGNORECASE,
+)
+
+
+def lexicon_scores(text: str, max_words: Optional[int] = None) -> Dict[str, float]:
+    """Lexicon score of each emotion over the first `max_words` words of `text`."""
+    words = _WORD.findall(text.lower())[:max_words]
+    if np is not None:
+        rows = [_WORD_INDEX[w] for w in words if w in _WORD_INDEX]
+        totals = _WEIGHTS[rows].sum(axis=0) if rows else np.zeros(len(EMOTIONS))
+        return {e: float(t) for e, t in zip(EMOTIONS, totals)}
+    totals = dict.fromkeys(EMOTIONS, 0.0)
+    for w in words:
+        hit = _VOCAB.get(w)
+        if hit is not None:
+            totals[EMOTIONS[hit[0]]] += hit[1]
+    return totals
+
+
+class EmotionStream:
+    """Text chunks with the leading emotion tag removed, plus the emotion.
+
+    emotion() reads just enough of `chunks` to decide; iterating yields the
+    held-back text (minus the tag) and then passes the remaining chunks
+    through as they arrive. `raw` is everything received, tag included, and
+    `source` says how the emotion was chosen: 'tag', 'lexicon' or 'default'.
+    """
+
+    def __init__(self, chunks: Iterable[str], default: str = DEFAULT_EMOTION,
+                 commit_words: Optional[int] = None):
+        self._chunks = iter(chunks)
+        self.default = default
+        self.commit_words = commit_words or int(os.environ.get('RALSEI_EMOTION_WORDS', '6'))
+        self.raw = ''
+        self.source: Optional[str] = None
+        self._emotion: Optional[str] = None
+        self._held = ''
+        self._tagless = False
+
+    def _decide(self, final: bool):
+        held = self._held
+        if not self._tagless:
+            m = _TAG.match(held)
+            done = final or len(held) >= MAX_TAG_CHARS
+            # a tag is complete once something that is not part of it follows
+            if m and (m.end() < len(held) or done):
+                self._emotion, self.source = m.group(1).lower(), 'tag'
+                self._held = held[m.end():]
+                return
+            if not done and (m or _PARTIAL_TAG.fullmatch(held)):
+                return
+            self._tagless = True
+        if final or len(_WORD.findall(held.lower())) >= self.commit_words:
+            scores = lexicon_scores(held, self.commit_words)
+            best = max(EMOTIONS, key=lambda e: scores[e])
+            if scores[best] > 0:
+                self._emotion, self.source = best, 'lexicon'
+            else:
+                self._emotion, self.source = self.default, 'default'
+
+    def emotion(self) -> str:
+        """The emotion, reading chunks from the stream until it is decided."""
+        while self._emotion is None:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._decide(final=True)
+                break
+            self.raw += chunk
+            self._held += chunk
+            self._decide(final=False)
+        return self._emotion
+
+    def __iter__(self) -> Iterator[str]:
+        self.emotion()
+        if self._held:
+            held, self._held = self._held, ''
+            yield held
+        for chunk in self._chunks:
+            self.raw += chunk
+            if chunk:
+                yield chunk
+
+
+def split_emotion(text: str, default: str = DEFAULT_EMOTION) -> Tuple[str, str]:
+    """(emotion, reply without the tag) for a complete reply."""
+    stream = EmotionStream([text], default=default)
+    emotion = stream.emotion()
+    return emotion, ''.join(stream)
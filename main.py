@@ -3,44 +3,49 @@
 # ideally this script allows for a connection to be made from custom ollama model to the ralsei cli tool
 
 from chatbox import ChatboxRenderer
+from emotion import EmotionStream, split_emotion
+from ollama_client import OllamaError, get_default_client
+import os
 import subprocess
 from time import sleep
 
-# takes in string prompt, converts it to usable list, and sends it as command to save output
+# "http" talks to the ollama server over one kept-alive connection, "cli" spawns `ollama run` per prompt
+BACKEND = os.environ.get("RALSEI_OLLAMA_BACKEND", "http")
+
+# takes in string prompt and sends it as command to save output
 def stringToCmd(command):
-	command = "ollama run ralseiModel '" + command + "'"
-	cmd = command.split()
+	if BACKEND == "http":
+		return get_default_client().generate(command)
+	# pass the prompt as a single argument so quotes and spaces survive
+	cmd = ["ollama", "run", os.environ.get("RALSEI_OLLAMA_MODEL", "ralseiModel"), command]
 	res = subprocess.run(cmd, capture_output=True, text=True)
 	return res.stdout
 
-# finds the earliest occurence of one of the emotions and returns that emotion value
+# splits the leading emotion tag off a finished response (lexicon guess if the model left it out, see emotion.py)
 def grabEmotion(response):
-	emotions = ["happy", "sad", "surprised", "mad"]
-	minIndex = len(response)      # start with a big index
-	foundEmotion = None
-
-	for i in emotions:
-		idx = response.find(i)
-		if idx != -1 and idx < minIndex:
-			minIndex = idx
-			foundEmotion = i
-
-	# removes the emotion text, doesnt need to be there, cringe enough as it is
-	response = response[4 + len(foundEmotion):]
-
-	# i could init it as some emotion already, but idk, i feel like this is better
-	# especially if i decide to change it later
-	if (foundEmotion is None):
-		foundEmotion = "happy"
+	emotion, response = split_emotion(response)
 
 	# returning as list because both response and emotion are needed as inputs or the chatbox
-	return [response, foundEmotion]
+	return [response, emotion]
 
 ralsei = ChatboxRenderer()
 
+if BACKEND == "http":
+	# load the model now so the first prompt doesn't pay for it
+	try:
+		get_default_client().warm()
+	except (OSError, OllamaError) as e:
+		print("couldn't warm up ollama: " + str(e))
+
 while True:
 	command = input("enter phrase >> ")
-	prompt = grabEmotion(stringToCmd(command))
-
-	ralsei.display(prompt[0], prompt[1])
-	print("emotion >> " + prompt[1])
+	if BACKEND == "http":
+		# the emotion is known a few tokens in, so the art is drawn while the rest streams
+		reply = EmotionStream(get_default_client().stream(command))
+		emotion = reply.emotion()
+		ralsei.display_stream(reply, emotion)
+	else:
+		prompt = grabEmotion(stringToCmd(command))
+		emotion = prompt[1]
+		ralsei.display(prompt[0], emotion)
+	print("emotion >> " + emotion)
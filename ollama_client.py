@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+ollama_client.py
+
+Minimal client for the local Ollama HTTP API (standard library only).
+
+Keeps one persistent keep-alive connection per client instead of spawning an
+`ollama run` process per prompt, streams the NDJSON tokens of /api/generate as
+they arrive, and passes `keep_alive` so the model stays loaded between turns.
+
+Configuration (environment):
+ - OLLAMA_HOST: server address, default http://127.0.0.1:11434
+ - RALSEI_OLLAMA_MODEL: model name, default ralseiModel
+ - RALSEI_OLLAMA_KEEP_ALIVE: how long Ollama keeps the model loaded, default 30m
+
+Functions:
+ - OllamaClient.stream(prompt): yields response text chunks
+ - OllamaClient.generate(prompt): returns the full response
+ - OllamaClient.warm(): loads the model without generating
+"""
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+import http.client
+import json
+import os
+import threading
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+class OllamaClient:
+    def __init__(self, model: Optional[str] = None, host: Optional[str] = None,
+                 keep_alive: Optional[str] = None, timeout: float = 300.0):
+        self.model = model or os.environ.get('RALSEI_OLLAMA_MODEL', 'ralseiModel')
+        host = host or os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')
+        if '://' not in host:
+            host = 'http://' + host
+        parsed = urlparse(host)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 11434
+        self.keep_alive = keep_alive or os.environ.get('RALSEI_OLLAMA_KEEP_ALIVE', '30m')
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+        # final message of the last response (eval_count, durations, ...), without the text
+        self.last_stats: dict = {}
+        # one request at a time on the shared connection
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request(self, path: str, payload: dict) -> http.client.HTTPResponse:
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed an idle keep-alive connection: reconnect once
+                self.close()
+                if attempt:
+                    raise
+                continue
+            except OSError:
+                self.close()
+                raise
+            if resp.status != 200:
+                detail = resp.read().decode('utf-8', 'replace')
+                if resp.will_close:
+                    self.close()
+                raise OllamaError(f'{path} returned HTTP {resp.status}: {detail}')
+            return resp
+        raise OllamaError('unreachable')
+
+    def _payload(self, prompt: str, system: Optional[str], options: Optional[dict], stream: bool) -> dict:
+        payload = {'model': self.model, 'prompt': prompt, 'stream': stream, 'keep_alive': self.keep_alive}
+        if system is not None:
+            payload['system'] = system
+        if options:
+            payload['options'] = options
+        return payload
+
+    def stream(self, prompt: str, system: Optional[str] = None, options: Optional[dict] = None) -> Iterator[str]:
+        """Yield response text chunks as Ollama produces them."""
+        with self._lock:
+            self.last_stats = {}
+            resp = self._request('/api/generate', self._payload(prompt, system, options, True))
+            done = False
+            try:
+                while True:
+                    line = resp.readline()
+                    if not line:
+                        break
+                    line = line.strip()
+                    if not line:
+                        continue
+                    msg = json.loads(line)
+                    if 'error' in msg:
+                        raise OllamaError(msg['error'])
+                    if msg.get('response'):
+                        yield msg['response']
+                    if msg.get('done'):
+                        msg.pop('response', None)
+                        self.last_stats = msg
+                        done = True
+                        break
+                if not done:
+                    raise OllamaError('stream ended before the response was done')
+                # drain the chunked terminator so the connection can be reused
+                resp.read()
+            finally:
+                if not done or resp.will_close:
+                    # abandoned or broken stream: the connection is not reusable
+                    self.close()
+
+    def generate(self, prompt: str, system: Optional[str] = None, options: Optional[dict] = None) -> str:
+        return ''.join(self.stream(prompt, system=system, options=options))
+
+    def warm(self):
+        """Ask Ollama to load the model (a request without a prompt only loads it)."""
+        with self._lock:
+            resp = self._request('/api/generate', {'model': self.model, 'keep_alive': self.keep_alive, 'stream': False})
+            resp.read()
+            if resp.will_close:
+                self.close()
+
+
+_default = None
+
+
+def get_default_client() -> OllamaClient:
+    global _default
+    if _default is None:
+        _default = OllamaClient()
+    return _default
+
+
+if __name__ == '__main__':
+    client = get_default_client()
+    p = input('prompt> ')
+    for chunk in client.stream(p):
+        print(chunk, end='', flush=True)
+    print()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+ollama_stub.py
+
+Offline stand-in for the parts of the Ollama HTTP API that ollama_client.py
+uses, so the HTTP backend can be exercised without Ollama or a model.
+
+ - POST /api/generate: streams a canned Ralsei reply as NDJSON over chunked
+   HTTP/1.1 (or one JSON object when "stream" is false); a request without a
+   prompt just "loads" the model, like the real server
+ - GET /api/tags: lists the stub model
+
+Usage:
+    python ollama_stub.py [port]          # default 11434
+    OLLAMA_HOST=127.0.0.1:<port> python main.py
+
+In code, serve(port=0) starts it on a free port in a background thread.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import sys
+import threading
+import time
+
+
+def canned_reply(prompt: str) -> str:
+    """Reply in the Modelfile format: a leading emotion, then the answer."""
+    lowered = prompt.lower()
+    emotion = 'happy'
+    if any(w in lowered for w in ('sad', 'sorry', 'lonely', 'goodbye')):
+        emotion = 'sad'
+    elif any(w in lowered for w in ('angry', 'mad', 'hate')):
+        emotion = 'mad'
+    elif '?' in prompt:
+        emotion = 'surprised'
+    head = ' '.join(prompt.split()[:12])
+    return f"{emotion} Oh! You said: \"{head}\". I'm Ralsei, and I'm happy to help you, Kris!"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # simulated per-token delay, seconds
+    token_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': 'ralseiModel:latest'}]})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json({'error': 'invalid JSON'}, status=400)
+            return
+        if self.path != '/api/generate':
+            self._send_json({'error': 'not found'}, status=404)
+            return
+
+        model = req.get('model', 'ralseiModel')
+        prompt = req.get('prompt')
+        if not prompt:
+            self._send_json({'model': model, 'response': '', 'done': True, 'done_reason': 'load'})
+            return
+
+        tokens = re.findall(r'\S+\s*', canned_reply(prompt))
+        limit = (req.get('options') or {}).get('num_predict')
+        if isinstance(limit, int) and limit > 0:
+            tokens = tokens[:limit]
+
+        if req.get('stream', True) is False:
+            self._send_json({'model': model, 'response': ''.join(tokens), 'done': True, 'eval_count': len(tokens)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for tok in tokens:
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+                self._write_chunk(json.dumps({'model': model, 'response': tok, 'done': False}).encode('utf-8') + b'\n')
+            self._write_chunk(json.dumps({'model': model, 'response': '', 'done': True, 'eval_count': len(tokens)}).encode('utf-8') + b'\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # client stopped reading mid-stream
+            self.close_connection = True
+
+
+def serve(host: str = '127.0.0.1', port: int = 0, token_delay: float = 0.0):
+    """Start the stub in a daemon thread; returns the server (see server.server_address)."""
+    handler = type('Handler', (_Handler,), {'token_delay': token_delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='ollama-stub', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 11434
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    print(f'ollama stub listening on http://127.0.0.1:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
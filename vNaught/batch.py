@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+batch.py
+
+Headless batch mode: answers a file of questions with the same retrieval,
+prompt packing and generation as the chat, and writes one JSON line per
+question. Nothing is rendered: no chatbox, typing animation or screen clearing.
+
+Input (a file, or stdin with "-" or no argument): one question per line,
+either plain text or a JSON object with "query" (or "question" / "message")
+and an optional "id" (default: the line number). Blank lines are skipped.
+
+Each output line has:
+ - id and query
+ - reply: with the emotion tag removed
+ - emotion and emotion_source: see emotion.py
+ - passages: those put in the prompt, with index, score and text
+ - prompt_tokens and cached
+ - timings_ms per stage: retrieve, cache, queue, build_prompt, generate, total
+ - error: only for a failed question
+
+Results are written in input order as soon as they are ready, or in
+completion order with --unordered.
+
+Retrieval runs on --workers threads. Prompt building and generation go
+through the server's BatchScheduler: up to --batch-size waiting questions are
+answered by one padded generate_batch call. A batch can only hold questions
+that are in flight, so keep --workers at least --batch-size. The Ollama and
+fallback backends answer one at a time. At most two questions per worker are read ahead, so
+memory stays flat however long the input is. Loading messages and a final
+summary go to stderr.
+
+Usage:
+    python batch.py questions.jsonl -o answers.jsonl [--workers 8] [--batch-size 8] [--max-tokens 256]
+    cat questions.txt | python main.py --batch > answers.jsonl
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional, TextIO
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+from emotion import EmotionStream
+from main import (MAX_NEW_TOKENS, build_response_cache, load_llm, load_retriever, load_searcher,
+                  pack_rag_prompt, retrieve_contexts)
+from server import FALLBACK_REPLY, BatchScheduler
+from tracing import get_tracer
+
+QUERY_KEYS = ('query', 'question', 'message')
+
+
+def parse_line(line: str, line_no: int) -> Optional[dict]:
+    """{'id', 'query'} for one input line ('error' instead of 'query' if unusable); None if blank."""
+    text = line.strip()
+    if not text:
+        return None
+    if not text.startswith('{'):
+        return {'id': line_no, 'query': text}
+    try:
+        obj = json.loads(text)
+    except ValueError as e:
+        return {'id': line_no, 'error': f'invalid JSON: {e}'}
+    record = {'id': obj.get('id', line_no)}
+    query = next((obj[k] for k in QUERY_KEYS if isinstance(obj.get(k), str) and obj[k].strip()), None)
+    if query is None:
+        record['error'] = 'expected a non-empty "query", "question" or "message"'
+    else:
+        record['query'] = query
+    return record
+
+
+def read_records(lines: Iterable[str]) -> Iterator[dict]:
+    for n, line in enumerate(lines, 1):
+        record = parse_line(line, n)
+        if record is not None:
+            yield record
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 1)
+
+
+class BatchRunner:
+    """Loaded components plus the generation scheduler; answer() is thread-safe."""
+
+    def __init__(self, retriever, searcher, llm, cache=None, max_batch: int = 8, batch_wait: float = 0.02,
+                 max_queue: int = 64, max_tokens: int = MAX_NEW_TOKENS, timeout: float = 600.0):
+        self.retriever = retriever
+        self.searcher = searcher
+        self.llm = llm
+        self.cache = cache
+        self.timeout = timeout
+        self.scheduler = (BatchScheduler(llm, max_batch=max_batch, batch_wait=batch_wait, max_queue=max_queue,
+                                         max_tokens=max_tokens) if llm is not None else None)
+
+    def answer(self, record: dict) -> dict:
+        if 'error' in record:
+            return record
+        result = dict(record)
+        try:
+            with get_tracer().turn(kind='batch_query', query_chars=len(record['query'])):
+                self._answer(record['query'], result)
+        except Exception as e:
+            result['error'] = f'[RAG error] {e}'
+        return result
+
+    def _answer(self, query: str, result: dict):
+        start = time.perf_counter()
+        result['prompt_tokens'] = None
+        timings = result['timings_ms'] = {}
+        if self.retriever is None or self.scheduler is None:
+            reply, contexts, cached = FALLBACK_REPLY, [], False
+        else:
+            contexts = retrieve_contexts(query, self.retriever, self.searcher)
+            timings['retrieve'] = _ms(time.perf_counter() - start)
+            passage_ids = [c[0] for c in contexts]
+            reply = None
+            if self.cache is not None:
+                t = time.perf_counter()
+                reply = self.cache.get(query, passage_ids)
+                timings['cache'] = _ms(time.perf_counter() - t)
+            cached = reply is not None
+            if not cached:
+                packed = {}
+
+                def prepare() -> str:
+                    # runs on the scheduler thread
+                    packed['start'] = time.perf_counter()
+                    prompt, packed['contexts'], report = pack_rag_prompt(query, contexts, self.llm)
+                    result['prompt_tokens'] = report['prompt_tokens']
+                    packed['end'] = time.perf_counter()
+                    return prompt
+
+                submitted = time.perf_counter()
+                reply = self.scheduler.submit(prepare, time.monotonic() + self.timeout).wait()
+                done = time.perf_counter()
+                contexts = packed['contexts']
+                timings.update(queue=_ms(packed['start'] - submitted),
+                               build_prompt=_ms(packed['end'] - packed['start']),
+                               generate=_ms(done - packed['end']))
+                if self.cache is not None and not self.llm.is_fallback:
+                    # cached with its emotion tag, like the chat does
+                    self.cache.put(query, passage_ids, reply)
+        stream = EmotionStream([reply])
+        result['emotion'] = stream.emotion()
+        result['emotion_source'] = stream.source
+        result['reply'] = ''.join(stream)
+        result['passages'] = [{'index': c[0], 'score': c[1], 'text': c[2]} for c in contexts]
+        result['cached'] = cached
+        timings['total'] = _ms(time.perf_counter() - start)
+
+
+def run(runner: BatchRunner, records: Iterable[dict], out: TextIO, workers: int = 8,
+        ordered: bool = True) -> dict:
+    """Answer `records` on `workers` threads, writing each result as a JSON line; returns counts."""
+    counts = {'queries': 0, 'errors': 0, 'cached': 0}
+    window = max(1, workers) * 2
+
+    def write(result: dict):
+        counts['queries'] += 1
+        counts['errors'] += 'error' in result
+        counts['cached'] += bool(result.get('cached'))
+        out.write(json.dumps(result, ensure_ascii=False) + '\n')
+        out.flush()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='batch') as pool:
+        pending: deque = deque()
+
+        def drain(limit: int):
+            while len(pending) > limit:
+                if ordered:
+                    write(pending.popleft().result())
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in [f for f in pending if f in done]:
+                    pending.remove(fut)
+                    write(fut.result())
+
+        for record in records:
+            if 'error' in record:
+                fut = Future()
+                fut.set_result(record)
+            else:
+                fut = pool.submit(runner.answer, record)
+            pending.append(fut)
+            drain(window - 1)
+        drain(0)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Answer questions from a file or stdin, one JSON line each.')
+    parser.add_argument('--batch', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('input', nargs='?', default='-', help='questions, plain text or JSONL ("-": stdin)')
+    parser.add_argument('-o', '--output', default='-', help='JSONL results ("-": stdout)')
+    parser.add_argument('--workers', type=int, default=8, help='questions in flight (retrieving or waiting to generate)')
+    parser.add_argument('--batch-size', type=int, default=8, help='most prompts per generate_batch call')
+    parser.add_argument('--batch-wait-ms', type=float, default=20.0, help='wait for a generation batch to fill')
+    parser.add_argument('--max-tokens', type=int, default=MAX_NEW_TOKENS, help='new tokens per reply')
+    parser.add_argument('--timeout', type=float, default=600.0, help='seconds per question before it fails')
+    parser.add_argument('--no-cache', action='store_true', help='always generate, never reuse an answer')
+    parser.add_argument('--unordered', action='store_true', help='write results as they finish')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    src = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    # stdout carries the results: send loading messages and warnings to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        with get_tracer().turn(kind='startup'):
+            retriever = load_retriever()
+            searcher = load_searcher(retriever)
+            llm = load_llm()
+        runner = BatchRunner(retriever, searcher, llm,
+                             cache=None if args.no_cache else build_response_cache(searcher),
+                             max_batch=args.batch_size, batch_wait=args.batch_wait_ms / 1000.0,
+                             max_queue=max(1, args.workers) + 1, max_tokens=args.max_tokens,
+                             timeout=args.timeout)
+        loaded = time.perf_counter()
+        try:
+            counts = run(runner, read_records(src), out, args.workers, ordered=not args.unordered)
+        finally:
+            if src is not sys.stdin:
+                src.close()
+            if out is not sys.stdout:
+                out.close()
+    elapsed = time.perf_counter() - loaded
+    rate = counts['queries'] / elapsed if elapsed > 0 else 0.0
+    stats = runner.scheduler.stats() if runner.scheduler is not None else {}
+    print(f"{counts['queries']} questions ({counts['errors']} errors, {counts['cached']} cached) in "
+          f"{elapsed:.1f}s, {rate:.2f}/s after {loaded - start:.1f}s loading; "
+          f"{stats.get('batches', 0)} generation batches, mean size {stats.get('mean_batch', 0.0)}",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+context_packer.py
+
+Fit retrieved passages into a prompt token budget.
+
+Passages are taken best score first. A passage that does not fit whole is
+cut back to its leading sentences; one that cannot keep even
+`min_passage_tokens` is skipped (a shorter, lower-ranked one may still fit).
+The question is always kept: when the budget cannot even hold the prompt
+without passages, the prompt goes out with no passages rather than without
+the question.
+
+Token counts come from the caller's `count_tokens` (the LLM tokenizer, see
+LLM.count_tokens). The budget defaults to RALSEI_PROMPT_BUDGET (384 tokens).
+
+API:
+ - pack_contexts(question, contexts, build_prompt, count_tokens, budget=None)
+   -> (packed contexts, report)
+"""
+from typing import Callable, List, Optional, Sequence, Tuple
+import os
+import re
+
+DEFAULT_BUDGET = 384
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def default_budget() -> int:
+    return int(os.environ.get('RALSEI_PROMPT_BUDGET', str(DEFAULT_BUDGET)))
+
+
+def _trim_to_sentences(passage: str, budget: int, count_tokens: Callable[[str], int]) -> Optional[str]:
+    """Longest run of leading sentences within `budget` tokens, or None."""
+    kept = []
+    used = 0
+    for sentence in _SENTENCE_END.split(passage):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        cost = count_tokens(' ' + sentence)
+        if used + cost > budget:
+            break
+        kept.append(sentence)
+        used += cost
+    return ' '.join(kept) if kept else None
+
+
+def pack_contexts(question: str, contexts: Sequence[Tuple[int, float, str]],
+                  build_prompt: Callable[[str, list], str], count_tokens: Callable[[str], int],
+                  budget: Optional[int] = None, separator: str = '\n\n---\n',
+                  min_passage_tokens: int = 24) -> Tuple[List[Tuple[int, float, str]], dict]:
+    """Contexts (index, score, passage) that fit `budget` prompt tokens, best first.
+
+    Returns (packed, report); report has the budget, the tokens of the prompt
+    without passages, the final prompt tokens and one entry per passage.
+    """
+    budget = default_budget() if budget is None else budget
+    base = count_tokens(build_prompt(question, []))
+    remaining = budget - base
+    packed: List[Tuple[int, float, str]] = []
+    entries = []
+
+    for idx, score, passage in sorted(contexts, key=lambda c: -c[1]):
+        sep_cost = count_tokens(separator) if packed else 0
+        cost = sep_cost + count_tokens(passage)
+        if cost <= remaining:
+            packed.append((idx, score, passage))
+            entries.append({'index': idx, 'tokens': cost, 'trimmed': False})
+            remaining -= cost
+            continue
+        room = remaining - sep_cost
+        trimmed = _trim_to_sentences(passage, room, count_tokens) if room >= min_passage_tokens else None
+        if trimmed is None:
+            entries.append({'index': idx, 'tokens': 0, 'trimmed': True})
+            continue
+        cost = sep_cost + count_tokens(trimmed)
+        packed.append((idx, score, trimmed))
+        entries.append({'index': idx, 'tokens': cost, 'trimmed': True})
+        remaining -= cost
+
+    # segment counts can be off by a token or two at the joins: check the real prompt
+    total = count_tokens(build_prompt(question, packed))
+    while total > budget and packed:
+        idx, score, passage = packed[-1]
+        shorter = _trim_to_sentences(passage, count_tokens(passage) - (total - budget), count_tokens)
+        if shorter is None or shorter == passage:
+            packed.pop()
+        else:
+            packed[-1] = (idx, score, shorter)
+        total = count_tokens(build_prompt(question, packed))
+
+    report = {
+        'budget': budget,
+        'base_tokens': base,
+        'prompt_tokens': total,
+        'passages_in': len(contexts),
+        'passages_used': len(packed),
+        'passages_trimmed': sum(1 for e in entries if e['trimmed'] and e['tokens']),
+        'passages': entries,
+    }
+    return packed, report
@@ -6,11 +6,55 @@ Small wrapper for local, free LLM usage. Tries to import HuggingFace's
 transformers and use a small CPU-friendly model if available. If not,
 falls back to a deterministic template-based responder for offline use.
 
+Set RALSEI_LLM_BACKEND=ollama to generate with a local Ollama server instead
+(see ollama_client.py; RALSEI_LLM_MODEL then names the Ollama model), or
+RALSEI_LLM_BACKEND=fallback to skip model loading and use the template responder.
+
+Prefix caching (transformers backend): callers may pass `prefixes`, prompt
+prefixes from shortest to longest (e.g. the fixed RAG instructions, then the
+instructions plus the first passage). Their past_key_values are computed once
+and reused, so only the rest of the prompt is encoded on each turn. The first
+prefix is always cached; longer ones once they have been seen
+RALSEI_PREFIX_MIN_HITS times (default 2). RALSEI_PREFIX_CACHE bounds the
+number of cached prefixes (LRU, default 8; 0 disables). Ollama keeps its own
+cache of the last prompt prefix while the model stays loaded, so the Ollama
+path ignores `prefixes`.
+
+Quantized CPU inference (transformers backend): RALSEI_LLM_QUANTIZE=int8 runs
+the linear layers with dynamic int8 quantization (GPT-2 Conv1D layers are
+converted to nn.Linear first), RALSEI_LLM_QUANTIZE=bf16 casts the model to
+bfloat16 on CPUs with native bf16. Either falls back to fp32 automatically
+(see LLM._quantize); `LLM.quantization` records what is running.
+scripts/quantize_benchmark.py compares load time, memory and tokens/sec.
+
+Speculative decoding (transformers backend): RALSEI_LLM_DRAFT_MODEL names a
+small model sharing the main model's tokenizer (e.g. distilgpt2 for gpt2).
+For greedy decoding (RALSEI_GEN_TEMPERATURE=0, no repetition penalty) the
+draft proposes RALSEI_LLM_DRAFT_TOKENS tokens (default 4) and the main model
+checks them all in one forward pass, keeping the longest prefix it agrees
+with plus its own next token, so the output is the main model's greedy
+output. Sampling, repetition penalties and generate_batch decode normally.
+`LLM.speculative_stats()` reports the draft acceptance rate.
+
 Functions:
- - generate(prompt, max_tokens=256): returns generated string
+ - generate(prompt, max_tokens=256, prefixes=None): returns generated string
+ - stream(prompt, max_tokens=256, stop_event=None, prefixes=None): yields text chunks as they are generated
+ - generate_batch(prompts, max_tokens=256, stop_event=None): one padded batch, one reply per prompt
+ - count_tokens(text), prompt_budget(budget, max_tokens=256): for fitting prompts to
+   the model (see context_packer.py)
+ - speculative_stats(): draft tokens proposed / accepted since the model was loaded
+ - is_fallback: True when replies come from the template responder
+ - model_namespace(): '<backend>:<model>' the replies of the configured LLM
+   come from, known without loading it (keys the response cache)
 """
-from typing import Optional
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Sequence, Tuple
+import copy
 import os
+import re
+import threading
+import time
+import warnings
 
 # Force CPU-only to avoid CUDA initialization warnings in environments
 # where CUDA isn't set up correctly. Set this before importing transformers/torch.
@@ -19,18 +63,217 @@ os.environ.setdefault('TORCH_CPP_MIN_LOG_LEVEL', '2')
 os.environ.setdefault('TRANSFORMERS_VERBOSITY', 'error')
 os.environ.setdefault('HF_HUB_DISABLE_TELEMETRY', '1')
 
+# transformers (and torch) are imported on first use by _load_transformers, so
+# importing this module is cheap and the cost lands in the thread that builds the LLM
+pipeline = None
+TextIteratorStreamer = None
+StoppingCriteriaList = None
+_StopOnEvent = None
+_TextCollector = None
+
+
+def _load_transformers() -> bool:
+    global pipeline, TextIteratorStreamer, StoppingCriteriaList, _StopOnEvent, _TextCollector
+    if pipeline is not None:
+        return True
+    try:
+        from transformers import pipeline as make_pipeline, TextIteratorStreamer as streamer_class
+        from transformers import StoppingCriteria, StoppingCriteriaList as criteria_list, TextStreamer
+    except Exception:
+        return False
+
+    class StopOnEvent(StoppingCriteria):
+        """Stops generate() at the next token once the event is set."""
+
+        def __init__(self, event: threading.Event):
+            self.event = event
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return input_ids.new_full((input_ids.shape[0],), self.event.is_set(), dtype=bool)
+
+    class TextCollector(TextStreamer):
+        """Detokenizes token ids fed by hand the way TextIteratorStreamer does,
+        collecting the finished text chunks for drain()."""
+
+        def __init__(self, tokenizer, **decode_kwargs):
+            super().__init__(tokenizer, **decode_kwargs)
+            self.chunks: List[str] = []
+
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            if text:
+                self.chunks.append(text)
+
+        def drain(self) -> List[str]:
+            chunks, self.chunks = self.chunks, []
+            return chunks
+
+    TextIteratorStreamer = streamer_class
+    StoppingCriteriaList = criteria_list
+    _StopOnEvent = StopOnEvent
+    _TextCollector = TextCollector
+    pipeline = make_pipeline
+    return True
+
 try:
-    from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer
+    from ollama_client import OllamaClient
 except Exception:
-    pipeline = None
+    OllamaClient = None
+
+
+class PrefixCache:
+    """LRU of past_key_values keyed by the token ids of a prompt prefix.
+
+    Stored caches are never handed out directly: callers get a copy, since
+    generate() appends to the cache it is given.
+    """
+
+    def __init__(self, max_entries: int = 8, min_hits: int = 2):
+        self.max_entries = max_entries
+        self.min_hits = min_hits
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Tuple[int, ...], object]' = OrderedDict()
+        self._seen: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[int, ...]):
+        with self._lock:
+            kv = self._entries.get(key)
+            if kv is not None:
+                self._entries.move_to_end(key)
+            return kv
+
+    def put(self, key: Tuple[int, ...], kv):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = kv
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def seen(self, key: Tuple[int, ...]) -> int:
+        """Count one more use of the prefix; returns the count so far."""
+        with self._lock:
+            if len(self._seen) > 4096:
+                self._seen.clear()
+            n = self._seen[key] = self._seen.get(key, 0) + 1
+            return n
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# prompt used to check a quantized model against the fp32 one
+QUANT_PROBE = ("Ralsei is a prince from the Dark World. He travels with Kris and Susie, "
+               "and he hopes to restore balance to the Light and the Dark.")
+
+
+def _cpu_has_bf16() -> bool:
+    """Native bf16 matmuls (AVX512-BF16 or AMX); elsewhere bf16 is emulated and slower than fp32."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def _release_memory():
+    """Hand the freed fp32 weights back to the OS (glibc keeps freed heap pages otherwise)."""
+    import ctypes
+    import gc
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _conv1d_to_linear(model):
+    """Replace transformers' Conv1D (GPT-2 style, weight stored as (in, out)) with
+    the equivalent nn.Linear, which dynamic quantization knows how to handle."""
+    import torch
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        return
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                n_in, n_out = child.weight.shape
+                linear = torch.nn.Linear(n_in, n_out)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, name, linear)
+
+
+def _quantize_model(model, mode: str):
+    """Quantize `model` in place (no second copy of the weights); returns it."""
+    import torch
+
+    if mode == 'int8':
+        from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+        _conv1d_to_linear(model)
+        # the output projection stays fp32: it decides every token, and is often tied to the embeddings
+        output = model.get_output_embeddings()
+        spec = {name: default_dynamic_qconfig for name, m in model.named_modules()
+                if isinstance(m, torch.nn.Linear) and m is not output}
+        if not spec:
+            raise RuntimeError('no linear layers to quantize')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # torch deprecation notices for the quantized tensor API
+            return quantize_dynamic(model, spec, dtype=torch.qint8, inplace=True)
+    if mode == 'bf16':
+        if not _cpu_has_bf16():
+            raise RuntimeError('this CPU has no native bf16 support')
+        return model.to(torch.bfloat16)
+    raise ValueError(f'unknown RALSEI_LLM_QUANTIZE mode {mode!r} (expected int8 or bf16)')
+
+
+def model_namespace(backend: Optional[str] = None, model_name: Optional[str] = None) -> Optional[str]:
+    """'<backend>:<model>' for the LLM the environment configures; None for the fallback backend."""
+    backend = backend or os.environ.get('RALSEI_LLM_BACKEND', 'transformers')
+    model_name = model_name or os.environ.get('RALSEI_LLM_MODEL')
+    if backend == 'fallback':
+        return None
+    if backend == 'ollama':
+        return f"ollama:{model_name or os.environ.get('RALSEI_OLLAMA_MODEL', 'ralseiModel')}"
+    # quantization changes the replies, speculative decoding does not
+    mode = os.environ.get('RALSEI_LLM_QUANTIZE', '').strip().lower()
+    suffix = f'@{mode}' if mode and mode not in ('fp32', 'none', 'off') else ''
+    return f"{backend}:{model_name or 'gpt2'}{suffix}"
 
 
 class LLM:
-    def __init__(self, model_name: Optional[str] = None):
+    def __init__(self, model_name: Optional[str] = None, backend: Optional[str] = None):
         self.model_name = model_name or os.environ.get('RALSEI_LLM_MODEL')
+        self.backend = backend or os.environ.get('RALSEI_LLM_BACKEND', 'transformers')
         self.generator = None
-        if pipeline is not None:
+        self.client = None
+        # how the transformers model runs: mode (fp32 / int8 / bf16), load seconds,
+        # and the fallback reason if the requested quantization was refused
+        self.quantization = {'mode': 'fp32'}
+        # token counts of the last generate/stream call: prompt_tokens, completion_tokens
+        # (and cached_tokens: prompt tokens served from the prefix cache)
+        self.last_usage = {}
+        self.prefix_cache = PrefixCache(int(os.environ.get('RALSEI_PREFIX_CACHE', '8')),
+                                        int(os.environ.get('RALSEI_PREFIX_MIN_HITS', '2')))
+        # speculative decoding: the draft model (None when off) and its running totals
+        self.draft_model = None
+        self.draft_tokens = max(1, int(os.environ.get('RALSEI_LLM_DRAFT_TOKENS', '4')))
+        self.speculative = {'steps': 0, 'drafted': 0, 'accepted': 0}
+        self._speculative_lock = threading.Lock()
+        if self.backend == 'ollama':
+            if OllamaClient is None:
+                raise ImportError("ollama_client.py not found; run from the repo root or add it to PYTHONPATH")
+            self.client = OllamaClient(model=self.model_name)
+        elif self.backend != 'fallback' and _load_transformers():
             try:
+                start = time.perf_counter()
                 # use a small model by default if nothing specified
                 model = self.model_name or 'gpt2'
                 # instantiate a text-generation pipeline
@@ -38,58 +281,464 @@ class LLM:
                 # newer transformers support device_map and device, but device=-1
                 # is the most compatible CPU setting for pipeline
                 self.generator = pipeline('text-generation', model=model, device=-1)
+                # if a prompt is ever too long, cut its start rather than the question at its end
+                self.generator.tokenizer.truncation_side = 'left'
+                mode = os.environ.get('RALSEI_LLM_QUANTIZE', '').strip().lower()
+                if mode and mode not in ('fp32', 'none', 'off'):
+                    self._quantize(mode)
+                self.quantization['load_seconds'] = round(time.perf_counter() - start, 3)
             except Exception:
                 self.generator = None
+            draft = os.environ.get('RALSEI_LLM_DRAFT_MODEL', '').strip()
+            if draft and self.generator is not None:
+                self._load_draft(draft)
+
+    def _quantize(self, mode: str):
+        """Quantize the pipeline's model to int8 / bf16 in place. If that fails,
+        or the quantized model's next-token predictions on QUANT_PROBE agree
+        with fp32 less than RALSEI_LLM_QUANTIZE_MIN_AGREEMENT (default 0.9) of
+        the time, the fp32 model is loaded again."""
+        import torch
+
+        min_agreement = float(os.environ.get('RALSEI_LLM_QUANTIZE_MIN_AGREEMENT', '0.9'))
+        try:
+            probe = self.generator.tokenizer(QUANT_PROBE, return_tensors='pt')['input_ids']
+            with torch.no_grad():
+                reference = self.generator.model(probe).logits.argmax(-1)
+                self.generator.model = _quantize_model(self.generator.model, mode)
+                logits = self.generator.model(probe).logits.float()
+            if not torch.isfinite(logits).all():
+                raise RuntimeError('non-finite logits')
+            agreement = (logits.argmax(-1) == reference).float().mean().item()
+            if agreement < min_agreement:
+                raise RuntimeError(f'top-1 agreement with fp32 is {agreement:.2f} (< {min_agreement})')
+        except Exception as e:
+            print(f'Warning: {mode} quantization not used, running fp32: {e}')
+            self.quantization = {'mode': 'fp32', 'requested': mode, 'fallback': str(e)}
+            truncation_side = self.generator.tokenizer.truncation_side
+            self.generator = pipeline('text-generation', model=self.model_name or 'gpt2', device=-1)
+            self.generator.tokenizer.truncation_side = truncation_side
+            return
+        self.quantization = {'mode': mode, 'agreement': round(agreement, 3)}
+        # the fp32 weights are gone: hand their pages back to the OS
+        _release_memory()
 
-    def generate(self, prompt: str, max_tokens: int = 256) -> str:
-        # Accept generation options via kwargs
-        def _fallback():
-            head = prompt.strip()[:100].replace('\n', ' ')
-            return f"[Fallback LLM] I read: '{head}...'\nHere's a short answer based on the retrieved context."
+    def _load_draft(self, name: str):
+        """Load the draft model for speculative decoding. It must use the main
+        model's tokenizer (same vocabulary); otherwise, or if it fails to load,
+        speculative decoding stays off."""
+        self.speculative['draft_model'] = name
+        try:
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            if AutoTokenizer.from_pretrained(name).get_vocab() != self.generator.tokenizer.get_vocab():
+                raise RuntimeError("its tokenizer differs from the main model's")
+            draft = AutoModelForCausalLM.from_pretrained(name)
+            if draft.config.vocab_size != self.generator.model.config.vocab_size:
+                raise RuntimeError(f'its vocab_size {draft.config.vocab_size} differs from the main model\'s '
+                                   f'{self.generator.model.config.vocab_size}')
+            draft.eval()
+        except Exception as e:
+            print(f'Warning: draft model {name} not used, speculative decoding off: {e}')
+            self.speculative['fallback'] = str(e)
+            return
+        self.draft_model = draft
+
+    def speculative_stats(self) -> dict:
+        """Speculative decoding totals: verification steps (main model passes),
+        draft tokens proposed and accepted, acceptance rate, and tokens produced
+        per main model pass (1.0 is plain decoding)."""
+        with self._speculative_lock:
+            stats = dict(self.speculative, enabled=self.draft_model is not None, draft_tokens=self.draft_tokens)
+        stats['acceptance_rate'] = round(stats['accepted'] / stats['drafted'], 3) if stats['drafted'] else None
+        # each step emits the accepted drafts plus the main model's own token
+        stats['tokens_per_step'] = (round((stats['accepted'] + stats['steps']) / stats['steps'], 2)
+                                    if stats['steps'] else None)
+        return stats
+
+    def _use_draft(self, sampling: dict, prompt_tokens: int, max_tokens: int) -> bool:
+        """Whether speculative decoding gives the same text as plain decoding here:
+        greedy, no repetition penalty, and the sequence fits the draft's window."""
+        if self.draft_model is None or sampling['do_sample'] or sampling['repetition_penalty'] != 1.0:
+            return False
+        config = self.draft_model.config
+        window = getattr(config, 'max_position_embeddings', None) or getattr(config, 'n_positions', 1024)
+        return prompt_tokens + max_tokens <= window
 
+    def context_window(self) -> Optional[int]:
+        """Maximum sequence length of the transformers model (None for other backends)."""
         if self.generator is None:
-            return _fallback()
+            return None
+        config = self.generator.model.config
+        return getattr(config, 'max_position_embeddings', None) or getattr(config, 'n_positions', 1024)
+
+    def count_tokens(self, text: str) -> int:
+        """Prompt tokens `text` takes with this model's tokenizer; a ~4 chars per
+        token estimate for the Ollama and fallback backends."""
+        if self.generator is not None:
+            return len(self.generator.tokenizer(text, add_special_tokens=False)['input_ids'])
+        return (len(text) + 3) // 4
+
+    def prompt_budget(self, budget: int, max_tokens: int = 256) -> int:
+        """`budget` capped so the prompt plus `max_tokens` new tokens fit the context window."""
+        window = self.context_window()
+        return budget if window is None else max(1, min(budget, window - max_tokens))
 
-        # parse generation kwargs from environment defaults or call-time kwargs
+    @property
+    def is_fallback(self) -> bool:
+        """No model loaded: replies are the canned template, not worth caching."""
+        return self.client is None and self.generator is None
+
+    def _fallback(self, prompt: str) -> str:
+        head = prompt.strip()[:100].replace('\n', ' ')
+        return f"[Fallback LLM] I read: '{head}...'\nHere's a short answer based on the retrieved context."
+
+    @staticmethod
+    def _sampling_kwargs() -> dict:
         # typical kwargs: temperature, top_p, repetition_penalty, do_sample
-        # caller may pass these via keyword arguments stored on the instance (we accept **gen_kwargs below)
         # For simplicity, read env defaults here
         gen_temp = float(os.environ.get('RALSEI_GEN_TEMPERATURE', '0.0'))
         gen_top_p = float(os.environ.get('RALSEI_GEN_TOP_P', '0.95'))
         gen_rep_pen = float(os.environ.get('RALSEI_GEN_REP_PENALTY', '1.0'))
 
         do_sample = gen_temp > 0.0
+        return {
+            'do_sample': do_sample,
+            'temperature': gen_temp if do_sample else 0.0,
+            'top_p': gen_top_p,
+            'repetition_penalty': gen_rep_pen,
+        }
+
+    def _ollama_options(self, max_tokens: int) -> dict:
+        sampling = self._sampling_kwargs()
+        return {
+            'num_predict': max_tokens,
+            'temperature': sampling['temperature'],
+            'top_p': sampling['top_p'],
+            'repeat_penalty': sampling['repetition_penalty'],
+        }
+
+    def generate(self, prompt: str, max_tokens: int = 256, prefixes: Optional[Sequence[str]] = None) -> str:
+        if self.generator is not None and ((prefixes and self.prefix_cache.max_entries > 0)
+                                           or self.draft_model is not None):
+            # the pipeline cannot take past_key_values or a draft model: go through the streaming path
+            return ''.join(self.stream(prompt, max_tokens=max_tokens, prefixes=prefixes))
+
+        if self.client is not None:
+            text = self.client.generate(prompt, options=self._ollama_options(max_tokens))
+            self._ollama_usage()
+            return text
+
+        if self.generator is None:
+            text = self._fallback(prompt)
+            self.last_usage = {'completion_tokens': len(text.split())}
+            return text
+
+        # parse generation kwargs from environment defaults
+        sampling = self._sampling_kwargs()
+        do_sample = sampling['do_sample']
 
         try:
             out = self.generator(
                 prompt,
                 max_new_tokens=max_tokens,
-                do_sample=do_sample,
-                temperature=gen_temp if do_sample else 0.0,
-                top_p=gen_top_p,
-                repetition_penalty=gen_rep_pen,
                 truncation=True,
                 return_full_text=False,
+                **sampling,
             )
         except TypeError:
             # older pipelines might ignore some kwargs
             out = self.generator(prompt, max_new_tokens=max_tokens, do_sample=do_sample)
+        text = ''
         if isinstance(out, list) and out:
             # pipeline may return either 'generated_text' or first element string
             first = out[0]
             if isinstance(first, dict):
-                return first.get('generated_text', '')
-            if isinstance(first, str):
-                return first
-        return ''
+                text = first.get('generated_text', '')
+            elif isinstance(first, str):
+                text = first
+        self.last_usage = {'completion_tokens': len(self.generator.tokenizer(text)['input_ids'])}
+        return text
+
+    def generate_batch(self, prompts: Sequence[str], max_tokens: int = 256,
+                       stop_event: Optional[threading.Event] = None) -> List[str]:
+        """Generate replies to several prompts in one padded batch (greedy or
+        sampled like generate()). Prompts are left-padded and, if too long,
+        cut at the start. Ollama and the fallback responder answer one by one.
+        Setting `stop_event` stops the whole batch at the next token."""
+        if self.generator is None:
+            return [self.generate(p, max_tokens=max_tokens) for p in prompts]
+
+        import torch
+
+        model = self.generator.model
+        tokenizer = self.generator.tokenizer
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # decoder-only models continue from the last position: pad on the left
+        tokenizer.padding_side = 'left'
+        limit = max(1, self.context_window() - max_tokens)
+        inputs = tokenizer(list(prompts), return_tensors='pt', padding=True, truncation=True, max_length=limit)
+        gen_kwargs = dict(inputs, max_new_tokens=max_tokens, pad_token_id=tokenizer.pad_token_id)
+        sampling = self._sampling_kwargs()
+        if sampling['do_sample']:
+            gen_kwargs.update(sampling)
+        else:
+            gen_kwargs.update(do_sample=False, repetition_penalty=sampling['repetition_penalty'])
+        if stop_event is not None:
+            gen_kwargs['stopping_criteria'] = StoppingCriteriaList([_StopOnEvent(stop_event)])
+        with torch.no_grad():
+            out = model.generate(**gen_kwargs)
+        new_tokens = out[:, inputs['input_ids'].shape[-1]:]
+        self.last_usage = {
+            'prompt_tokens': int(inputs['attention_mask'].sum()),
+            'completion_tokens': int((new_tokens != tokenizer.pad_token_id).sum()),
+            'batch_size': len(prompts),
+        }
+        return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    def _ollama_usage(self):
+        stats = self.client.last_stats
+        self.last_usage = {
+            'prompt_tokens': stats.get('prompt_eval_count'),
+            'completion_tokens': stats.get('eval_count'),
+        }
+
+    def _encode(self, prompt: str, prefixes: Sequence[str], limit: int) -> Tuple[List[int], List[int]]:
+        """Token ids of the prompt, encoded segment by segment at the prefix
+        boundaries (so a prefix always maps to the same ids), and the
+        boundaries in tokens. Prefixes that are not a prefix of the prompt are
+        ignored. Over `limit`, the start of the prompt is cut (keeping the
+        question at its end), which leaves no prefix to cache."""
+        tokenizer = self.generator.tokenizer
+        ids: List[int] = []
+        bounds: List[int] = []
+        start = 0
+        for prefix in sorted(set(prefixes), key=len):
+            if len(prefix) <= start or not prompt.startswith(prefix):
+                continue
+            ids.extend(tokenizer(prompt[start:len(prefix)], add_special_tokens=False)['input_ids'])
+            bounds.append(len(ids))
+            start = len(prefix)
+        ids.extend(tokenizer(prompt[start:], add_special_tokens=False)['input_ids'])
+        if len(ids) > limit:
+            return ids[-limit:], []
+        # generate() needs at least one uncached token
+        return ids, [b for b in bounds if b < len(ids)]
+
+    def _prefix_state(self, model, ids: List[int], bounds: List[int]):
+        """(copy of past_key_values, tokens covered) for the longest usable cached prefix.
+
+        Missing prefixes are computed by extending the previous one: always for
+        the first boundary, for longer ones once seen `min_hits` times.
+        """
+        import torch
+
+        cache = self.prefix_cache
+        kv, covered = None, 0
+        for n, b in enumerate(bounds):
+            key = tuple(ids[:b])
+            seen = cache.seen(key)
+            stored = cache.get(key)
+            if stored is not None:
+                kv, covered = stored, b
+                cache.hits += 1
+                continue
+            cache.misses += 1
+            if n > 0 and seen < cache.min_hits:
+                break
+            with torch.no_grad():
+                out = model(input_ids=torch.tensor([ids[covered:b]]),
+                            past_key_values=copy.deepcopy(kv) if kv is not None else None,
+                            use_cache=True)
+            kv, covered = out.past_key_values, b
+            cache.put(key, kv)
+        return (copy.deepcopy(kv) if kv is not None else None), covered
+
+    def _speculative_tokens(self, ids: List[int], past, covered: int, max_tokens: int,
+                            stopped) -> Iterator[Tuple[List[int], int, int]]:
+        """Greedy decoding checked in blocks: yields (token ids, drafted, accepted) per step.
+
+        Invariant: the main model's cache covers every token but the last one
+        produced (`seq[:-1]`), the draft's cache covers `seq[:draft_len]`. Each
+        step the draft extends `seq` greedily by up to `draft_tokens` tokens,
+        the main model scores the last token plus the drafts in one pass, and
+        the drafts it would have picked itself are kept along with its own
+        prediction after them. Rejected drafts are cropped from both caches.
+        """
+        import torch
+
+        model, draft = self.generator.model, self.draft_model
+        eos = self.generator.tokenizer.eos_token_id
+        with torch.no_grad():
+            out = model(input_ids=torch.tensor([ids[covered:]]), past_key_values=past, use_cache=True)
+            past = out.past_key_values
+            token = int(out.logits[0, -1].argmax())
+            seq = list(ids) + [token]
+            produced = 1
+            draft_past, draft_len = None, 0
+            yield [token], 0, 0
+            while produced < max_tokens and token != eos and not stopped():
+                # the step emits up to n_draft + 1 tokens
+                n_draft = min(self.draft_tokens, max_tokens - produced - 1)
+                proposal: List[int] = []
+                pending = seq[draft_len:]
+                for _ in range(n_draft):
+                    d_out = draft(input_ids=torch.tensor([pending]), past_key_values=draft_past, use_cache=True)
+                    draft_past = d_out.past_key_values
+                    draft_len += len(pending)
+                    pending = [int(d_out.logits[0, -1].argmax())]
+                    proposal.append(pending[0])
+
+                out = model(input_ids=torch.tensor([[token] + proposal]), past_key_values=past, use_cache=True)
+                past = out.past_key_values
+                predicted = out.logits[0].argmax(-1).tolist()
+                n = 0
+                while n < len(proposal) and proposal[n] == predicted[n]:
+                    n += 1
+                accepted = proposal[:n] + [predicted[n]]
+                valid = len(seq) + n
+                past.crop(valid)
+                if draft_len > valid:
+                    draft_past.crop(valid)
+                    draft_len = valid
+                with self._speculative_lock:
+                    self.speculative['steps'] += 1
+                    self.speculative['drafted'] += len(proposal)
+                    self.speculative['accepted'] += n
+                if eos in accepted:
+                    accepted = accepted[:accepted.index(eos) + 1]
+                seq.extend(accepted)
+                produced += len(accepted)
+                token = accepted[-1]
+                yield accepted, len(proposal), n
+
+    def _stream_speculative(self, ids: List[int], past, covered: int, max_tokens: int,
+                            stopped, usage: dict) -> Iterator[str]:
+        """stream() with the draft model: same chunking as TextIteratorStreamer."""
+        import torch
+
+        collector = _TextCollector(self.generator.tokenizer, skip_special_tokens=True)
+        drafted = accepted = produced = 0
+        steps = self._speculative_tokens(ids, past, covered, max_tokens, stopped)
+        try:
+            for tokens, n_drafted, n_accepted in steps:
+                if stopped():
+                    break
+                drafted += n_drafted
+                accepted += n_accepted
+                produced += len(tokens)
+                collector.put(torch.tensor(tokens))
+                yield from collector.drain()
+            else:
+                collector.end()
+                yield from collector.drain()
+        finally:
+            steps.close()
+            usage.update(completion_tokens=produced, drafted_tokens=drafted, accepted_tokens=accepted)
+
+    def stream(self, prompt: str, max_tokens: int = 256,
+               stop_event: Optional[threading.Event] = None,
+               prefixes: Optional[Sequence[str]] = None) -> Iterator[str]:
+        """Yield generated text chunks as soon as the model produces them.
+
+        Generation runs on a background thread feeding a TextIteratorStreamer;
+        errors raised there are re-raised here once the stream ends. The
+        fallback responder yields its canned answer word by word. Setting
+        `stop_event` cancels generation at the next token. `prefixes` enables
+        prefix caching (see the module docstring). With a draft model, greedy
+        generation runs speculatively on this thread instead
+        (_speculative_tokens); last_usage then also counts drafted_tokens and
+        accepted_tokens.
+        """
+        stopped = stop_event.is_set if stop_event is not None else (lambda: False)
+
+        if self.client is not None:
+            chunks = self.client.stream(prompt, options=self._ollama_options(max_tokens))
+            try:
+                for chunk in chunks:
+                    if stopped():
+                        break
+                    yield chunk
+            finally:
+                # closing an unfinished stream drops the connection, which stops Ollama
+                chunks.close()
+                self._ollama_usage()
+            return
+
+        if self.generator is None or TextIteratorStreamer is None:
+            n = 0
+            for piece in re.findall(r'\S+\s*', self._fallback(prompt)):
+                if stopped():
+                    break
+                n += 1
+                yield piece
+            self.last_usage = {'completion_tokens': n}
+            return
+
+        model = self.generator.model
+        tokenizer = self.generator.tokenizer
+        limit = max(1, self.context_window() - max_tokens)
+        cached_tokens = 0
+        if prefixes and self.prefix_cache.max_entries > 0:
+            import torch
+            ids, bounds = self._encode(prompt, prefixes, limit)
+            past, cached_tokens = self._prefix_state(model, ids, bounds)
+            inputs = {'input_ids': torch.tensor([ids]), 'attention_mask': torch.ones((1, len(ids)), dtype=torch.long)}
+            if past is not None:
+                inputs['past_key_values'] = past
+        else:
+            inputs = tokenizer(prompt, return_tensors='pt', truncation=True, max_length=limit)
+        sampling = self._sampling_kwargs()
+        prompt_tokens = int(inputs['input_ids'].shape[-1])
+        usage = {'prompt_tokens': prompt_tokens, 'cached_tokens': cached_tokens}
+        self.last_usage = usage
+        if self._use_draft(sampling, prompt_tokens, max_tokens):
+            yield from self._stream_speculative(inputs['input_ids'][0].tolist(), inputs.get('past_key_values'),
+                                                cached_tokens, max_tokens, stopped, usage)
+            return
+
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        gen_kwargs = dict(inputs, max_new_tokens=max_tokens, streamer=streamer,
+                          pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id)
+        if sampling['do_sample']:
+            gen_kwargs.update(sampling)
+        else:
+            gen_kwargs.update(do_sample=False, repetition_penalty=sampling['repetition_penalty'])
+        if stop_event is not None:
+            gen_kwargs['stopping_criteria'] = StoppingCriteriaList([_StopOnEvent(stop_event)])
+
+        error = []
+
+        def _run():
+            try:
+                out = model.generate(**gen_kwargs)
+                usage['completion_tokens'] = int(out.shape[-1]) - prompt_tokens
+            except Exception as e:
+                error.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=_run, name='llm-stream', daemon=True)
+        thread.start()
+        for chunk in streamer:
+            if stopped():
+                break
+            if chunk:
+                yield chunk
+        thread.join()
+        if error:
+            raise error[0]
 
 
 _default = None
+_default_lock = threading.Lock()
 
 def get_default_llm() -> LLM:
     global _default
     if _default is None:
-        _default = LLM()
+        # several threads (warm-up, server handlers) may ask at once: build it once
+        with _default_lock:
+            if _default is None:
+                _default = LLM()
     return _default
 
 
@@ -6,8 +6,16 @@ os.environ.setdefault('TRANSFORMERS_VERBOSITY', 'error')
 os.environ.setdefault('HF_HUB_DISABLE_TELEMETRY', '1')
 
 from chatbox import ChatboxRenderer
+from concurrent.futures import ThreadPoolExecutor
+from context_packer import default_budget, pack_contexts
+from emotion import EmotionStream
+from tracing import get_tracer
+from typing import Optional
+import asyncio
+import contextvars
+import signal
 import sys
-import time
+import threading
 
 # optional components for RAG
 try:
@@ -16,85 +24,375 @@ except Exception:
     build_default_retriever = None
 
 try:
-    from llm import get_default_llm
+    from llm import get_default_llm, model_namespace
 except Exception:
     get_default_llm = None
+    model_namespace = None
 
 try:
-    from scripts.hybrid_retriever import rerank_candidates
+    from scripts.hybrid_retriever import rerank_candidates, get_default_reranker
 except Exception:
     rerank_candidates = None
+    get_default_reranker = None
+
+try:
+    from scripts.dense_retriever import build_hybrid_searcher
+except Exception:
+    build_hybrid_searcher = None
+
+try:
+    from scripts.response_cache import ResponseCache
+except Exception:
+    ResponseCache = None
+
+
+RAG_INSTRUCTIONS = (
+    "Use the following extracted passages from the Deltarune wiki to answer the user's question. "
+    "When uncertain, be honest and cite the passages.\n\nPassages:\n"
+)
+PASSAGE_SEPARATOR = "\n\n---\n"
 
 
 def build_rag_prompt(question: str, contexts: list) -> str:
-    # simple prompt: provide contexts then ask the question
-    ctx_text = "\n\n---\n".join([f"(score:{c[1]:.3f}) {c[2]}" for c in contexts])
-    prompt = (
-        "Use the following extracted passages from the Deltarune wiki to answer the user's question. "
-        "When uncertain, be honest and cite the passages.\n\nPassages:\n"
-        f"{ctx_text}\n\nQuestion: {question}\nAnswer:"
-    )
-    return prompt
+    # simple prompt: provide contexts then ask the question. Passages are
+    # rendered without their scores so the same passage always produces the
+    # same text, which keeps prompt prefixes cacheable (see rag_prompt_prefixes)
+    ctx_text = PASSAGE_SEPARATOR.join(c[2] for c in contexts)
+    return f"{RAG_INSTRUCTIONS}{ctx_text}\n\nQuestion: {question}\nAnswer:"
 
 
-def main():
-    chatbox = ChatboxRenderer()
+def rag_prompt_prefixes(contexts: list) -> list:
+    """Prefixes of build_rag_prompt's output worth caching in the LLM: the fixed
+    instructions, then the instructions plus each leading passage."""
+    prefixes = [RAG_INSTRUCTIONS]
+    for i in range(1, len(contexts)):
+        prefixes.append(RAG_INSTRUCTIONS + PASSAGE_SEPARATOR.join(c[2] for c in contexts[:i]) + PASSAGE_SEPARATOR)
+    return prefixes
+
+
+# new tokens per reply; the prompt gets what is left of the context window
+MAX_NEW_TOKENS = 256
+
+
+def pack_rag_prompt(question: str, contexts: list, llm) -> tuple:
+    """(prompt, packed contexts, report): the passages, best first and trimmed at
+    sentence boundaries, that fit RALSEI_PROMPT_BUDGET tokens of the LLM's tokenizer."""
+    budget = llm.prompt_budget(default_budget(), MAX_NEW_TOKENS)
+    packed, report = pack_contexts(question, contexts, build_rag_prompt, llm.count_tokens,
+                                   budget, separator=PASSAGE_SEPARATOR)
+    return build_rag_prompt(question, packed), packed, report
+
+
+# optional pause (seconds) before non-streamed replies; pacing only, off by default
+PACING = float(os.environ.get('RALSEI_PACING', '0'))
+
+
+def load_retriever():
+    if build_default_retriever is None:
+        return None
+    try:
+        with get_tracer().span('load_retriever'):
+            return build_default_retriever()
+    except Exception as e:
+        print('Warning: retriever not available:', e)
+        return None
+
+
+def load_searcher(retriever):
+    """Load the embedding model once, precompute passage embeddings and search
+    them alongside TF-IDF (fused with reciprocal-rank fusion)."""
+    if retriever is None or get_default_reranker is None or build_hybrid_searcher is None:
+        return None
+    try:
+        with get_tracer().span('load_reranker'):
+            return build_hybrid_searcher(retriever, get_default_reranker(retriever))
+    except Exception as e:
+        print('Warning: dense search not available:', e)
+        return None
+
+
+def load_llm():
+    if get_default_llm is None:
+        return None
+    try:
+        with get_tracer().span('load_llm') as span:
+            llm = get_default_llm()
+            span.set(**llm.quantization)
+            if llm.draft_model is not None:
+                span.set(draft_model=llm.speculative['draft_model'], draft_tokens=llm.draft_tokens)
+            return llm
+    except Exception as e:
+        print('Warning: LLM wrapper not available:', e)
+        return None
+
+
+def load_components():
+    """Build the optional RAG components one after another; returns (retriever, searcher, llm)."""
+    with get_tracer().turn(kind='startup'):
+        retriever = load_retriever()
+        searcher = load_searcher(retriever)
+        llm = load_llm()
+    return retriever, searcher, llm
+
+
+def build_response_cache(searcher=None):
+    """Answer cache; RALSEI_RESPONSE_CACHE=<path> persists it, RALSEI_RESPONSE_CACHE_TTL expires entries.
+
+    Entries belong to the configured backend and model, so answers from
+    another model are never replayed. None for the fallback backend.
+    """
+    namespace = model_namespace() if model_namespace is not None else None
+    if ResponseCache is None or namespace is None:
+        return None
+    ttl = os.environ.get('RALSEI_RESPONSE_CACHE_TTL')
+    encoder = searcher.dense.encode_query if searcher is not None else None
+    return ResponseCache(
+        ttl=float(ttl) if ttl else None,
+        encoder=encoder,
+        path=os.environ.get('RALSEI_RESPONSE_CACHE') or None,
+        namespace=namespace,
+    )
 
-    welcome_message = "Hi! I'm Ralsei! I'm here to chat with you and be your friend! (Press Ctrl+C to exit)"
-    chatbox.display(welcome_message, "happy")
 
-    # try to instantiate optional RAG components
-    retriever = None
-    llm = None
-    if build_default_retriever is not None:
+def retrieve_contexts(user_input: str, retriever, searcher, rerank: bool = True) -> list:
+    tracer = get_tracer()
+    if searcher is not None:
+        with tracer.span('retrieve', mode='hybrid'):
+            return searcher.retrieve(user_input, k=3)
+    # get larger candidate set from TF-IDF then re-rank with embeddings
+    with tracer.span('retrieve', mode='tfidf'):
+        tfidf_candidates = retriever.retrieve(user_input, k=50)
+    if rerank and rerank_candidates is not None:
         try:
-            retriever = build_default_retriever()
-        except Exception as e:
-            print('Warning: retriever not available:', e)
+            with tracer.span('rerank_candidates'):
+                return rerank_candidates(user_input, tfidf_candidates, top_k=3)
+        except Exception:
+            pass  # embedding model unavailable: keep the TF-IDF order
+    return tfidf_candidates[:3]
+
+
+async def read_line(prompt: str) -> str:
+    """input() on a daemon thread, so the event loop stays free and exit never waits on it."""
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def _resolve(line, error):
+        if fut.done():
+            return
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(line)
 
-    if get_default_llm is not None:
+    def _worker():
         try:
-            llm = get_default_llm()
-        except Exception as e:
-            print('Warning: LLM wrapper not available:', e)
+            line = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(_resolve, None, e)
+        else:
+            loop.call_soon_threadsafe(_resolve, line, None)
 
-    try:
-        while True:
-            user_input = input("\nYou: ")
+    threading.Thread(target=_worker, name='chat-input', daemon=True).start()
+    return await fut
+
+
+class ChatSession:
+    """One chat: components load in the background, each turn is a cancellable task."""
+
+    def __init__(self, chatbox: ChatboxRenderer):
+        self.chatbox = chatbox
+        # daemon-ish pool for CPU-heavy stages, terminal rendering and the two warm-up chains
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chat')
+        # resolved by warm_up() as each component finishes loading
+        self.retriever: Optional[asyncio.Future] = None
+        self.searcher: Optional[asyncio.Future] = None
+        self.llm: Optional[asyncio.Future] = None
+        self.warming: Optional[asyncio.Task] = None
+        self.cache = None
+        self.turn: Optional[asyncio.Task] = None
+
+    async def run_blocking(self, fn, *args):
+        # carry the current trace turn into the worker thread
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, ctx.run, fn, *args)
+
+    async def warm_up(self):
+        """Load the retriever (then the embedding search) and the LLM side by side.
+
+        Turns only wait for the components they need: retrieval starts as soon
+        as the index is loaded, and uses the hybrid searcher only once it is ready.
+        """
+        loop = asyncio.get_running_loop()
+        self.retriever, self.searcher, self.llm = (loop.create_future() for _ in range(3))
+
+        async def load(fut, fn, *args):
+            value = await self.run_blocking(fn, *args)
+            fut.set_result(value)
+            return value
+
+        async def load_search_chain():
+            retriever = await load(self.retriever, load_retriever)
+            searcher = await load(self.searcher, load_searcher, retriever)
+            self.cache = build_response_cache(searcher)
+
+        with get_tracer().turn(kind='startup'):
+            await asyncio.gather(load_search_chain(), load(self.llm, load_llm))
+
+    async def answer(self, user_input: str):
+        with get_tracer().turn(kind='chat', query_chars=len(user_input)):
+            await self._answer(user_input)
 
-            # if we have a retriever and llm, do RAG
-            response = None
-            emotion = 'neutral'
+    async def _answer(self, user_input: str):
+        tracer = get_tracer()
+        # shielded: cancelling a turn must not cancel the shared warm-up futures
+        retriever = await asyncio.shield(self.retriever)
+        # the embedding model may still be loading: search TF-IDF only rather than wait for it
+        searcher = self.searcher.result() if self.searcher.done() else None
+        llm = None
+        response = None
+        emotion = 'neutral'
 
-            if retriever is not None and llm is not None:
+        if retriever is not None:
+            try:
+                contexts = await self.run_blocking(retrieve_contexts, user_input, retriever, searcher,
+                                                   self.searcher.done())
+                passage_ids = [c[0] for c in contexts]
+                cached = None
+                if self.cache is not None:
+                    with tracer.span('response_cache') as span:
+                        cached = await self.run_blocking(self.cache.get, user_input, passage_ids)
+                        span.set(hit=cached is not None)
+                if cached is None:
+                    # a cache hit never waits for the model
+                    with tracer.span('wait_llm'):
+                        llm = await asyncio.shield(self.llm)
+                if llm is not None:
+                    with tracer.span('build_rag_prompt') as span:
+                        prompt, contexts, report = await self.run_blocking(pack_rag_prompt, user_input,
+                                                                           contexts, llm)
+                        span.set(budget=report['budget'], prompt_tokens=report['prompt_tokens'],
+                                 passages=report['passages_used'], trimmed=report['passages_trimmed'])
+            except Exception as e:
+                response = f"[RAG error] {e}"
+                emotion = 'surprised'
+            else:
+                # generation streams on its own thread; rendering starts with the first token
+                stop = threading.Event()
+                if cached is not None:
+                    chunks = iter([cached])
+                elif llm is not None:
+                    chunks = tracer.trace_stream(
+                        llm.stream(prompt, max_tokens=MAX_NEW_TOKENS, stop_event=stop,
+                                   prefixes=rag_prompt_prefixes(contexts)),
+                        tracer.span('generate', prompt_chars=len(prompt)),
+                        usage=lambda: llm.last_usage,
+                    )
+                else:
+                    chunks = None  # the LLM failed to load: simple reply below
+                if chunks is not None:
+                    # the art follows the reply's emotion tag (or first words), known a few tokens in
+                    reply = EmotionStream(chunks)
+                    display_span = tracer.span('display')
+                    display_span.__enter__()
+                    render = asyncio.ensure_future(self.run_blocking(self.display_reply, reply, display_span))
+                    render.add_done_callback(lambda _: display_span.__exit__(None, None, None))
+                    try:
+                        await asyncio.shield(render)
+                        if cached is None and self.cache is not None and not llm.is_fallback:
+                            # cached with its tag, so a replay gets the same art
+                            await self.run_blocking(self.cache.put, user_input, passage_ids, reply.raw)
+                        return
+                    except asyncio.CancelledError:
+                        stop.set()
+                        # let the render thread finish its last frame before anything else draws
+                        await asyncio.wait([render])
+                        raise
+                    except Exception as e:
+                        response = f"[RAG error] {e}"
+                        emotion = 'surprised'
+
+        # fallback simple reply
+        if response is None:
+            response = "That's interesting! I'm looking forward to when I can respond more meaningfully!"
+
+        if PACING:
+            await asyncio.sleep(PACING)
+        with tracer.span('display', streamed=False):
+            await self.run_blocking(self.chatbox.display, response, emotion, 0.01, PACING)
+
+    def display_reply(self, reply: EmotionStream, span) -> str:
+        """Draw a streamed reply once its emotion is known (runs on a worker thread)."""
+        emotion = reply.emotion()
+        span.set(emotion=emotion, emotion_source=reply.source)
+        return self.chatbox.display_stream(reply, emotion)
+
+    def interrupt(self):
+        """Ctrl+C: cancel the turn in flight, or leave if there is none."""
+        if self.turn is not None and not self.turn.done():
+            self.turn.cancel()
+        else:
+            raise KeyboardInterrupt
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        welcome_message = "Hi! I'm Ralsei! I'm here to chat with you and be your friend! (Press Ctrl+C to exit)"
+        # load retriever / models while the welcome message animates
+        self.warming = asyncio.ensure_future(self.warm_up())
+        await self.run_blocking(self.chatbox.display, welcome_message, "happy")
+
+        main_task = asyncio.current_task()
+
+        def on_sigint():
+            try:
+                self.interrupt()
+            except KeyboardInterrupt:
+                main_task.cancel()
+
+        try:
+            loop.add_signal_handler(signal.SIGINT, on_sigint)
+        except (NotImplementedError, RuntimeError):
+            pass  # e.g. Windows: Ctrl+C raises KeyboardInterrupt instead
+
+        try:
+            while True:
+                user_input = await read_line("\nYou: ")
+                self.turn = asyncio.ensure_future(self.answer(user_input))
                 try:
-                    # get larger candidate set from TF-IDF then re-rank with embeddings
-                    tfidf_candidates = retriever.retrieve(user_input, k=50)
-                    if rerank_candidates is not None:
-                        contexts = rerank_candidates(user_input, tfidf_candidates, top_k=3)
-                    else:
-                        contexts = tfidf_candidates[:3]
-
-                    prompt = build_rag_prompt(user_input, contexts)
-                    generated = llm.generate(prompt, max_tokens=256)
-                    response = generated
-                    emotion = 'happy'
-                except Exception as e:
-                    response = f"[RAG error] {e}"
-                    emotion = 'surprised'
-
-            # fallback simple reply
-            if response is None:
-                response = "That's interesting! I'm looking forward to when I can respond more meaningfully!"
-
-            time.sleep(0.5)
-            chatbox.display(response, emotion)
+                    await self.turn
+                except asyncio.CancelledError:
+                    if main_task.cancelling():
+                        raise
+                    print("\n(interrupted)")
+        except (asyncio.CancelledError, KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        await self.run_blocking(self.chatbox.display, "Goodbye! It was nice talking to you!", "sad")
+        await asyncio.sleep(1)
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
+
+def main():
+    if '--profile-startup' in sys.argv[1:]:
+        from scripts.startup_profile import profile_startup
+        sys.exit(profile_startup())
+    if '--serve' in sys.argv[1:]:
+        from server import serve
+        sys.exit(serve())
+    if '--batch' in sys.argv[1:]:
+        from batch import main as run_batch
+        sys.exit(run_batch())
+    chatbox = ChatboxRenderer()
+    try:
+        asyncio.run(ChatSession(chatbox).run())
     except KeyboardInterrupt:
         chatbox.display("Goodbye! It was nice talking to you!", "sad")
-        time.sleep(1)
-        sys.exit(0)
+    sys.exit(0)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+
+Offline CPU benchmarks for the RAG hot paths. Prints (or writes) one JSON
+document so results can be diffed across commits.
+
+Stages, each over a fixed query set:
+ - index_build: Retriever built from scratch (no cache)
+ - default_retriever: build_default_retriever cold (empty cache) vs warm
+ - retrieve / retrieve_many: TF-IDF query latency (p50/p99)
+ - bm25: inverted-index BM25 build and query latency over the same passages
+ - rerank: Reranker.rerank over 50 TF-IDF candidates
+ - dense_search: exact and IVF dense search
+ - prompt_build: build_rag_prompt
+ - llm_fallback: LLM.generate with the template responder
+ - chatbox_fps: ChatboxRenderer.display_stream frames per second
+
+index_build, retrieve, bm25 and dense_search also run on synthetic corpora scaled
+from deltarune_wiki_data.txt (10x / 100x by default).
+
+If the sentence-transformers model is not available locally, the rerank
+and dense stages use a hashing bag-of-words encoder; the output records which
+encoder ran.
+
+Usage:
+    python scripts/benchmark.py [--scales 1,10,100] [--repeat 50] [--output bench.json]
+"""
+import argparse
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import redirect_stdout
+
+# ensure project root is on sys.path so `scripts.*` imports work when running this file
+proj_root = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(proj_root))
+# chatbox.py lives at the repository root
+sys.path.append(str(proj_root.parent))
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '')
+os.environ.setdefault('TRANSFORMERS_VERBOSITY', 'error')
+os.environ.setdefault('HF_HUB_DISABLE_TELEMETRY', '1')
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+import numpy as np
+
+from scripts.retriever import Retriever, build_default_retriever, default_data_path
+from scripts import hybrid_retriever
+from scripts.dense_retriever import DenseRetriever
+from scripts.bm25 import BM25Retriever
+
+QUERIES = [
+    'How do I pacify enemies?',
+    'Who is Ralsei?',
+    'What happens when you seal a Dark Fountain?',
+    'What is the Roaring?',
+    'How does Susie learn healing magic?',
+    'Where is Castle Town?',
+    'Who is Lancer?',
+    'What is the prophecy about the Lightners?',
+    'Does Ralsei wear a hat?',
+    'What does Ralsei think of Kris?',
+]
+
+
+def summarize(samples):
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        'n': int(ms.size),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'min_ms': float(ms.min()),
+    }
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+class HashingEncoder:
+    """Deterministic bag-of-words hashing encoder with a sentence-transformers style encode()."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                h = zlib.crc32(word.encode('utf-8'))
+                out[row, h % self.dim] += 1.0 if h & 1 else -1.0
+        return out
+
+
+def make_reranker():
+    """Real embedding model if it loads offline, else the hashing encoder."""
+    try:
+        return hybrid_retriever.Reranker(), hybrid_retriever.DEFAULT_MODEL
+    except Exception:
+        return hybrid_retriever.Reranker(model_name='hashing', model=HashingEncoder()), 'hashing'
+
+
+def make_corpus(base_text: str, scale: int, out_dir: str, seed: int = 0) -> str:
+    """Synthetic corpus ~scale x the base size: resampled sentences with some words
+    replaced by new tokens, so the vocabulary grows as well as the passage count."""
+    path = os.path.join(out_dir, f'corpus_x{scale}.txt')
+    if scale == 1:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(base_text)
+        return path
+    rng = random.Random(seed)
+    sentences = [s for s in re.split(r'(?<=[.!?\n])\s+', base_text) if s.strip()]
+    target = len(base_text) * scale
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < target:
+            words = rng.choice(sentences).split(' ')
+            for i in range(len(words)):
+                if rng.random() < 0.1:
+                    words[i] = f'syn{rng.randrange(50000)}'
+            line = ' '.join(words) + '\n'
+            f.write(line)
+            written += len(line)
+    return path
+
+
+def bench_default_retriever(repeat: int):
+    """build_default_retriever with an empty cache dir (cold) and again (warm)."""
+    old = os.environ.get('RALSEI_INDEX_DIR')
+    with tempfile.TemporaryDirectory() as cache_root:
+        os.environ['RALSEI_INDEX_DIR'] = cache_root
+        try:
+            t0 = time.perf_counter()
+            build_default_retriever()
+            cold = time.perf_counter() - t0
+            warm = timed(build_default_retriever, repeat)
+        finally:
+            if old is None:
+                os.environ.pop('RALSEI_INDEX_DIR', None)
+            else:
+                os.environ['RALSEI_INDEX_DIR'] = old
+    return {'cold_ms': cold * 1000.0, 'warm': summarize(warm)}
+
+
+def bench_corpus(path: str, cache_dir: str, repeat: int, reranker, with_rerank: bool):
+    result = {'bytes': os.path.getsize(path)}
+
+    build = timed(lambda: Retriever(path, use_cache=False), max(1, min(3, repeat)))
+    result['index_build'] = summarize(build)
+
+    r = Retriever(path, cache_dir=cache_dir)
+    result['passages'] = len(r.passages)
+    result['vocabulary'] = len(r.vectorizer.vocabulary_)
+
+    samples = []
+    for _ in range(repeat):
+        for q in QUERIES:
+            t0 = time.perf_counter()
+            r.retrieve(q, k=50)
+            samples.append(time.perf_counter() - t0)
+    result['retrieve'] = summarize(samples)
+    batch = timed(lambda: r.retrieve_many(QUERIES, k=50), repeat)
+    result['retrieve_many'] = summarize(batch)
+    result['retrieve_many']['queries_per_batch'] = len(QUERIES)
+
+    passages = list(r.passages)
+    t0 = time.perf_counter()
+    bm25 = BM25Retriever(passages)
+    bm25_build_ms = (time.perf_counter() - t0) * 1000.0
+    samples = []
+    for _ in range(repeat):
+        for q in QUERIES:
+            t0 = time.perf_counter()
+            bm25.retrieve(q, k=50)
+            samples.append(time.perf_counter() - t0)
+    result['bm25'] = dict(summarize(samples), build_ms=bm25_build_ms)
+
+    t0 = time.perf_counter()
+    reranker.embeddings = None
+    reranker.attach(r)
+    result['embed_passages_ms'] = (time.perf_counter() - t0) * 1000.0
+
+    if with_rerank:
+        candidates = [r.retrieve(q, k=50) for q in QUERIES]
+        samples = []
+        for _ in range(repeat):
+            for q, c in zip(QUERIES, candidates):
+                t0 = time.perf_counter()
+                reranker.rerank(q, c, top_k=3)
+                samples.append(time.perf_counter() - t0)
+        result['rerank'] = summarize(samples)
+
+    dense = {}
+    for mode in ('exact', 'ivf'):
+        t0 = time.perf_counter()
+        d = DenseRetriever.from_reranker(reranker, mode=mode)
+        build_ms = (time.perf_counter() - t0) * 1000.0
+        qvecs = [reranker.encode_query(q) for q in QUERIES]
+        samples = []
+        for _ in range(repeat):
+            for qv in qvecs:
+                t0 = time.perf_counter()
+                d.search(qv, k=50)
+                samples.append(time.perf_counter() - t0)
+        dense[mode] = dict(summarize(samples), build_ms=build_ms)
+        if mode == 'ivf':
+            dense[mode].update(nlist=d.nlist, nprobe=d.nprobe)
+    result['dense_search'] = dense
+    return result
+
+
+def bench_prompt_build(repeat: int):
+    from main import build_rag_prompt
+    r = build_default_retriever()
+    contexts = [r.retrieve(q, k=3) for q in QUERIES]
+    samples = []
+    for _ in range(repeat):
+        for q, c in zip(QUERIES, contexts):
+            t0 = time.perf_counter()
+            build_rag_prompt(q, c)
+            samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def bench_llm_fallback(repeat: int):
+    from llm import LLM
+    llm = LLM(backend='fallback')
+    prompt = 'Passages:\n' + 'Ralsei is a Darkner. ' * 50 + '\n\nQuestion: Who is Ralsei?\nAnswer:'
+    return summarize(timed(lambda: llm.generate(prompt, max_tokens=256), repeat))
+
+
+def bench_chatbox(repeat: int):
+    from chatbox import ChatboxRenderer
+    renderer = ChatboxRenderer(fps=0, clear_screen=False)  # fps=0: draw every chunk
+    text = "Hi! I'm Ralsei! I'm here to chat with you and be your friend! " * 8
+    chunks = re.findall(r'\S+\s*', text)
+    samples = []
+    sink = io.StringIO()
+    for _ in range(max(1, repeat // 5)):
+        sink.seek(0)
+        sink.truncate()
+        with redirect_stdout(sink):
+            t0 = time.perf_counter()
+            renderer.display_stream(iter(chunks), 'happy')
+            samples.append(time.perf_counter() - t0)
+    best = min(samples)
+    return {
+        'frames': len(chunks),
+        'fps': len(chunks) / best if best else float('inf'),
+        'bytes_per_message': len(sink.getvalue()),
+        'message': summarize(samples),
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=proj_root, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(scales, repeat: int):
+    base_path = default_data_path()
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base_text = f.read()
+
+    reranker, encoder = make_reranker()
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'repeat': repeat,
+            'queries': len(QUERIES),
+            'encoder': encoder,
+        },
+        'default_retriever': bench_default_retriever(repeat),
+        'corpora': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            path = make_corpus(base_text, scale, tmp)
+            cache_dir = os.path.join(tmp, f'index_x{scale}')
+            report['corpora'][f'x{scale}'] = bench_corpus(path, cache_dir, repeat, reranker, with_rerank=scale == 1)
+
+    report['prompt_build'] = bench_prompt_build(repeat)
+    report['llm_fallback'] = bench_llm_fallback(repeat)
+    report['chatbox'] = bench_chatbox(repeat)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RAG hot paths (offline, CPU).')
+    parser.add_argument('--scales', default='1,10,100', help='comma-separated corpus scale factors')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions per measurement')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(',') if s.strip()]
+    report = run(scales, args.repeat)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
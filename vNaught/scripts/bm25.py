@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+bm25.py
+
+Inverted-index BM25 retriever in plain NumPy (no scikit-learn at query time).
+
+The index stores, per term, a postings list of passage ids (int32) and the
+precomputed BM25 contribution of the term to each passage (float32), all
+concatenated into two flat arrays addressed by `term_offsets`. A query only
+touches the postings of its own terms.
+
+Top-k uses max-score pruning: terms are scored from the highest to the
+lowest upper bound (the largest contribution in their postings). Once the
+upper bounds of the remaining terms add up to less than the current k-th
+best score, no passage that is not already a candidate can reach the top k,
+so the remaining (common, low-IDF) terms only update existing candidates,
+and candidates that can no longer make it are dropped.
+
+Like Retriever, the index and the passages are cached next to the source
+file (in a separate `<name>.bm25` directory) and memory-mapped on start.
+
+API:
+ - BM25Retriever(passages, metadata=None, k1=1.2, b=0.75, cache=None)
+   - retrieve(query, k) / retrieve_many(queries, k): [(index, score, passage)]
+ - build_bm25_retriever(path=None): over the wiki JSON (or a .txt file)
+ - tokenize(text): the analyzer used for passages and queries
+"""
+from typing import List, Optional, Sequence, Tuple
+import json
+import os
+import re
+
+import numpy as np
+
+try:
+    from scripts.index_cache import IndexCache, default_cache_dir
+    from scripts.retriever import chunk_text, chunk_wiki_records, default_data_path, load_passages, save_passages
+except ImportError:
+    from index_cache import IndexCache, default_cache_dir
+    from retriever import chunk_text, chunk_wiki_records, default_data_path, load_passages, save_passages
+
+_TOKEN = re.compile(r'\b\w\w+\b')
+
+STOP_WORDS = frozenset('''
+a about above after again against all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further had has
+have having he her here hers herself him himself his how i if in into is it its itself just me
+more most my myself no nor not now of off on once only or other our ours ourselves out over own
+same she should so some such than that the their theirs them themselves then there these they this
+those through to too under until up very was we were what when where which while who whom why will
+with would you your yours yourself yourselves
+'''.split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOP_WORDS]
+
+
+class BM25Retriever:
+    def __init__(self, passages: Sequence[str], metadata: Optional[List[dict]] = None,
+                 k1: float = 1.2, b: float = 0.75, cache: Optional[IndexCache] = None):
+        self.k1 = k1
+        self.b = b
+        self.cache = cache
+        self.passages: Sequence[str] = passages
+        self.metadata = metadata
+        self._build()
+
+    def _build(self):
+        terms: dict = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(len(self.passages), dtype=np.float32)
+        for d, passage in enumerate(self.passages):
+            counts: dict = {}
+            tokens = tokenize(passage)
+            doc_len[d] = len(tokens)
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                term_ids.append(terms.setdefault(tok, len(terms)))
+                doc_ids.append(d)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        # postings sorted by term, then passage id
+        order = np.lexsort((doc_ids, term_ids))
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        df = np.bincount(term_ids, minlength=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+
+        n = max(len(self.passages), 1)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if len(doc_len) and doc_len.mean() > 0 else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * doc_len[doc_ids] / avgdl)
+        impacts = (idf[term_ids] * tfs * (self.k1 + 1.0) / (tfs + norm)).astype(np.float32)
+
+        self.vocabulary = terms
+        self.term_offsets = offsets
+        self.post_docs = doc_ids
+        self.post_impacts = impacts
+        self.term_ub = np.maximum.reduceat(impacts, offsets[:-1]) if len(impacts) else np.zeros(0, np.float32)
+
+    # -- persistence -------------------------------------------------------
+
+    @classmethod
+    def from_source(cls, path: str, cache_dir: Optional[str] = None, use_cache: bool = True,
+                    max_chars: int = 600, chunk_size: int = 400, overlap: int = 100,
+                    k1: float = 1.2, b: float = 0.75) -> 'BM25Retriever':
+        """BM25 index over a wiki JSON scrape (structure-aware passages) or a .txt file."""
+        is_json = path.endswith('.json')
+        params = {'kind': 'bm25', 'k1': k1, 'b': b}
+        params.update({'chunking': 'wiki-json', 'max_chars': max_chars} if is_json
+                      else {'chunk_size': chunk_size, 'overlap': overlap})
+        cache = None
+        if use_cache:
+            cache = IndexCache(cache_dir or default_cache_dir(path) + '.bm25', path, params)
+            if cache.is_fresh():
+                try:
+                    return cls._load(cache, k1, b)
+                except (OSError, ValueError, KeyError):
+                    pass  # damaged cache: rebuild below
+
+        st = os.stat(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            if is_json:
+                passages, metadata = chunk_wiki_records(json.load(f), max_chars)
+            else:
+                passages, metadata = chunk_text(f.read(), chunk_size, overlap), None
+        r = cls(passages, metadata, k1=k1, b=b, cache=cache)
+        if cache is not None:
+            try:
+                r._save(st)
+            except OSError as e:
+                print('Warning: could not write index cache:', e)
+        return r
+
+    def _save(self, st: os.stat_result):
+        cache = self.cache
+        cache.invalidate()
+        terms = [''] * len(self.vocabulary)
+        for term, i in self.vocabulary.items():
+            terms[i] = term
+        cache.save_bytes('vocabulary.txt', '\n'.join(terms).encode('utf-8'))
+        cache.save_array('term_offsets', self.term_offsets)
+        cache.save_array('post_docs', self.post_docs)
+        cache.save_array('post_impacts', self.post_impacts)
+        cache.save_array('term_ub', self.term_ub)
+        if self.metadata is not None:
+            cache.save_json('metadata.json', self.metadata)
+        save_passages(cache, self.passages)
+        cache.commit(st)
+
+    @classmethod
+    def _load(cls, cache: IndexCache, k1: float, b: float) -> 'BM25Retriever':
+        r = cls.__new__(cls)
+        r.k1, r.b, r.cache = k1, b, cache
+        with open(cache.path('vocabulary.txt'), 'r', encoding='utf-8') as f:
+            r.vocabulary = {t: i for i, t in enumerate(f.read().split('\n')) if t}
+        r.term_offsets = cache.load_array('term_offsets')
+        r.post_docs = cache.load_array('post_docs')
+        r.post_impacts = cache.load_array('post_impacts')
+        r.term_ub = cache.load_array('term_ub', mmap=False)
+        r.metadata = cache.load_json('metadata.json') if cache.has('metadata.json') else None
+        r.passages = load_passages(cache)
+        if len(r.term_offsets) != len(r.vocabulary) + 1:
+            raise ValueError('vocabulary does not match the cached postings')
+        return r
+
+    # -- queries -------------------------------------------------------------
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+        return self.post_docs[start:end], self.post_impacts[start:end]
+
+    def score(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(passage ids, scores) of the top k, sorted by score desc (max-score pruned)."""
+        qtf: dict = {}
+        for tok in tokenize(query):
+            t = self.vocabulary.get(tok)
+            if t is not None:
+                qtf[t] = qtf.get(t, 0) + 1
+        if not qtf or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # highest possible contribution first
+        terms = sorted(qtf, key=lambda t: -float(self.term_ub[t]) * qtf[t])
+        bounds = np.asarray([float(self.term_ub[t]) * qtf[t] for t in terms], dtype=np.float64)
+        rest = np.concatenate([np.cumsum(bounds[::-1])[::-1][1:], [0.0]])  # bound of the terms after i
+
+        cand = np.empty(0, dtype=np.int32)
+        scores = np.empty(0, dtype=np.float32)
+        theta = 0.0
+        for i, t in enumerate(terms):
+            docs, impacts = self._postings(t)
+            weight = np.float32(qtf[t])
+            if bounds[i] + rest[i] > theta or len(cand) < k:
+                # a passage seen for the first time could still make the top k
+                docs_all = np.concatenate([cand, docs])
+                uniq, inv = np.unique(docs_all, return_inverse=True)
+                scores = np.bincount(inv, weights=np.concatenate([scores, impacts * weight]),
+                                     minlength=len(uniq)).astype(np.float32)
+                cand = uniq.astype(np.int32)
+            else:
+                # only existing candidates can still win: look them up in this postings list
+                pos = np.searchsorted(docs, cand)
+                pos[pos == len(docs)] = 0
+                hit = docs[pos] == cand if len(docs) else np.zeros(len(cand), dtype=bool)
+                scores[hit] += impacts[pos[hit]] * weight
+            if len(scores) >= k:
+                theta = float(np.partition(scores, len(scores) - k)[len(scores) - k])
+                if rest[i] < theta:
+                    keep = scores + rest[i] >= theta
+                    cand, scores = cand[keep], scores[keep]
+
+        kk = min(k, len(scores))
+        top = np.argpartition(-scores, kk - 1)[:kk]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return cand[top].astype(np.int64), scores[top]
+
+    def retrieve(self, query: str, k: int = 3) -> List[Tuple[int, float, str]]:
+        """Return list of (index, score, passage) sorted by score desc."""
+        ids, scores = self.score(query, k)
+        top = [(int(i), float(s)) for i, s in zip(ids, scores)]
+        if len(top) < k:
+            # fewer matching passages than k: pad with zero-score ones like Retriever does
+            seen = set(int(i) for i in ids)
+            for i in range(len(self.passages)):
+                if len(top) >= k:
+                    break
+                if i not in seen:
+                    top.append((i, 0.0))
+        return [(i, s, self.passages[i]) for i, s in top]
+
+    def retrieve_many(self, queries: Sequence[str], k: int = 3) -> List[List[Tuple[int, float, str]]]:
+        return [self.retrieve(q, k) for q in queries]
+
+
+def build_bm25_retriever(path: Optional[str] = None) -> BM25Retriever:
+    if path is None:
+        path = default_data_path('deltarune_wiki_data.json')
+        if not os.path.exists(path):
+            path = default_data_path()
+    return BM25Retriever.from_source(path)
+
+
+if __name__ == '__main__':
+    r = build_bm25_retriever()
+    query = input('query: ')
+    for i, score, passage in r.retrieve(query, k=5):
+        snippet = passage[:200].replace('\n', ' ')
+        print(f'[{i}] {score:.3f} {snippet}')
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+dense_retriever.py
+
+Full-corpus dense vector search over the passage-embedding matrix built by
+hybrid_retriever.Reranker, in plain NumPy.
+
+Two search modes:
+ - 'exact': brute-force dot product against every passage (best for small corpora)
+ - 'ivf':   inverted-file index; passages are clustered with spherical k-means
+            and a query only scans the `nprobe` closest clusters. `nlist`
+            (number of clusters) and `nprobe` trade recall for latency.
+'auto' picks exact below `exact_threshold` passages and IVF above it.
+
+API:
+ - DenseRetriever(embeddings, passages, encode_query, mode='auto', ...)
+   - retrieve(query, k): returns [(index, score, passage)]
+ - reciprocal_rank_fusion(rankings, k=60, weights=None): fuses ranked index lists
+ - HybridSearcher(retriever, dense, depth=50): TF-IDF + dense fused with RRF
+ - build_hybrid_searcher(retriever, reranker): wires the default components
+"""
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import os
+
+import numpy as np
+
+# rows scored per block when the matrix is float16 / memory-mapped
+_BLOCK = 65536
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, sorted desc, without a full sort."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def _dot_blocks(matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+    if matrix.dtype == np.float32 and not isinstance(matrix, np.memmap):
+        return matrix @ q
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], _BLOCK):
+        block = np.asarray(matrix[start:start + _BLOCK], dtype=np.float32)
+        out[start:start + block.shape[0]] = block @ q
+    return out
+
+
+def spherical_kmeans(x: np.ndarray, nlist: int, n_iter: int = 20, sample: int = 256, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity; returns (nlist, dim) unit centroids.
+
+    Trains on at most `sample * nlist` rows, which is plenty for IVF.
+    """
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    if n > sample * nlist:
+        train = np.asarray(x[np.sort(rng.choice(n, sample * nlist, replace=False))], dtype=np.float32)
+    else:
+        train = np.asarray(x, dtype=np.float32)
+    centroids = train[rng.choice(train.shape[0], nlist, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty clusters from random training rows
+            sums[empty] = train[rng.choice(train.shape[0], int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1e-8
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+class DenseRetriever:
+    def __init__(self, embeddings: np.ndarray, passages: Sequence[str], encode_query: Callable[[str], np.ndarray],
+                 mode: Optional[str] = None, nlist: Optional[int] = None, nprobe: Optional[int] = None,
+                 exact_threshold: int = 20000, cache=None, cache_key: Optional[str] = None):
+        self.embeddings = embeddings
+        self.passages = passages
+        self.encode_query = encode_query
+        mode = mode or os.environ.get('RALSEI_DENSE_MODE', 'auto')
+        if mode == 'auto':
+            mode = 'exact' if embeddings.shape[0] <= exact_threshold else 'ivf'
+        if mode not in ('exact', 'ivf'):
+            raise ValueError(f"unknown dense search mode: {mode}")
+        self.mode = mode
+        n = embeddings.shape[0]
+        self.nlist = max(1, min(n, nlist or int(4 * np.sqrt(n))))
+        self.nprobe = nprobe or int(os.environ.get('RALSEI_DENSE_NPROBE', '8'))
+        self.cache = cache
+        self.cache_key = cache_key
+        self.centroids: Optional[np.ndarray] = None
+        self.list_order: Optional[np.ndarray] = None
+        self.list_offsets: Optional[np.ndarray] = None
+        if self.mode == 'ivf':
+            self._build_ivf()
+
+    @classmethod
+    def from_reranker(cls, reranker, **kwargs) -> 'DenseRetriever':
+        """Search the passages a Reranker has been attached to, reusing its model."""
+        if reranker.embeddings is None:
+            raise RuntimeError("Reranker has no passage embeddings; call attach(retriever) first")
+        cache = kwargs.pop('cache', None)
+        cache_key = None
+        if cache is not None:
+            cache_key = f'{cache.key}-{reranker._artifact_name()}'
+        return cls(reranker.embeddings, reranker.passages, reranker.encode_query,
+                   cache=cache, cache_key=cache_key, **kwargs)
+
+    def _build_ivf(self):
+        name = f'ivf-{self.nlist}'
+        cache = self.cache
+        if cache is not None and self.cache_key and cache.has(name + '.json'):
+            try:
+                if cache.load_json(name + '.json').get('key') == self.cache_key:
+                    self.centroids = np.asarray(cache.load_array(name + '-centroids'))
+                    self.list_order = cache.load_array(name + '-order')
+                    self.list_offsets = np.asarray(cache.load_array(name + '-offsets'))
+                    return
+            except (OSError, ValueError):
+                pass
+
+        self.centroids = spherical_kmeans(self.embeddings, self.nlist)
+        assign = np.empty(self.embeddings.shape[0], dtype=np.int64)
+        for start in range(0, self.embeddings.shape[0], _BLOCK):
+            block = np.asarray(self.embeddings[start:start + _BLOCK], dtype=np.float32)
+            assign[start:start + block.shape[0]] = np.argmax(block @ self.centroids.T, axis=1)
+        # inverted lists: passage ids grouped by cluster, with CSR-style offsets
+        self.list_order = np.argsort(assign, kind='stable')
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=self.nlist), out=self.list_offsets[1:])
+
+        if cache is not None and self.cache_key:
+            try:
+                cache.save_array(name + '-centroids', self.centroids)
+                cache.save_array(name + '-order', self.list_order)
+                cache.save_array(name + '-offsets', self.list_offsets)
+                cache.save_json(name + '.json', {'key': self.cache_key})
+            except OSError as e:
+                print('Warning: could not cache IVF index:', e)
+
+    def search(self, q: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores) of the k nearest passages to unit vector q."""
+        q = np.asarray(q, dtype=np.float32)
+        if self.mode == 'exact':
+            scores = _dot_blocks(self.embeddings, q)
+            top = _top_k(scores, k)
+            return top, scores[top]
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe = _top_k(self.centroids @ q, nprobe)
+        ids = np.concatenate([self.list_order[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe])
+        if ids.size == 0:
+            return ids.astype(np.int64), np.empty(0, dtype=np.float32)
+        ids.sort()  # sequential reads from the (possibly memory-mapped) matrix
+        scores = np.asarray(self.embeddings[ids], dtype=np.float32) @ q
+        top = _top_k(scores, k)
+        return ids[top], scores[top]
+
+    def retrieve(self, query: str, k: int = 3) -> List[Tuple[int, float, str]]:
+        """Return list of (index, score, passage) sorted by score desc."""
+        idx, scores = self.search(self.encode_query(query), k)
+        return [(int(i), float(s), self.passages[int(i)]) for i, s in zip(idx, scores)]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[int, float]]:
+    """Fuse ranked lists of passage indices: score(d) = sum_r w_r / (k + rank_r(d))."""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[int, float] = {}
+    for ranking, w in zip(rankings, weights):
+        for rank, idx in enumerate(ranking, 1):
+            fused[idx] = fused.get(idx, 0.0) + w / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridSearcher:
+    """TF-IDF and dense retrieval over the same passages, fused with RRF.
+
+    Each side contributes its top `depth` passages, so passages only one of
+    them finds still make it into the fused ranking.
+    """
+
+    def __init__(self, retriever, dense: DenseRetriever, depth: int = 50, rrf_k: int = 60,
+                 weights: Optional[Sequence[float]] = None):
+        self.retriever = retriever
+        self.dense = dense
+        self.depth = depth
+        self.rrf_k = rrf_k
+        self.weights = weights
+        self.passages = retriever.passages
+
+    def retrieve(self, query: str, k: int = 3) -> List[Tuple[int, float, str]]:
+        """Return list of (index, fused_score, passage) sorted by score desc."""
+        sparse = [i for i, score, _ in self.retriever.retrieve(query, k=self.depth) if score > 0]
+        dense = [i for i, _, _ in self.dense.retrieve(query, k=self.depth)]
+        fused = reciprocal_rank_fusion([sparse, dense], k=self.rrf_k, weights=self.weights)
+        return [(idx, score, self.passages[idx]) for idx, score in fused[:k]]
+
+
+def build_hybrid_searcher(retriever, reranker, **kwargs) -> HybridSearcher:
+    dense = DenseRetriever.from_reranker(reranker, cache=getattr(retriever, 'cache', None), **kwargs)
+    return HybridSearcher(retriever, dense)
@@ -5,53 +5,166 @@ hybrid_retriever.py
 Re-rank TF-IDF candidate passages using semantic embeddings.
 
 API:
+ - Reranker(model_name=None, dtype='float32'): keeps the embedding model resident
+   - attach(retriever): encode every passage once (cached next to the TF-IDF index)
+   - rerank(query, candidates, top_k=3): one query encode + gather-and-dot
+ - get_default_reranker(retriever=None): shared Reranker instance
  - rerank_candidates(query: str, candidates: List[Tuple[index, score, passage]], top_k=3, model_name=None)
 
 If sentence-transformers is not installed, this module will return the original
 TF-IDF ranking (graceful fallback).
 """
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+import os
+import re
+import threading
 import numpy as np
 
-try:
-    from sentence_transformers import SentenceTransformer
-except Exception:
-    SentenceTransformer = None
+# sentence-transformers (and torch) are imported on first use, see _load_sentence_transformers
+SentenceTransformer = None
 
 
-def rerank_candidates(query: str, candidates: List[Tuple[int, float, str]], top_k: int = 3, model_name: Optional[str] = None):
-    """Return top_k candidates re-ranked by cosine similarity of embeddings.
+def _load_sentence_transformers() -> bool:
+    global SentenceTransformer
+    if SentenceTransformer is None:
+        try:
+            from sentence_transformers import SentenceTransformer as model_class
+        except Exception:
+            return False
+        SentenceTransformer = model_class
+    return True
 
-    candidates: list of (index, score, passage)
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    denom = np.linalg.norm(x, axis=-1, keepdims=True)
+    denom[denom == 0] = 1e-8
+    return x / denom
+
+
+class Reranker:
+    """Sentence-transformers model loaded once, plus a passage-embedding matrix.
+
+    The matrix holds one L2-normalized row per retriever passage, so scoring
+    a candidate is a dot product with the query embedding. It is stored as
+    float32 by default; float16 halves the file and memory at a small cost
+    in precision (scores are always computed in float32).
     """
-    if SentenceTransformer is None:
-        # fallback: return top_k of input as-is
-        return candidates[:top_k]
 
-    model_name = model_name or 'all-MiniLM-L6-v2'
-    # force CPU device for stability
-    model = SentenceTransformer(model_name, device='cpu')
+    def __init__(self, model_name: Optional[str] = None, dtype: Optional[str] = None, model=None):
+        """`model` may be any object with a sentence-transformers style encode();
+        by default the named SentenceTransformer is loaded."""
+        if model is None and not _load_sentence_transformers():
+            raise ImportError("sentence-transformers is required for reranking. Install with: pip install sentence-transformers")
+        self.model_name = model_name or DEFAULT_MODEL
+        self.dtype = np.dtype(dtype or os.environ.get('RALSEI_EMBED_DTYPE', 'float32'))
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError(f"unsupported embedding dtype: {self.dtype}")
+        # force CPU device for stability
+        self.model = model if model is not None else SentenceTransformer(self.model_name, device='cpu')
+        self.embeddings: Optional[np.ndarray] = None
+        self.passages = None
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        emb = self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True)
+        return _normalize(np.asarray(emb, dtype=np.float32))
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return self.encode([query])[0]
+
+    def _artifact_name(self) -> str:
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', self.model_name).strip('_')
+        return f'embeddings-{slug}-{self.dtype.name}'
 
-    passages = [p[2] for p in candidates]
-    # compute embeddings
-    emb_pass = model.encode(passages, convert_to_numpy=True)
-    emb_q = model.encode([query], convert_to_numpy=True)[0]
+    def attach(self, retriever):
+        """Load (or compute and cache) embeddings for every passage of `retriever`."""
+        self.build_passage_embeddings(retriever.passages, getattr(retriever, 'cache', None))
+        return self
 
-    # cosine similarities
-    # normalize
-    def normalize(x):
-        denom = np.linalg.norm(x, axis=1, keepdims=True)
-        denom[denom == 0] = 1e-8
-        return x / denom
+    def build_passage_embeddings(self, passages, cache=None):
+        self.passages = passages
+        name = self._artifact_name()
+        if cache is not None and cache.has(name + '.npy') and cache.has(name + '.json'):
+            try:
+                info = cache.load_json(name + '.json')
+                emb = cache.load_array(name)
+                if info.get('key') == cache.key and emb.shape[0] == len(passages):
+                    self.embeddings = emb
+                    return self.embeddings
+            except (OSError, ValueError):
+                pass
 
-    emb_pass_n = normalize(emb_pass)
-    emb_q_n = emb_q / (np.linalg.norm(emb_q) + 1e-8)
+        emb = self.encode(list(passages)).astype(self.dtype)
+        self.embeddings = emb
+        if cache is not None:
+            try:
+                cache.save_array(name, emb)
+                cache.save_json(name + '.json', {'key': cache.key, 'model': self.model_name, 'dim': int(emb.shape[1])})
+            except OSError as e:
+                print('Warning: could not cache passage embeddings:', e)
+        return self.embeddings
 
-    sims = np.dot(emb_pass_n, emb_q_n)
-    idxs = np.argsort(sims)[::-1][:top_k]
+    def _indexed(self, candidates) -> bool:
+        """True if candidate indices point at the attached passages."""
+        if self.embeddings is None:
+            return False
+        n = self.embeddings.shape[0]
+        for i, _, passage in candidates:
+            if not 0 <= i < n or self.passages[i] != passage:
+                return False
+        return True
+
+    def rerank(self, query: str, candidates: List[Tuple[int, float, str]], top_k: int = 3):
+        """Return top_k candidates re-ranked by cosine similarity of embeddings.
+
+        Uses the precomputed matrix when attached; otherwise the candidate
+        passages are encoded on the fly (still without reloading the model).
+        """
+        if not candidates:
+            return []
+        q = self.encode_query(query)
+        if self._indexed(candidates):
+            idx = np.fromiter((c[0] for c in candidates), dtype=np.int64, count=len(candidates))
+            emb = np.asarray(self.embeddings[idx], dtype=np.float32)
+        else:
+            emb = self.encode([c[2] for c in candidates])
+        sims = emb @ q
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(candidates[int(i)][0], float(sims[i]), candidates[int(i)][2]) for i in top]
+
+
+_rerankers: Dict[str, Reranker] = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_default_reranker(retriever=None, model_name: Optional[str] = None) -> Reranker:
+    """Shared Reranker per model name; attaches `retriever` passages on first use."""
+    model_name = model_name or DEFAULT_MODEL
+    reranker = _rerankers.get(model_name)
+    if reranker is None or (retriever is not None and reranker.embeddings is None):
+        # several threads (server handlers) may ask at once: load the model and embed the passages once
+        with _rerankers_lock:
+            reranker = _rerankers.get(model_name)
+            if reranker is None:
+                reranker = _rerankers[model_name] = Reranker(model_name)
+            if retriever is not None and reranker.embeddings is None:
+                reranker.attach(retriever)
+    return reranker
+
+
+def rerank_candidates(query: str, candidates: List[Tuple[int, float, str]], top_k: int = 3, model_name: Optional[str] = None):
+    """Return top_k candidates re-ranked by cosine similarity of embeddings.
+
+    candidates: list of (index, score, passage)
+    """
+    if not _load_sentence_transformers():
+        # fallback: return top_k of input as-is
+        return candidates[:top_k]
 
-    reranked = [(candidates[int(i)][0], float(sims[i]), candidates[int(i)][2]) for i in idxs]
-    return reranked
+    return get_default_reranker(model_name=model_name).rerank(query, candidates, top_k=top_k)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+incremental_index.py
+
+TF-IDF index that can add, replace and delete documents without refitting.
+
+Terms are hashed into a fixed number of columns (sklearn HashingVectorizer),
+so there is no vocabulary to fit. The index is a list of immutable segments,
+each holding raw term counts for a batch of passages:
+
+ - add(doc_id, passages) vectorizes only the new passages into a new segment,
+   so a page is searchable a few milliseconds after it is scraped
+ - delete(doc_id) clears the document's rows in a per-segment "live" mask
+ - document frequencies are kept up to date on every change; query terms are
+   weighted with the current IDF, passage norms use the IDF at the time the
+   segment was built
+ - compact() merges all segments into one, drops deleted rows and recomputes
+   the passage norms with the current IDF. Once there are more than
+   `max_segments` segments it runs on a background thread; queries keep
+   using the old segments until the merged one is swapped in.
+
+A document is any group of passages under one id (a wiki page: its URL).
+Passage ids returned by retrieve() are stable for the life of the passage.
+
+API:
+ - IncrementalIndex(n_features=2**20, max_segments=8)
+   - add(doc_id, passages, metadata=None) / delete(doc_id)
+   - add_record(record): add or replace one scraped wiki page
+   - retrieve(query, k): [(passage_id, score, passage)]
+   - compact(background=False)
+   - check(): inconsistencies between n_live, df and the live rows ([] if none)
+   - save(directory) / IncrementalIndex.load(directory)
+ - build_from_wiki_json(json_path): index of every page in the scraped JSON
+ - stress_check(records): concurrent add/delete/compact, then check() the
+   index; run it with `python incremental_index.py --check`
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+try:
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from scipy.sparse import csr_matrix, vstack
+except Exception:
+    HashingVectorizer = None
+
+try:
+    from scripts.retriever import chunk_wiki_records
+except ImportError:
+    from retriever import chunk_wiki_records
+
+MANIFEST = 'manifest.json'
+
+
+class _Segment:
+    """Immutable batch of passages; only the live mask changes after creation."""
+
+    __slots__ = ('name', 'counts', 'pids', 'doc_ids', 'passages', 'metadata', 'norms', 'live')
+
+    def __init__(self, counts, pids: np.ndarray, doc_ids: List[str], passages: List[str],
+                 metadata: List[Optional[dict]], norms: np.ndarray, live: Optional[np.ndarray] = None,
+                 name: Optional[str] = None):
+        self.name = name or f'seg-{uuid.uuid4().hex[:12]}.npz'
+        self.counts = counts            # csr (rows, n_features) of raw term counts
+        self.pids = pids                # int64 passage id per row
+        self.doc_ids = doc_ids
+        self.passages = passages
+        self.metadata = metadata
+        self.norms = norms              # float32 TF-IDF L2 norm per row
+        self.live = np.ones(len(pids), dtype=bool) if live is None else live
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+
+class IncrementalIndex:
+    def __init__(self, n_features: int = 2 ** 20, max_segments: int = 8):
+        if HashingVectorizer is None:
+            raise ImportError("scikit-learn is required for the retriever. Install with: pip install scikit-learn")
+        self.n_features = n_features
+        self.max_segments = max_segments
+        self.vectorizer = HashingVectorizer(n_features=n_features, stop_words='english',
+                                            alternate_sign=False, norm=None)
+        self.df = np.zeros(n_features, dtype=np.int32)
+        self.n_live = 0
+        self._segments: Tuple[_Segment, ...] = ()
+        # doc_id -> [(segment, row), ...]
+        self._docs: Dict[str, List[Tuple[_Segment, int]]] = {}
+        self._next_pid = 0
+        self._lock = threading.RLock()
+        # held for a whole compaction, so a foreground one waits for a background one
+        self._compact_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+
+    # -- weights ---------------------------------------------------------
+
+    def idf(self, columns=None) -> np.ndarray:
+        """Smoothed IDF (as in TfidfVectorizer) of the given columns, or all of them."""
+        df = self.df if columns is None else self.df[columns]
+        return (np.log((1.0 + self.n_live) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    def _norms(self, counts) -> np.ndarray:
+        weighted = counts.data * self.idf(counts.indices)
+        sq = csr_matrix((weighted * weighted, counts.indices, counts.indptr), shape=counts.shape).sum(axis=1)
+        return np.sqrt(np.asarray(sq, dtype=np.float32).ravel())
+
+    def _df_delta(self, counts, rows, sign: int):
+        if len(rows):
+            cols = counts[rows].indices
+            np.add.at(self.df, cols, sign)
+
+    # -- updates ---------------------------------------------------------
+
+    def add(self, doc_id: str, passages: Sequence[str], metadata: Optional[Sequence[dict]] = None) -> List[int]:
+        """Add (or replace) a document; returns the new passage ids."""
+        passages = [p for p in passages if p and p.strip()]
+        meta = list(metadata) if metadata is not None else [None] * len(passages)
+        counts = self.vectorizer.transform(passages).tocsr().astype(np.float32) if passages else None
+        with self._lock:
+            self._delete_locked(doc_id)
+            if not passages:
+                return []
+            pids = np.arange(self._next_pid, self._next_pid + len(passages), dtype=np.int64)
+            self._next_pid += len(passages)
+            self._df_delta(counts, np.arange(len(passages)), 1)
+            self.n_live += len(passages)
+            seg = _Segment(counts, pids, [doc_id] * len(passages), list(passages), meta, self._norms(counts))
+            self._segments = self._segments + (seg,)
+            self._docs[doc_id] = [(seg, i) for i in range(len(passages))]
+            needs_compaction = len(self._segments) > self.max_segments
+        if needs_compaction:
+            self.compact(background=True)
+        return [int(p) for p in pids]
+
+    def add_record(self, record: dict, max_chars: int = 600) -> List[int]:
+        """Add or replace one scraped wiki page, keyed by its URL (or title)."""
+        passages, metadata = chunk_wiki_records([record], max_chars)
+        return self.add(record.get('url') or record.get('title', ''), passages, metadata)
+
+    def delete(self, doc_id: str) -> int:
+        """Remove a document; returns the number of passages removed."""
+        with self._lock:
+            return self._delete_locked(doc_id)
+
+    def _delete_locked(self, doc_id: str) -> int:
+        rows = self._docs.pop(doc_id, None)
+        if not rows:
+            return 0
+        for seg, row in rows:
+            if seg.live[row]:
+                seg.live[row] = False
+                self._df_delta(seg.counts, [row], -1)
+                self.n_live -= 1
+        return len(rows)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def __len__(self) -> int:
+        return self.n_live
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    # -- compaction ------------------------------------------------------
+
+    def compact(self, background: bool = False):
+        """Merge all segments into one, dropping deleted passages.
+
+        With background=True this returns immediately. At most one compaction
+        runs at a time: a foreground one first waits for a running background one.
+        """
+        if background:
+            with self._lock:
+                if self._compactor is not None and self._compactor.is_alive():
+                    return
+                self._compactor = threading.Thread(target=self._compact, name='index-compact', daemon=True)
+                self._compactor.start()
+            return
+        self._compact()
+
+    def wait(self):
+        """Block until a background compaction (if any) has finished."""
+        t = self._compactor
+        if t is not None:
+            t.join()
+
+    def _compact(self):
+        with self._compact_lock:
+            self._merge()
+
+    def _merge(self):
+        with self._lock:
+            old = self._segments
+            if len(old) <= 1 and all(s.live.all() for s in old):
+                return
+            # rows live at snapshot time; deletes that land meanwhile are re-applied below
+            keep = [np.flatnonzero(s.live) for s in old]
+
+        # the expensive part runs without the lock: queries and updates continue
+        counts = vstack([s.counts[k] for s, k in zip(old, keep)], format='csr')
+        pids = np.concatenate([s.pids[k] for s, k in zip(old, keep)])
+        doc_ids = [s.doc_ids[i] for s, k in zip(old, keep) for i in k]
+        passages = [s.passages[i] for s, k in zip(old, keep) for i in k]
+        metadata = [s.metadata[i] for s, k in zip(old, keep) for i in k]
+        norms = self._norms(counts)
+
+        with self._lock:
+            live = np.concatenate([s.live[k] for s, k in zip(old, keep)])
+            merged = _Segment(counts, pids, doc_ids, passages, metadata, norms, live)
+            added_since = self._segments[len(old):]
+            self._segments = (merged,) + added_since
+            for doc_id, rows in self._docs.items():
+                if any(seg in old for seg, _ in rows):
+                    self._docs[doc_id] = []
+            for i, doc_id in enumerate(doc_ids):
+                if live[i]:
+                    self._docs[doc_id].append((merged, i))
+
+    def check(self) -> List[str]:
+        """Problems found by recomputing n_live, df and the doc map from the live rows ([] if consistent)."""
+        with self._lock:
+            segments = self._segments
+            problems = []
+            df = np.zeros(self.n_features, dtype=np.int64)
+            live_rows = {}
+            for seg in segments:
+                rows = np.flatnonzero(seg.live)
+                np.add.at(df, seg.counts[rows].indices, 1)
+                for i in rows:
+                    live_rows.setdefault(seg.doc_ids[i], set()).add((id(seg), int(i)))
+            n_live = sum(len(rows) for rows in live_rows.values())
+            if n_live != self.n_live:
+                problems.append(f'n_live is {self.n_live}, {n_live} rows are live')
+            bad_df = np.flatnonzero(df != self.df)
+            if len(bad_df):
+                problems.append(f'df differs in {len(bad_df)} columns (min df {int(self.df.min())})')
+            for doc_id, rows in self._docs.items():
+                if {(id(seg), row) for seg, row in rows} != live_rows.pop(doc_id, set()):
+                    problems.append(f'{doc_id}: doc map does not match its live rows')
+                if any(seg not in segments for seg, _ in rows):
+                    problems.append(f'{doc_id}: doc map points at a merged-away segment')
+            for doc_id in live_rows:
+                problems.append(f'{doc_id}: live rows missing from the doc map')
+            return problems
+
+    # -- queries ---------------------------------------------------------
+
+    def retrieve(self, query: str, k: int = 3) -> List[Tuple[int, float, str]]:
+        """Return list of (passage_id, score, passage) sorted by score desc."""
+        return self.retrieve_many([query], k=k)[0]
+
+    def retrieve_many(self, queries: Sequence[str], k: int = 3) -> List[List[Tuple[int, float, str]]]:
+        if not len(queries):
+            return []
+        q = self.vectorizer.transform(list(queries)).tocsr().astype(np.float32)
+        with self._lock:
+            segments = self._segments
+            idf = self.idf(q.indices)
+        # weight query terms with IDF twice (query side and passage side), then L2-normalize the query
+        q.data *= idf
+        q_norm = np.sqrt(np.asarray(q.multiply(q).sum(axis=1)).ravel())
+        q_norm[q_norm == 0] = 1.0
+        q.data *= idf
+
+        scored = [(seg, (q @ seg.counts.T).toarray()) for seg in segments if len(seg)]
+        results = []
+        for row in range(q.shape[0]):
+            hits, sims = [], []
+            for n, (seg, scores) in enumerate(scored):
+                s = scores[row]
+                rows = np.flatnonzero((s > 0) & seg.live)
+                hits.extend((n, int(r)) for r in rows)
+                sims.append(s[rows] / (seg.norms[rows] * q_norm[row]))
+            sims = np.concatenate(sims) if sims else np.empty(0, dtype=np.float32)
+            results.append(self._top_k(scored, hits, sims, k))
+        return results
+
+    @staticmethod
+    def _top_k(scored, hits, sims: np.ndarray, k: int) -> List[Tuple[int, float, str]]:
+        """Best k distinct passages; the same text on several pages is returned once."""
+        if k <= 0:
+            return []
+        out: List[Tuple[int, float, str]] = []
+        seen = set()
+        # a few spare candidates absorb duplicates; fall back to a full sort if they don't
+        for depth in (min(len(sims), 4 * k), len(sims)):
+            top = np.argpartition(-sims, depth - 1)[:depth] if 0 < depth < len(sims) else np.arange(len(sims))
+            top = top[np.argsort(-sims[top], kind='stable')]
+            out.clear()
+            seen.clear()
+            for j in top:
+                n, r = hits[j]
+                seg = scored[n][0]
+                if seg.passages[r] in seen:
+                    continue
+                seen.add(seg.passages[r])
+                out.append((int(seg.pids[r]), float(sims[j]), seg.passages[r]))
+                if len(out) == k:
+                    return out
+        return out
+
+    def passage_meta(self, pid: int) -> Optional[dict]:
+        # passage ids only grow, and segments keep them in order
+        for seg in self._segments:
+            i = int(np.searchsorted(seg.pids, pid))
+            if i < len(seg) and seg.pids[i] == pid:
+                return seg.metadata[i]
+        return None
+
+    # -- persistence -----------------------------------------------------
+
+    def save(self, directory: str):
+        """Write new segments and the manifest (last); existing segment files are never rewritten."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            segments = self._segments
+            next_pid = self._next_pid
+        names = []
+        for seg in segments:
+            if not os.path.exists(os.path.join(directory, seg.name)):
+                self._write_segment(os.path.join(directory, seg.name), seg)
+            names.append(seg.name)
+        manifest = {
+            'format': 1,
+            'n_features': self.n_features,
+            'next_pid': next_pid,
+            'segments': [{'name': n, 'live': np.flatnonzero(~s.live).tolist()} for n, s in zip(names, segments)],
+        }
+        tmp = os.path.join(directory, MANIFEST + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(directory, MANIFEST))
+        # segment files no longer referenced (merged away) can go
+        for name in os.listdir(directory):
+            if name.startswith('seg-') and name.endswith('.npz') and name not in names:
+                os.remove(os.path.join(directory, name))
+
+    @staticmethod
+    def _write_segment(path: str, seg: _Segment):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f,
+                data=seg.counts.data, indices=seg.counts.indices, indptr=seg.counts.indptr,
+                pids=seg.pids, norms=seg.norms,
+                docs=np.frombuffer(json.dumps({'doc_ids': seg.doc_ids, 'passages': seg.passages,
+                                               'metadata': seg.metadata}, ensure_ascii=False).encode('utf-8'),
+                                   dtype=np.uint8),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: str, max_segments: int = 8) -> 'IncrementalIndex':
+        with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        index = cls(n_features=manifest['n_features'], max_segments=max_segments)
+        segments = []
+        for entry in manifest['segments']:
+            with np.load(os.path.join(directory, entry['name']), allow_pickle=False) as z:
+                counts = csr_matrix((z['data'], z['indices'], z['indptr']),
+                                    shape=(len(z['indptr']) - 1, index.n_features))
+                docs = json.loads(z['docs'].tobytes().decode('utf-8'))
+                live = np.ones(len(z['pids']), dtype=bool)
+                live[np.asarray(entry['live'], dtype=np.int64)] = False
+                seg = _Segment(counts, z['pids'], docs['doc_ids'], docs['passages'], docs['metadata'],
+                               z['norms'], live, name=entry['name'])
+            segments.append(seg)
+            rows = np.flatnonzero(seg.live)
+            index._df_delta(counts, rows, 1)
+            index.n_live += len(rows)
+            for i in rows:
+                index._docs.setdefault(seg.doc_ids[i], []).append((seg, int(i)))
+        index._segments = tuple(segments)
+        index._next_pid = manifest['next_pid']
+        return index
+
+
+def build_from_wiki_json(json_path: str, max_chars: int = 600, **kwargs) -> IncrementalIndex:
+    """One document per page of the scraped JSON (later duplicates of a URL replace earlier ones)."""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    index = IncrementalIndex(**kwargs)
+    for record in records:
+        index.add_record(record, max_chars)
+    index.compact()
+    return index
+
+
+def stress_check(records: Sequence[dict], threads: int = 4, rounds: int = 3, max_segments: int = 4) -> List[str]:
+    """Add, replace, delete and compact from several threads at once, then check() the index."""
+    index = IncrementalIndex(max_segments=max_segments)
+
+    def worker(n: int):
+        mine = records[n::threads]
+        for r in range(rounds):
+            for i, record in enumerate(mine):
+                index.add_record(record)
+                if i % 7 == r:
+                    index.delete(record.get('url') or record.get('title', ''))
+                if i % 25 == 0:
+                    index.compact(background=n % 2 == 0)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    index.compact()
+    problems = index.check()
+    if index.segment_count != 1:
+        problems.append(f'{index.segment_count} segments after a final compact()')
+    return problems
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    try:
+        from scripts.retriever import default_data_path
+    except ImportError:
+        from retriever import default_data_path
+    if '--check' in sys.argv:
+        # regression check: concurrent updates and compactions keep n_live, df and the doc map in sync
+        with open(default_data_path('deltarune_wiki_data.json'), 'r', encoding='utf-8') as f:
+            problems = stress_check(json.load(f))
+        print('\n'.join(problems) or 'index consistent')
+        sys.exit(1 if problems else 0)
+    t0 = time.perf_counter()
+    idx = build_from_wiki_json(default_data_path('deltarune_wiki_data.json'))
+    print(f'{len(idx)} passages in {time.perf_counter() - t0:.2f}s')
+    t0 = time.perf_counter()
+    idx.add_record({'title': 'Test Page', 'url': 'test://page',
+                    'content': [{'type': 'p', 'content': 'Ralsei bakes a fluffy cake for Kris.'}]})
+    print(f'added a page in {(time.perf_counter() - t0) * 1000:.1f} ms')
+    query = input('query: ')
+    for pid, score, passage in idx.retrieve(query, k=5):
+        snippet = passage[:200].replace('\n', ' ')
+        print(f'[{pid}] {score:.3f} {snippet}')
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+index_cache.py
+
+On-disk cache for retrieval index artifacts.
+
+A cache is a directory holding a `meta.json` that records the source file it
+was built from (size, mtime, sha256) and the build parameters, next to any
+number of `.npy` arrays and small JSON/text files. Arrays are loaded with
+memory-mapping, so opening a cached index does not cost more as the corpus
+grows.
+
+`meta.json` is written last and removed first, so a half-written cache is
+always treated as stale.
+
+API:
+ - sha256_file(path): hex digest of a file's contents
+ - default_cache_dir(source_path): where caches for a source file live
+ - IndexCache(cache_dir, source_path, params): freshness check + load/save helpers
+"""
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+META_NAME = 'meta.json'
+
+
+def sha256_file(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def default_cache_dir(source_path: str) -> str:
+    """Cache root for a source file; RALSEI_INDEX_DIR overrides the location."""
+    root = os.environ.get('RALSEI_INDEX_DIR')
+    if not root:
+        root = os.path.join(os.path.dirname(os.path.abspath(source_path)), '.ralsei_index')
+    return os.path.join(root, os.path.basename(source_path))
+
+
+class IndexCache:
+    def __init__(self, cache_dir: str, source_path: str, params: Dict[str, Any]):
+        self.cache_dir = cache_dir
+        self.source_path = source_path
+        self.params = dict(params)
+        self._sha256: Optional[str] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def load_meta(self) -> Optional[dict]:
+        try:
+            with open(self._path(META_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self) -> bool:
+        """True if the cache was built from the current source with the same params.
+
+        Size and mtime are checked first so an unchanged file costs a single
+        stat(); the content hash is only computed when the mtime moved.
+        """
+        meta = self.load_meta()
+        if not meta or meta.get('format') != FORMAT_VERSION or meta.get('params') != self.params:
+            return False
+        try:
+            st = os.stat(self.source_path)
+        except OSError:
+            return False
+        if st.st_size != meta.get('size'):
+            return False
+        if st.st_mtime_ns == meta.get('mtime_ns'):
+            self._sha256 = meta.get('sha256')
+            return True
+        if self.sha256() != meta.get('sha256'):
+            return False
+        # same content, touched file: refresh the stat so the next start is fast
+        meta['mtime_ns'] = st.st_mtime_ns
+        try:
+            self._write_json(META_NAME, meta)
+        except OSError:
+            pass
+        return True
+
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = sha256_file(self.source_path)
+        return self._sha256
+
+    @property
+    def key(self) -> str:
+        """Stable identifier of (source contents, params); used to key derived artifacts."""
+        params = json.dumps(self.params, sort_keys=True)
+        return hashlib.sha256((self.sha256() + params).encode('utf-8')).hexdigest()[:16]
+
+    def invalidate(self):
+        """Drop the commit marker before (re)writing artifacts."""
+        try:
+            os.remove(self._path(META_NAME))
+        except FileNotFoundError:
+            pass
+        # the source may have changed since we last hashed it
+        self._sha256 = None
+
+    def commit(self, st: Optional[os.stat_result] = None):
+        """Write meta.json; `st` should be the source stat taken before reading it."""
+        if st is None:
+            st = os.stat(self.source_path)
+        meta = {
+            'format': FORMAT_VERSION,
+            'params': self.params,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sha256': self.sha256(),
+        }
+        self._write_json(META_NAME, meta)
+
+    def has(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def save_array(self, name: str, arr: np.ndarray):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self._path(name + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(arr), allow_pickle=False)
+        os.replace(tmp, self._path(name + '.npy'))
+
+    def load_array(self, name: str, mmap: bool = True) -> np.ndarray:
+        return np.load(self._path(name + '.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+    def save_bytes(self, name: str, data: bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self._path(name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(name))
+
+    def path(self, name: str) -> str:
+        return self._path(name)
+
+    def save_json(self, name: str, obj: Any):
+        self._write_json(name, obj)
+
+    def load_json(self, name: str) -> Any:
+        with open(self._path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_json(self, name: str, obj: Any):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self._path(name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp, self._path(name))
@@ -7,12 +7,27 @@ write them as plain text (one item per line) to an output file.
 
 Usage:
     python scripts/json_to_text.py input.json output.txt
+    python scripts/json_to_text.py --stream input.json|input.jsonl output.txt
 
 This keeps only the textual contents and removes JSON punctuation/structure.
+
+By default the whole file is loaded and the unique lines are written sorted.
+With --stream (always used for .jsonl input) the file is read incrementally,
+one top-level document at a time (the elements of a top-level array, or one
+value per line of a JSONL scrape). Lines keep their document order, each
+document (wiki page) is followed by a blank line, and output is written in
+buffered chunks. Repeated lines are dropped using a set of 64-bit hashes
+(8 bytes per unique line, whatever its length). Memory stays bounded by the
+largest single document plus the hash set.
 """
-import sys
+from array import array
+from hashlib import blake2b
+from typing import Any, Iterator, List, Set, TextIO
+import argparse
 import json
-from typing import Any, Set
+
+READ_CHUNK = 1 << 16
+WRITE_CHUNK = 1 << 20
 
 
 def extract_texts(obj: Any, texts: Set[str]):
@@ -40,22 +55,177 @@ def extract_texts(obj: Any, texts: Set[str]):
         return
 
 
+def iter_texts(obj: Any) -> Iterator[str]:
+    """Same values as extract_texts, in document order (repeats included)."""
+    if obj is None:
+        return
+    if isinstance(obj, str):
+        s = obj.strip()
+        if s:
+            yield s
+    elif isinstance(obj, (int, float)):
+        yield str(obj)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            if isinstance(k, str) and k.strip():
+                yield k.strip()
+            yield from iter_texts(v)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            yield from iter_texts(item)
+
+
+class HashSet:
+    """Open-addressing set of 64-bit BLAKE2b hashes of strings.
+
+    Each slot is 8 bytes however long the string; the table doubles when
+    3/4 full. Two different strings sharing a hash (odds ~n^2 / 2^65) would
+    drop the second one.
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._slots = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._count = 0
+
+    @staticmethod
+    def _hash(text: str) -> int:
+        # 0 marks an empty slot
+        return int.from_bytes(blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    def _insert(self, h: int) -> bool:
+        slots, mask = self._slots, self._mask
+        i = h & mask
+        while True:
+            v = slots[i]
+            if v == 0:
+                slots[i] = h
+                self._count += 1
+                return True
+            if v == h:
+                return False
+            i = (i + 1) & mask
+
+    def add(self, text: str) -> bool:
+        """Add `text`; True if it was not in the set yet."""
+        if not self._insert(self._hash(text)):
+            return False
+        if self._count * 4 > len(self._slots) * 3:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self._slots
+        self._slots = array('Q', bytes(16 * len(old)))
+        self._mask = len(self._slots) - 1
+        self._count = 0
+        for h in old:
+            if h:
+                self._insert(h)
+
+    def __len__(self) -> int:
+        return self._count
+
+
+def iter_documents(f: TextIO, chunk_size: int = READ_CHUNK) -> Iterator[Any]:
+    """Top-level documents of a JSON file, decoded one at a time.
+
+    A top-level array yields its elements; otherwise each whitespace-separated
+    value (one per line in JSONL) is a document. Only the text of the
+    document being decoded is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        # read at least as much as is buffered, so a large document costs O(n) retries
+        chunk = f.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def skip(chars: str) -> bool:
+        """Skip `chars`; False at end of input."""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf):
+                return True
+            if eof:
+                return False
+            fill()
+
+    in_array = False
+    if skip(' \t\r\n') and buf[pos] == '[':
+        in_array = True
+        pos += 1
+    while skip(' \t\r\n,' if in_array else ' \t\r\n'):
+        if in_array and buf[pos] == ']':
+            in_array = False
+            pos += 1
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if (not eof and isinstance(obj, (int, float)) and not isinstance(obj, bool)
+                and (end == len(buf) or buf[end] not in ' \t\r\n,]}')):
+            fill()  # the number may be cut at the chunk end ("2." of "2.5"): decode again
+            continue
+        pos = end
+        yield obj
+
+
+def convert_streaming(in_path: str, out_path: str) -> dict:
+    """Write the unique lines of each document in order, a blank line after each."""
+    seen = HashSet()
+    pending: List[str] = []
+    pending_size = 0
+    documents = lines = 0
+    with open(in_path, 'r', encoding='utf-8') as src, open(out_path, 'w', encoding='utf-8') as out:
+        for doc in iter_documents(src):
+            documents += 1
+            new = [s for s in iter_texts(doc) if seen.add(s)]
+            if not new:
+                continue
+            lines += len(new)
+            pending.append('\n'.join(new) + '\n\n')
+            pending_size += len(pending[-1])
+            if pending_size >= WRITE_CHUNK:
+                out.write(''.join(pending))
+                pending, pending_size = [], 0
+        out.write(''.join(pending))
+    return {'documents': documents, 'lines': lines}
+
+
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: json_to_text.py input.json output.txt")
-        sys.exit(2)
+    parser = argparse.ArgumentParser(description='Extract the text values of a JSON file, one per line.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--stream', action='store_true',
+                        help='read incrementally, keep document order, blank line between documents')
+    args = parser.parse_args()
 
-    in_path = sys.argv[1]
-    out_path = sys.argv[2]
+    if args.stream or args.input.endswith('.jsonl'):
+        stats = convert_streaming(args.input, args.output)
+        print(f"{stats['lines']} lines from {stats['documents']} documents")
+        return
 
-    with open(in_path, "r", encoding="utf-8") as f:
+    with open(args.input, "r", encoding="utf-8") as f:
         data = json.load(f)
 
     texts = set()
     extract_texts(data, texts)
 
     # write sorted to produce stable output
-    with open(out_path, "w", encoding="utf-8") as f:
+    with open(args.output, "w", encoding="utf-8") as f:
         for line in sorted(texts):
             f.write(line + "\n")
 
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+response_cache.py
+
+Cache of generated answers that sits between build_rag_prompt and the LLM.
+
+Two lookup layers:
+ - exact: normalized question + the ids of the retrieved passages
+ - semantic: cosine similarity of question embeddings above `threshold`,
+   for near-duplicate phrasings ("who's ralsei" / "Who is Ralsei?")
+
+Entries are evicted least-recently-used beyond `max_entries` and expire after
+`ttl` seconds (if set). With a `path` the cache is saved as JSON after each
+insert and loaded again on the next start.
+
+Answers depend on the model that wrote them: `namespace` (e.g.
+'ollama:ralseiModel') is saved with every entry, and entries from another
+namespace are dropped on load, so switching models starts an empty cache.
+
+API:
+ - ResponseCache(max_entries=256, ttl=None, threshold=0.92, encoder=None, path=None, namespace='')
+   - get(query, passage_ids): cached response or None
+   - put(query, passage_ids, response)
+   - stats(): hit/miss counters
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+_PUNCT = re.compile(r'[^\w\s]')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    return _SPACE.sub(' ', _PUNCT.sub(' ', query.lower())).strip()
+
+
+class _Entry:
+    __slots__ = ('query', 'passage_ids', 'response', 'created', 'embedding')
+
+    def __init__(self, query: str, passage_ids: List[int], response: str, created: float,
+                 embedding: Optional[np.ndarray] = None):
+        self.query = query
+        self.passage_ids = passage_ids
+        self.response = response
+        self.created = created
+        self.embedding = embedding
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None, threshold: float = 0.92,
+                 encoder: Optional[Callable[[str], np.ndarray]] = None, path: Optional[str] = None,
+                 namespace: str = ''):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.encoder = encoder
+        self.path = path
+        self.namespace = namespace
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None   # stacked embeddings, rebuilt lazily
+        self._matrix_keys: List[str] = []
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                self.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print('Warning: could not load response cache:', e)
+
+    @staticmethod
+    def make_key(query: str, passage_ids: Sequence[int]) -> str:
+        return normalize_query(query) + '|' + ','.join(str(int(i)) for i in passage_ids)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl is not None and now - entry.created > self.ttl
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if self.encoder is None:
+            return None
+        v = np.asarray(self.encoder(query), dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def _semantic_lookup(self, q: np.ndarray, now: float) -> Optional[str]:
+        if self._matrix is None:
+            keys = [k for k, e in self._entries.items() if e.embedding is not None and e.embedding.shape == q.shape]
+            if not keys:
+                return None
+            self._matrix_keys = keys
+            self._matrix = np.stack([self._entries[k].embedding for k in keys])
+        sims = self._matrix @ q
+        for i in np.argsort(-sims):
+            if sims[i] < self.threshold:
+                break
+            key = self._matrix_keys[int(i)]
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, now):
+                continue
+            self._entries.move_to_end(key)
+            return entry.response
+        return None
+
+    def get(self, query: str, passage_ids: Sequence[int]) -> Optional[str]:
+        """Cached response for the query, or None (counted as a miss)."""
+        now = time.time()
+        key = self.make_key(query, passage_ids)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self._entries.move_to_end(key)
+                    self.hits_exact += 1
+                    return entry.response
+                self._remove(key)
+        q = self._embed(query)
+        with self._lock:
+            if q is not None:
+                response = self._semantic_lookup(q, now)
+                if response is not None:
+                    self.hits_semantic += 1
+                    return response
+            self.misses += 1
+        return None
+
+    def put(self, query: str, passage_ids: Sequence[int], response: str):
+        if not response or not response.strip():
+            return
+        key = self.make_key(query, passage_ids)
+        emb = self._embed(query)
+        with self._lock:
+            self._entries[key] = _Entry(query, [int(i) for i in passage_ids], response, time.time(), emb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+        if self.path:
+            try:
+                self.save(self.path)
+            except OSError as e:
+                print('Warning: could not save response cache:', e)
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits_exact': self.hits_exact,
+            'hits_semantic': self.hits_semantic,
+            'misses': self.misses,
+            'hit_rate': (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+        }
+
+    def save(self, path: str):
+        with self._lock:
+            records = [
+                {
+                    'namespace': self.namespace,
+                    'query': e.query,
+                    'passage_ids': e.passage_ids,
+                    'response': e.response,
+                    'created': e.created,
+                    'embedding': e.embedding.tolist() if e.embedding is not None else None,
+                }
+                for e in self._entries.values()
+            ]
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def load(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        now = time.time()
+        with self._lock:
+            for r in records:
+                if r.get('namespace', '') != self.namespace:
+                    continue  # written by another backend or model
+                emb = r.get('embedding')
+                entry = _Entry(r['query'], r['passage_ids'], r['response'], r['created'],
+                               np.asarray(emb, dtype=np.float32) if emb is not None else None)
+                if not self._expired(entry, now):
+                    self._entries[self.make_key(entry.query, entry.passage_ids)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
@@ -7,74 +7,455 @@ Simple TF-IDF based retriever for local RAG experiments.
 Functions:
  - build_index(text_path, chunk_size, overlap): loads and chunks a text file
  - retrieve(query, k): returns top-k passages for a query
+ - retrieve_many(queries, k): top-k passages for each of several queries at once
+ - chunk_wiki_records(records, max_chars): structure-aware passages from the
+   scraped wiki JSON (whole paragraphs/list items, split at sentence ends)
+ - WikiRetriever(json_path): retriever over those passages; each passage
+   carries its page title, URL and element type, and retrieval can filter
+   or boost by page title
+ - build_default_retriever(): the retriever the chat app uses (see also
+   bm25.py, selected with RALSEI_RETRIEVER=bm25)
 
 This is lightweight and depends on scikit-learn. If scikit-learn is not
 installed, the module will still import but raise a clear error when used.
+
+The fitted index (vocabulary, IDF weights, CSR matrix arrays and passage
+offsets) is cached on disk next to the source file (see index_cache.py) and
+memory-mapped on the next start; it is rebuilt only when the source contents
+or chunk_size/overlap change.
 """
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import json
+import mmap
 import os
 import math
+import re
+
+# scikit-learn is imported on first use (see _load_sklearn): importing this
+# module stays cheap, and the import cost lands in whichever thread builds the index
+TfidfVectorizer = None
 
 try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
-except Exception as e:
-    TfidfVectorizer = None
-    cosine_similarity = None
+    import numpy as np
+    try:
+        from scripts.index_cache import IndexCache, default_cache_dir
+    except ImportError:
+        from index_cache import IndexCache, default_cache_dir
+except Exception:
+    IndexCache = None
+
+
+def chunk_text(text: str, chunk_size: int = 400, overlap: int = 100) -> List[str]:
+    # naive chunking by characters preserving overlap
+    passages = []
+    start = 0
+    text_len = len(text)
+    while start < text_len:
+        end = start + chunk_size
+        passages.append(text[start:end].strip())
+        if end >= text_len:
+            break
+        start = end - overlap
+    return [p for p in passages if p]
+
+
+class PassageStore(Sequence):
+    """Read-only list of passages backed by a memory-mapped UTF-8 blob.
+
+    offsets holds n+1 byte offsets; passage i is blob[offsets[i]:offsets[i+1]].
+    Passages are decoded on access, so opening the store is O(1).
+    """
+
+    def __init__(self, blob_path: str, offsets):
+        self._offsets = offsets
+        self._file = open(blob_path, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buf = b''
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('passage index out of range')
+        return self._buf[int(self._offsets[i]):int(self._offsets[i + 1])].decode('utf-8')
+
+
+def save_passages(cache, passages: Sequence[str]):
+    """Write passages as one UTF-8 blob plus byte offsets (read back with load_passages)."""
+    encoded = [p.encode('utf-8') for p in passages]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    cache.save_bytes('passages.bin', b''.join(encoded))
+    cache.save_array('passage_offsets', offsets)
+
+
+def load_passages(cache) -> PassageStore:
+    return PassageStore(cache.path('passages.bin'), cache.load_array('passage_offsets'))
+
+
+def _load_sklearn() -> bool:
+    global TfidfVectorizer
+    if TfidfVectorizer is None:
+        try:
+            from sklearn.feature_extraction.text import TfidfVectorizer as vectorizer
+        except Exception:
+            return False
+        TfidfVectorizer = vectorizer
+    return True
 
 
 class Retriever:
-    def __init__(self, text_path: str, chunk_size: int = 400, overlap: int = 100):
+    def __init__(self, text_path: str, chunk_size: int = 400, overlap: int = 100,
+                 cache_dir: Optional[str] = None, use_cache: bool = True):
         self.text_path = text_path
         self.chunk_size = chunk_size
         self.overlap = overlap
-        self.passages: List[str] = []
+        self.passages: Sequence[str] = []
         self.vectorizer = None
         self.tfidf_matrix = None
+        self.cache = None
+        if use_cache and IndexCache is not None:
+            self.cache = IndexCache(cache_dir or default_cache_dir(text_path), text_path, self._cache_params())
         self._build_index()
 
+    def _cache_params(self) -> dict:
+        return {'kind': 'tfidf', 'chunk_size': self.chunk_size, 'overlap': self.overlap}
+
     def _load_text(self) -> str:
         with open(self.text_path, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def _load_passages(self) -> List[str]:
+        return self._chunk_text(self._load_text())
+
     def _chunk_text(self, text: str) -> List[str]:
-        # naive chunking by characters preserving overlap
-        passages = []
-        start = 0
-        text_len = len(text)
-        while start < text_len:
-            end = start + self.chunk_size
-            passages.append(text[start:end].strip())
-            if end >= text_len:
-                break
-            start = end - self.overlap
-        return [p for p in passages if p]
+        return chunk_text(text, self.chunk_size, self.overlap)
 
     def _build_index(self):
-        if TfidfVectorizer is None:
+        if not _load_sklearn():
             raise ImportError("scikit-learn is required for the retriever. Install with: pip install scikit-learn")
 
-        text = self._load_text()
-        self.passages = self._chunk_text(text)
+        if self.cache is not None and self.cache.is_fresh():
+            try:
+                self._load_cached_index()
+                return
+            except (OSError, ValueError, KeyError):
+                pass  # damaged cache: rebuild below
+
+        st = os.stat(self.text_path)
+        self.passages = self._load_passages()
 
         # use TF-IDF with simple preprocessing
-        self.vectorizer = TfidfVectorizer(stop_words='english')
+        self.vectorizer = self._new_vectorizer()
         self.tfidf_matrix = self.vectorizer.fit_transform(self.passages)
 
+        if self.cache is not None:
+            try:
+                self._save_index(st)
+            except OSError as e:
+                print('Warning: could not write index cache:', e)
+
+    @staticmethod
+    def _new_vectorizer():
+        return TfidfVectorizer(stop_words='english')
+
+    def _save_index(self, st: os.stat_result):
+        cache = self.cache
+        cache.invalidate()
+        m = self.tfidf_matrix.tocsr()
+        cache.save_array('tfidf_data', m.data)
+        cache.save_array('tfidf_indices', m.indices)
+        cache.save_array('tfidf_indptr', m.indptr)
+        cache.save_array('tfidf_shape', np.asarray(m.shape, dtype=np.int64))
+        cache.save_array('idf', self.vectorizer.idf_)
+        # vocabulary_ maps term -> column; store terms in column order, one per line
+        terms = [''] * len(self.vectorizer.vocabulary_)
+        for term, col in self.vectorizer.vocabulary_.items():
+            terms[col] = term
+        cache.save_bytes('vocabulary.txt', '\n'.join(terms).encode('utf-8'))
+
+        save_passages(cache, self.passages)
+        cache.commit(st)
+
+    def _load_cached_index(self):
+        from scipy.sparse import csr_matrix
+        cache = self.cache
+        with open(cache.path('vocabulary.txt'), 'r', encoding='utf-8') as f:
+            terms = f.read().split('\n')
+        vectorizer = self._new_vectorizer()
+        vectorizer.vocabulary_ = {t: i for i, t in enumerate(terms) if t}
+        vectorizer.idf_ = np.asarray(cache.load_array('idf'))
+        shape = tuple(int(x) for x in cache.load_array('tfidf_shape', mmap=False))
+        matrix = csr_matrix(
+            (cache.load_array('tfidf_data'), cache.load_array('tfidf_indices'), cache.load_array('tfidf_indptr')),
+            shape=shape,
+            copy=False,
+        )
+        self.passages = load_passages(cache)
+        self.vectorizer = vectorizer
+        self.tfidf_matrix = matrix
+
     def retrieve(self, query: str, k: int = 3) -> List[Tuple[int, float, str]]:
         """Return list of (index, score, passage) sorted by score desc."""
+        return self.retrieve_many([query], k=k)[0]
+
+    def retrieve_many(self, queries: Sequence[str], k: int = 3) -> List[List[Tuple[int, float, str]]]:
+        """Top-k (index, score, passage) lists, one per query.
+
+        All queries are vectorized in one transform and scored with a single
+        sparse-by-sparse product (TF-IDF rows are L2-normalized, so the dot
+        product is the cosine similarity). Only passages sharing a term with
+        the query are candidates; top-k uses argpartition, not a full sort.
+        """
+        if not len(queries):
+            return []
+        scores = self._score(queries)
+        return [self._top_k(scores, row, k) for row in range(scores.shape[0])]
+
+    def _score(self, queries: Sequence[str]):
+        """CSR matrix of query-by-passage cosine similarities (nonzeros only)."""
         if self.tfidf_matrix is None:
             raise RuntimeError("Index not built")
-        q_vec = self.vectorizer.transform([query])
-        sims = cosine_similarity(q_vec, self.tfidf_matrix)[0]
-        idxs = sims.argsort()[::-1][:k]
-        return [(int(i), float(sims[i]), self.passages[i]) for i in idxs]
+        q_mat = self.vectorizer.transform(list(queries))
+        return (q_mat @ self.tfidf_matrix.T).tocsr()
+
+    def _top_k(self, scores, row: int, k: int, allowed=None) -> List[Tuple[int, float, str]]:
+        """Top-k of one score row; `allowed` optionally restricts the passage indices."""
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        idx = scores.indices[start:end]
+        sims = scores.data[start:end]
+        if allowed is not None:
+            keep = allowed[idx]
+            idx, sims = idx[keep], sims[keep]
+            n = int(np.count_nonzero(allowed))
+        else:
+            n = self.tfidf_matrix.shape[0]
+        k = max(0, min(k, n))
+        if len(sims) > k:
+            part = np.argpartition(-sims, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        else:
+            part = np.arange(len(sims))
+        part = part[np.argsort(-sims[part], kind='stable')]
+        top = [(int(idx[j]), float(sims[j])) for j in part]
+        if len(top) < k:
+            # fewer matching passages than k: pad with zero-score ones like a full ranking would
+            seen = set(i for i, _ in top)
+            pool = np.flatnonzero(allowed) if allowed is not None else range(self.tfidf_matrix.shape[0])
+            for i in pool:
+                if len(top) >= k:
+                    break
+                if int(i) not in seen:
+                    top.append((int(i), 0.0))
+        return [(i, score, self.passages[i]) for i, score in top]
+
+
+_SENTENCE_END = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+')
+
+
+def _split_sentences(text: str, max_chars: int) -> List[str]:
+    """Pieces of `text` no longer than max_chars, cut at sentence ends where possible."""
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            # a single overlong sentence: cut at the last space that fits
+            cut = sentence.rfind(' ', 0, max_chars + 1)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(sentence[:cut].rstrip())
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def chunk_wiki_records(records: Iterable[dict], max_chars: int = 600) -> Tuple[List[str], List[dict]]:
+    """Passages and their metadata from scraped wiki records.
+
+    Each record is {'title', 'url', 'content': [{'type', 'content'}, ...]}.
+    Consecutive elements of the same page and type are packed together up to
+    max_chars; an element longer than that is split at sentence boundaries.
+    Chunks never span two pages and never overlap. Elements repeated
+    verbatim (the scrape has duplicate pages) are indexed once.
+
+    Returns (passages, metadata) with metadata[i] = {'title', 'url', 'type'}.
+    """
+    passages: List[str] = []
+    metadata: List[dict] = []
+    seen = set()
+
+    for record in records:
+        title = record.get('title', '')
+        url = record.get('url', '')
+        buf: List[str] = []
+        buf_len = 0
+        buf_type = None
+
+        def flush():
+            nonlocal buf, buf_len
+            if buf:
+                passages.append('\n'.join(buf))
+                metadata.append({'title': title, 'url': url, 'type': buf_type})
+            buf = []
+            buf_len = 0
+
+        for element in record.get('content', []):
+            text = ' '.join(str(element.get('content', '')).split())
+            if not text or text in seen:
+                continue
+            seen.add(text)
+            kind = element.get('type', 'p')
+            if kind != buf_type:
+                flush()
+                buf_type = kind
+            pieces = [text] if len(text) <= max_chars else _split_sentences(text, max_chars)
+            for piece in pieces:
+                if buf and buf_len + 1 + len(piece) > max_chars:
+                    flush()
+                buf.append(piece)
+                buf_len += len(piece) + (1 if buf_len else 0)
+        flush()
+    return passages, metadata
+
+
+class WikiRetriever(Retriever):
+    """TF-IDF retriever over structure-aware passages of deltarune_wiki_data.json.
+
+    retrieve()/retrieve_many() take two optional arguments:
+     - titles: only return passages from these pages (case-insensitive)
+     - title_boost: multiply the score of passages whose page title appears
+       in the query by (1 + title_boost); default RALSEI_TITLE_BOOST or 0.25
+    """
+
+    def __init__(self, json_path: str, max_chars: int = 600,
+                 cache_dir: Optional[str] = None, use_cache: bool = True):
+        self.max_chars = max_chars
+        self.metadata: List[dict] = []
+        super().__init__(json_path, chunk_size=max_chars, overlap=0, cache_dir=cache_dir, use_cache=use_cache)
+        self._index_titles()
+
+    def _cache_params(self) -> dict:
+        return {'kind': 'tfidf', 'chunking': 'wiki-json', 'max_chars': self.max_chars}
+
+    def _load_passages(self) -> List[str]:
+        with open(self.text_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        passages, self.metadata = chunk_wiki_records(records, self.max_chars)
+        return passages
+
+    def _save_index(self, st: os.stat_result):
+        # metadata goes in before the base class commits meta.json
+        self.cache.invalidate()
+        pages: Dict[Tuple[str, str], int] = {}
+        page_of = np.empty(len(self.metadata), dtype=np.int32)
+        for i, m in enumerate(self.metadata):
+            page_of[i] = pages.setdefault((m['title'], m['url']), len(pages))
+        types = sorted(set(m['type'] for m in self.metadata))
+        type_of = np.asarray([types.index(m['type']) for m in self.metadata], dtype=np.int8)
+        self.cache.save_json('pages.json', {'pages': [list(p) for p in pages], 'types': types})
+        self.cache.save_array('passage_page', page_of)
+        self.cache.save_array('passage_type', type_of)
+        super()._save_index(st)
+
+    def _load_cached_index(self):
+        info = self.cache.load_json('pages.json')
+        page_of = self.cache.load_array('passage_page', mmap=False)
+        type_of = self.cache.load_array('passage_type', mmap=False)
+        pages = [{'title': t, 'url': u} for t, u in info['pages']]
+        types = info['types']
+        super()._load_cached_index()
+        if len(page_of) != len(self.passages):
+            raise ValueError('passage metadata does not match the cached passages')
+        self.metadata = [dict(pages[p], type=types[t]) for p, t in zip(page_of, type_of)]
+
+    def _index_titles(self):
+        self._title_rows: Dict[str, np.ndarray] = {}
+        rows: Dict[str, List[int]] = {}
+        for i, m in enumerate(self.metadata):
+            rows.setdefault(m['title'].lower(), []).append(i)
+        for title, r in rows.items():
+            self._title_rows[title] = np.asarray(r, dtype=np.int64)
+        # longest titles first so "Roaring Knight" wins over "Knight"
+        titles = sorted((t for t in rows if t), key=len, reverse=True)
+        self._title_pattern = re.compile(
+            r'(?<!\w)(' + '|'.join(re.escape(t) for t in titles) + r')(?!\w)') if titles else None
+
+    def titles_in(self, query: str) -> List[str]:
+        """Page titles (lowercased) mentioned in the query."""
+        if self._title_pattern is None:
+            return []
+        return sorted(set(self._title_pattern.findall(query.lower())))
+
+    def retrieve(self, query: str, k: int = 3, titles: Optional[Iterable[str]] = None,
+                 title_boost: Optional[float] = None) -> List[Tuple[int, float, str]]:
+        return self.retrieve_many([query], k=k, titles=titles, title_boost=title_boost)[0]
+
+    def retrieve_many(self, queries: Sequence[str], k: int = 3, titles: Optional[Iterable[str]] = None,
+                      title_boost: Optional[float] = None) -> List[List[Tuple[int, float, str]]]:
+        if not len(queries):
+            return []
+        if title_boost is None:
+            title_boost = float(os.environ.get('RALSEI_TITLE_BOOST', '0.25'))
+        allowed = None
+        if titles is not None:
+            allowed = np.zeros(len(self.passages), dtype=bool)
+            for t in titles:
+                rows = self._title_rows.get(t.lower())
+                if rows is not None:
+                    allowed[rows] = True
+
+        scores = self._score(queries)
+        if title_boost:
+            scores.data = scores.data.copy()
+            for row, query in enumerate(queries):
+                mentioned = self.titles_in(query)
+                if not mentioned:
+                    continue
+                boosted = np.zeros(len(self.passages), dtype=bool)
+                for t in mentioned:
+                    boosted[self._title_rows[t]] = True
+                start, end = scores.indptr[row], scores.indptr[row + 1]
+                hit = boosted[scores.indices[start:end]]
+                scores.data[start:end][hit] *= 1.0 + title_boost
+        return [self._top_k(scores, row, k, allowed) for row in range(scores.shape[0])]
+
+    def passage_meta(self, i: int) -> dict:
+        return self.metadata[i]
+
+
+def default_data_path(name: str = 'deltarune_wiki_data.txt') -> str:
+    """Locate a file in wikiStuff/, checking vNaught/ first and then the repo root."""
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for root in (base, os.path.dirname(base)):
+        path = os.path.join(root, 'wikiStuff', name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(base, 'wikiStuff', name)
 
 
 def build_default_retriever():
-    base = os.path.dirname(os.path.dirname(__file__))
-    text_path = os.path.join(base, 'wikiStuff', 'deltarune_wiki_data.txt')
-    return Retriever(text_path)
+    """WikiRetriever over the scraped JSON if present, else the flattened .txt.
+
+    RALSEI_RETRIEVER=bm25 selects the inverted-index BM25 retriever instead.
+    """
+    if os.environ.get('RALSEI_RETRIEVER', 'tfidf').lower() == 'bm25':
+        try:
+            from scripts.bm25 import build_bm25_retriever
+        except ImportError:
+            from bm25 import build_bm25_retriever
+        return build_bm25_retriever()
+    json_path = default_data_path('deltarune_wiki_data.json')
+    if os.path.exists(json_path):
+        return WikiRetriever(json_path)
+    return Retriever(default_data_path())
 
 
 if __name__ == '__main__':
@@ -86,4 +467,6 @@ if __name__ == '__main__':
         raise
     query = input('query: ')
     for i, score, passage in r.retrieve(query, k=5):
-        print(f'[{i}] {score:.3f} {passage[:200].replace("\n"," ")}')
+        snippet = passage[:200].replace('\n', ' ')
+        title = f' ({r.metadata[i]["title"]})' if isinstance(r, WikiRetriever) else ''
+        print(f'[{i}] {score:.3f}{title} {snippet}')
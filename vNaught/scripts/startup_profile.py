@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+startup_profile.py
+
+Startup-time report for the vNaught chat app (`python main.py --profile-startup`).
+
+Runs the startup path in a fresh interpreter with `-X importtime`: import
+main, then load the retriever, the embedding search and the LLM one after
+another. Prints the wall time of each phase and the import time of the
+heaviest top-level packages, with the phase that first imported them.
+
+Usage:
+    python main.py --profile-startup [--top 15]
+    python scripts/startup_profile.py [--top 15]
+"""
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+proj_root = pathlib.Path(__file__).resolve().parent.parent
+
+_MARK = '# startup-phase '
+
+# runs in the child interpreter, cwd = vNaught/
+_CHILD = r'''
+import json, sys, time
+
+def phase(name):
+    sys.stderr.write('# startup-phase ' + name + '\n')
+    sys.stderr.flush()
+
+timings = {}
+phase('import main')
+t0 = time.perf_counter()
+import main
+timings['import main'] = time.perf_counter() - t0
+
+steps = (
+    ('load_retriever', lambda: main.load_retriever()),
+    ('load_reranker', lambda: main.load_searcher(retriever)),
+    ('load_llm', lambda: main.load_llm()),
+)
+retriever = None
+for name, fn in steps:
+    phase(name)
+    t0 = time.perf_counter()
+    value = fn()
+    timings[name] = time.perf_counter() - t0
+    if name == 'load_retriever':
+        retriever = value
+phase('done')
+print('# startup-timings ' + json.dumps(timings))
+'''
+
+
+def parse_importtime(stderr: str):
+    """From -X importtime output: ({top-level package: (self seconds, phase first
+    imported)}, {phase: import seconds})."""
+    packages = {}
+    by_phase = {}
+    phase = 'interpreter'
+    for line in stderr.splitlines():
+        if line.startswith(_MARK):
+            phase = line[len(_MARK):].strip()
+            continue
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header row
+        self_us = int(fields[0])
+        top = fields[2].strip().split('.')[0]
+        total, first = packages.get(top, (0.0, phase))
+        packages[top] = (total + self_us / 1e6, first)
+        by_phase[phase] = by_phase.get(phase, 0.0) + self_us / 1e6
+    return packages, by_phase
+
+
+def run_profile():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(proj_root.parent), str(proj_root), env.get('PYTHONPATH')]))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD], cwd=str(proj_root),
+                          env=env, capture_output=True, text=True)
+    timings = None
+    for line in proc.stdout.splitlines():
+        if line.startswith('# startup-timings '):
+            timings = json.loads(line[len('# startup-timings '):])
+    if timings is None:
+        raise RuntimeError(f'startup profile failed:\n{proc.stderr[-2000:]}')
+    packages, by_phase = parse_importtime(proc.stderr)
+    return timings, packages, by_phase
+
+
+def format_report(timings, packages, by_phase, top: int = 15) -> str:
+    lines = ['Startup phases (wall time):']
+    for name, seconds in timings.items():
+        lines.append(f'  {name:<16} {seconds * 1000:9.1f} ms')
+    lines.append(f'  {"total":<16} {sum(timings.values()) * 1000:9.1f} ms')
+    lines.append('')
+    lines.append(f'Import time by top-level package (self time, top {top}):')
+    ranked = sorted(packages.items(), key=lambda kv: -kv[1][0])
+    for name, (seconds, phase) in ranked[:top]:
+        lines.append(f'  {name:<28} {seconds * 1000:9.1f} ms   first imported in {phase}')
+    lines.append('')
+    lines.append('Import time by phase:')
+    for phase, seconds in by_phase.items():
+        lines.append(f'  {phase:<16} {seconds * 1000:9.1f} ms')
+    return '\n'.join(lines)
+
+
+def profile_startup(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Profile vNaught startup (imports and component loads).')
+    parser.add_argument('--profile-startup', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--top', type=int, default=15, help='number of packages to list')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    try:
+        timings, packages, by_phase = run_profile()
+    except RuntimeError as e:
+        print(e)
+        return 1
+    print(format_report(timings, packages, by_phase, args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(profile_startup())
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+server.py
+
+Local multi-user server for the Ralsei RAG chat. One process holds one copy
+of the index and the model and answers many sessions over HTTP, on a TCP port
+or a Unix socket.
+
+Each request retrieves on its own handler thread. Prompt building and
+generation go through a single scheduler thread, which takes queued requests
+in micro-batches (up to RALSEI_SERVER_BATCH, waiting at most
+RALSEI_SERVER_BATCH_WAIT_MS for a batch to fill). Each batch is answered by one
+padded LLM.generate_batch call. The queue is bounded (RALSEI_SERVER_QUEUE):
+when it is full, requests are refused at once with 503 and Retry-After, rather
+than piling up. Every request has a deadline (RALSEI_SERVER_TIMEOUT seconds,
+or "timeout" in the request). Requests that expire while queued are dropped,
+and a batch whose requests have all expired stops at the next token.
+
+Sessions keep the recent turns of one user and run them one at a time. They
+expire after RALSEI_SERVER_SESSION_TTL idle seconds.
+
+Endpoints (JSON in and out):
+ - POST /sessions                               -> {"session"}
+ - POST /chat {"message", "session"?, "timeout"?} -> {"session", "reply", "emotion", "passages", "cached", ...}
+ - GET /sessions/<id>                           -> {"session", "history"}
+ - DELETE /sessions/<id>
+ - GET /health                                  -> queue and batch stats
+
+Usage:
+    python server.py [--host 127.0.0.1] [--port 8765] [--unix PATH]
+    python main.py --serve [same options]
+"""
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+
+from emotion import split_emotion
+from main import (MAX_NEW_TOKENS, build_response_cache, load_llm, load_retriever, load_searcher,
+                  pack_rag_prompt, retrieve_contexts)
+from tracing import get_tracer
+
+FALLBACK_REPLY = "That's interesting! I'm looking forward to when I can respond more meaningfully!"
+MAX_BODY = 64 * 1024
+
+
+class QueueFull(Exception):
+    """The generation queue is at capacity; the client should retry later."""
+
+
+class _Request:
+    __slots__ = ('prepare', 'deadline', 'done', 'reply', 'error')
+
+    def __init__(self, prepare: Callable[[], str], deadline: float):
+        self.prepare = prepare
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.reply: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+    def finish(self, reply: Optional[str] = None, error: Optional[BaseException] = None):
+        self.reply, self.error = reply, error
+        self.done.set()
+
+    def wait(self) -> str:
+        if not self.done.wait(max(0.0, self.deadline - time.monotonic())):
+            raise TimeoutError('request timed out')
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+class BatchScheduler:
+    """Single thread that builds prompts and runs generation in micro-batches.
+
+    `prepare` callables run on the scheduler thread too, so the tokenizer is
+    only ever used by one thread.
+    """
+
+    def __init__(self, llm, max_batch: int = 4, batch_wait: float = 0.02, max_queue: int = 64,
+                 max_tokens: int = MAX_NEW_TOKENS):
+        self.llm = llm
+        self.max_batch = max(1, max_batch)
+        self.batch_wait = batch_wait
+        self.max_tokens = max_tokens
+        self.queue: 'queue.Queue[_Request]' = queue.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, prepare: Callable[[], str], deadline: float) -> _Request:
+        req = _Request(prepare, deadline)
+        try:
+            self.queue.put_nowait(req)
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFull('server busy')
+        return req
+
+    def _collect(self) -> List[_Request]:
+        batch = [self.queue.get()]
+        until = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.monotonic()
+            live = []
+            for req in batch:
+                if req.deadline <= now:
+                    self.expired += 1
+                    req.finish(error=TimeoutError('request timed out in queue'))
+                else:
+                    live.append(req)
+            if live:
+                self._generate(live)
+
+    def _generate(self, batch: List[_Request]):
+        tracer = get_tracer()
+        prompts = []
+        ready = []
+        for req in batch:
+            try:
+                prompts.append(req.prepare())
+                ready.append(req)
+            except Exception as e:
+                req.finish(error=e)
+        if not ready:
+            return
+        # nobody is waiting once every deadline has passed: stop the batch early
+        stop = threading.Event()
+        timer = threading.Timer(max(r.deadline for r in ready) - time.monotonic(), stop.set)
+        timer.daemon = True
+        timer.start()
+        try:
+            with tracer.turn(kind='batch', size=len(ready)):
+                with tracer.span('generate_batch', size=len(ready)) as span:
+                    replies = self.llm.generate_batch(prompts, max_tokens=self.max_tokens, stop_event=stop)
+                    span.set(**self.llm.last_usage)
+        except Exception as e:
+            for req in ready:
+                req.finish(error=e)
+            return
+        finally:
+            timer.cancel()
+        self.batches += 1
+        self.completed += len(ready)
+        for req, reply in zip(ready, replies):
+            req.finish(reply)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'batches': self.batches,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'mean_batch': round(self.completed / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class Session:
+    def __init__(self, session_id: str, max_turns: int = 20):
+        self.id = session_id
+        self.history: deque = deque(maxlen=max_turns)
+        self.lock = threading.Lock()  # one turn at a time per session
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, ttl: float = 3600.0, max_sessions: int = 1000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: dict = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        for sid in [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl]:
+            del self._sessions[sid]
+        if len(self._sessions) >= self.max_sessions:
+            oldest = min(self._sessions.values(), key=lambda s: s.last_used)
+            del self._sessions[oldest.id]
+
+    def create(self) -> Session:
+        with self._lock:
+            self._expire(time.monotonic())
+            session = Session(uuid.uuid4().hex)
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class ChatService:
+    """Shared components plus the session store and the scheduler."""
+
+    def __init__(self, retriever, searcher, llm, timeout: float = 60.0, **scheduler_kwargs):
+        self.retriever = retriever
+        self.searcher = searcher
+        self.llm = llm
+        self.timeout = timeout
+        self.cache = build_response_cache(searcher)
+        self.sessions = SessionStore(float(os.environ.get('RALSEI_SERVER_SESSION_TTL', '3600')))
+        self.scheduler = BatchScheduler(llm, **scheduler_kwargs) if llm is not None else None
+
+    @classmethod
+    def from_env(cls) -> 'ChatService':
+        with get_tracer().turn(kind='startup'):
+            retriever = load_retriever()
+            searcher = load_searcher(retriever)
+            llm = load_llm()
+        return cls(
+            retriever, searcher, llm,
+            timeout=float(os.environ.get('RALSEI_SERVER_TIMEOUT', '60')),
+            max_batch=int(os.environ.get('RALSEI_SERVER_BATCH', '4')),
+            batch_wait=float(os.environ.get('RALSEI_SERVER_BATCH_WAIT_MS', '20')) / 1000.0,
+            max_queue=int(os.environ.get('RALSEI_SERVER_QUEUE', '64')),
+        )
+
+    def chat(self, session: Session, message: str, timeout: Optional[float] = None) -> dict:
+        deadline = time.monotonic() + (timeout or self.timeout)
+        if not session.lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise TimeoutError('previous turn of this session still running')
+        try:
+            with get_tracer().turn(kind='serve', query_chars=len(message)):
+                result = self._answer(message, deadline)
+            # replies (and the cache) keep the model's emotion tag until here
+            result['emotion'], result['reply'] = split_emotion(result['reply'])
+            session.history.append({'message': message, 'reply': result['reply']})
+            return result
+        finally:
+            session.lock.release()
+
+    def _answer(self, message: str, deadline: float) -> dict:
+        if self.retriever is None or self.scheduler is None:
+            return {'reply': FALLBACK_REPLY, 'passages': [], 'cached': False}
+        contexts = retrieve_contexts(message, self.retriever, self.searcher)
+        passage_ids = [c[0] for c in contexts]
+        cached = self.cache.get(message, passage_ids) if self.cache is not None else None
+        if cached is not None:
+            return {'reply': cached, 'passages': [{'index': c[0], 'score': c[1]} for c in contexts],
+                    'cached': True}
+
+        packed = {}
+
+        def prepare() -> str:
+            prompt, packed['contexts'], packed['report'] = pack_rag_prompt(message, contexts, self.llm)
+            return prompt
+
+        reply = self.scheduler.submit(prepare, deadline).wait()
+        if self.cache is not None and not self.llm.is_fallback:
+            self.cache.put(message, passage_ids, reply)
+        return {
+            'reply': reply,
+            'passages': [{'index': c[0], 'score': c[1]} for c in packed['contexts']],
+            'prompt_tokens': packed['report']['prompt_tokens'],
+            'cached': False,
+        }
+
+    def health(self) -> dict:
+        return {
+            'sessions': len(self.sessions),
+            'retriever': self.retriever is not None,
+            'llm': self.llm is not None,
+            'scheduler': self.scheduler.stats() if self.scheduler is not None else None,
+            'speculative': self.llm.speculative_stats() if self.llm is not None else None,
+        }
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    server_version = 'RalseiServer/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self) -> ChatService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if os.environ.get('RALSEI_SERVER_LOG'):
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # Unix-socket peers have no (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def _send(self, status: int, body: dict, headers: Optional[dict] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Optional[dict]:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self._send(413, {'error': 'request body too large'})
+            self.close_connection = True
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send(400, {'error': 'invalid JSON'})
+            return None
+        if not isinstance(body, dict):
+            self._send(400, {'error': 'expected a JSON object'})
+            return None
+        return body
+
+    def _session_id(self) -> Optional[str]:
+        parts = self.path.strip('/').split('/')
+        return parts[1] if len(parts) == 2 and parts[0] == 'sessions' else None
+
+    def do_GET(self):
+        if self.path == '/health':
+            return self._send(200, self.service.health())
+        sid = self._session_id()
+        session = self.service.sessions.get(sid) if sid else None
+        if session is None:
+            return self._send(404, {'error': 'not found'})
+        self._send(200, {'session': session.id, 'history': list(session.history)})
+
+    def do_DELETE(self):
+        sid = self._session_id()
+        if sid and self.service.sessions.delete(sid):
+            return self._send(200, {'session': sid, 'deleted': True})
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = self._read_json()
+        if body is None:
+            return
+        if self.path == '/sessions':
+            return self._send(200, {'session': self.service.sessions.create().id})
+        if self.path != '/chat':
+            return self._send(404, {'error': 'not found'})
+
+        message = body.get('message')
+        if not isinstance(message, str) or not message.strip():
+            return self._send(400, {'error': '"message" must be a non-empty string'})
+        sid = body.get('session')
+        session = self.service.sessions.get(sid) if sid else self.service.sessions.create()
+        if session is None:
+            return self._send(404, {'error': f'unknown session {sid}'})
+        timeout = body.get('timeout')
+        if timeout is not None and not (isinstance(timeout, (int, float)) and timeout > 0):
+            return self._send(400, {'error': '"timeout" must be a positive number of seconds'})
+
+        try:
+            result = self.service.chat(session, message, timeout)
+        except QueueFull:
+            return self._send(503, {'error': 'server busy, retry later'}, {'Retry-After': '1'})
+        except TimeoutError as e:
+            return self._send(504, {'error': str(e)})
+        except Exception as e:
+            return self._send(500, {'error': f'[RAG error] {e}'})
+        self._send(200, dict(result, session=session.id))
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)  # stale socket from a previous run
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def make_server(service: ChatService, host: str = '127.0.0.1', port: int = 8765,
+                unix_path: Optional[str] = None) -> ThreadingHTTPServer:
+    server = UnixHTTPServer(unix_path, ChatHandler) if unix_path else ThreadingHTTPServer((host, port), ChatHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Serve the Ralsei RAG chat to several users.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of TCP')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    service = ChatService.from_env()
+    server = make_server(service, args.host, args.port, args.unix)
+    where = args.unix or f'http://{args.host}:{server.server_port}'
+    print(f'Ralsei server listening on {where}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(serve())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+tracing.py
+
+Lightweight per-turn latency tracing for the chat pipeline.
+
+Each chat turn is a trace made of timing spans (retrieve, rerank_candidates,
+build_rag_prompt, generate, display, ...). When a turn ends, its spans are
+appended as one JSON line to the trace file, and the per-stage latency
+histograms are rewritten as a Prometheus text-format snapshot.
+
+Configuration (environment):
+ - RALSEI_TRACE: path of the JSONL trace file; tracing is off when unset
+ - RALSEI_METRICS: path of the Prometheus text snapshot (optional)
+
+When tracing is off, span() returns a shared no-op object, so instrumented
+code pays roughly one attribute check per span.
+
+Functions:
+ - get_tracer(): process-wide Tracer configured from the environment
+ - Tracer.turn(**attrs): context manager around one turn
+ - Tracer.span(name, **attrs): context manager timing one stage
+ - Tracer.trace_stream(chunks, span): wraps a token stream to record
+   time-to-first-token and tokens/sec
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'turn', 'name', 'attrs', 'start', 'duration')
+
+    def __init__(self, tracer: 'Tracer', turn: Optional['_Turn'], name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.turn = turn
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer._finish_span(self)
+        return False
+
+
+class _Turn:
+    def __init__(self, turn_id: int, attrs: Dict[str, Any]):
+        self.turn_id = turn_id
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+
+
+_current_turn: contextvars.ContextVar = contextvars.ContextVar('ralsei_trace_turn', default=None)
+
+
+class Tracer:
+    def __init__(self, trace_path: Optional[str] = None, metrics_path: Optional[str] = None):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.enabled = bool(trace_path or metrics_path)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # stage -> [bucket counts..., +Inf count], sum
+        self._hist: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return _NOOP
+        return Span(self, _current_turn.get(), name, attrs)
+
+    def turn(self, **attrs):
+        if not self.enabled:
+            return _NOOP
+        return _TurnScope(self, attrs)
+
+    def _finish_span(self, span: Span):
+        with self._lock:
+            counts = self._hist.get(span.name)
+            if counts is None:
+                counts = self._hist[span.name] = [0] * (len(BUCKETS) + 1)
+                self._sums[span.name] = 0.0
+            for i, bound in enumerate(BUCKETS):
+                if span.duration <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[span.name] += span.duration
+        if span.turn is not None:
+            with span.turn.lock:
+                span.turn.spans.append(span)
+
+    def _finish_turn(self, turn: _Turn, error: Optional[str]):
+        record = {
+            'turn': turn.turn_id,
+            'ts': turn.wall_start,
+            'duration_ms': (time.perf_counter() - turn.start) * 1000.0,
+            'spans': [
+                dict({'name': s.name,
+                      'start_ms': (s.start - turn.start) * 1000.0,
+                      'duration_ms': s.duration * 1000.0}, **s.attrs)
+                for s in sorted(turn.spans, key=lambda s: s.start)
+            ],
+        }
+        record.update(turn.attrs)
+        if error:
+            record['error'] = error
+        try:
+            if self.trace_path:
+                with open(self.trace_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            if self.metrics_path:
+                self.write_metrics(self.metrics_path)
+        except OSError as e:
+            print('Warning: could not write trace:', e)
+
+    def trace_stream(self, chunks: Iterable[str], span, usage: Optional[Callable[[], dict]] = None) -> Iterator[str]:
+        """Pass chunks through, recording ttft_ms, chunk count and chunks/sec on `span`.
+
+        The span is timed from the first next() to the end of the stream.
+        `usage` is called once the stream ends; if it reports completion_tokens,
+        tokens_per_sec is recorded as well.
+        """
+        if span is _NOOP:
+            yield from chunks
+            return
+        n = 0
+        with span:
+            for chunk in chunks:
+                if n == 0:
+                    span.set(ttft_ms=(time.perf_counter() - span.start) * 1000.0)
+                n += 1
+                yield chunk
+            elapsed = time.perf_counter() - span.start
+            span.set(chunks=n, chunks_per_sec=n / elapsed if elapsed > 0 else 0.0)
+            if usage is not None:
+                stats = {k: v for k, v in (usage() or {}).items() if v is not None}
+                span.set(**stats)
+                if stats.get('completion_tokens') and elapsed > 0:
+                    span.set(tokens_per_sec=stats['completion_tokens'] / elapsed)
+
+    def prometheus_text(self) -> str:
+        lines = [
+            '# HELP ralsei_stage_seconds Latency of chat pipeline stages.',
+            '# TYPE ralsei_stage_seconds histogram',
+        ]
+        with self._lock:
+            for name in sorted(self._hist):
+                counts = self._hist[name]
+                for bound, count in zip(BUCKETS, counts):
+                    lines.append(f'ralsei_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'ralsei_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'ralsei_stage_seconds_sum{{stage="{name}"}} {self._sums[name]:.6f}')
+                lines.append(f'ralsei_stage_seconds_count{{stage="{name}"}} {counts[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_metrics(self, path: str):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+
+class _TurnScope:
+    def __init__(self, tracer: Tracer, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.turn = _Turn(next(tracer._ids), attrs)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_turn.set(self.turn)
+        return self
+
+    def set(self, **attrs):
+        self.turn.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_turn.reset(self._token)
+        self.tracer._finish_turn(self.turn, exc_type.__name__ if exc_type else None)
+        return False
+
+
+_default = None
+
+
+def get_tracer() -> Tracer:
+    global _default
+    if _default is None:
+        _default = Tracer(os.environ.get('RALSEI_TRACE') or None, os.environ.get('RALSEI_METRICS') or None)
+    return _default
@@ -1,14 +1,296 @@
 import requests
 from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse
+import argparse
+import os
 import re
 import json
+import threading
 import time
-from typing import Set, List, Dict
+from typing import Iterable, Optional, Set, List, Dict
+
+SKIP_PREFIXES = ['Special:', 'File:', 'User:', 'Talk:', 'Category:', 'Help:', 'Blog:', 'Template:']
+
+
+def clean_text(text: str) -> str:
+    """Remove extra whitespace and [edit] markers from extracted text."""
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\[edit\]', '', text)
+    return text.strip()
+
+
+def parse_page(html: str, url: str, keywords: List[str], min_content_length: int) -> Dict:
+    """Parse one page: its title, the keyword elements of the main content and
+    every link in it. Module-level so it can run in a parser process."""
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.find('h1', {'id': 'firstHeading'})
+    main_content = soup.find('div', {'id': 'mw-content-text'})
+    content = []
+    links = []
+    if main_content:
+        for element in main_content.find_all(['p', 'h2', 'h3', 'h4', 'li']):
+            text = clean_text(element.get_text())
+            if len(text) >= min_content_length and any(k.lower() in text.lower() for k in keywords):
+                content.append({'type': element.name, 'content': text})
+        links = [urljoin(url, a_tag['href']) for a_tag in main_content.find_all('a', href=True)]
+    return {
+        'title': title.get_text().strip() if title else "No Title",
+        'content': content,
+        'links': links,
+        'has_main': main_content is not None,
+    }
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostRateLimiter:
+    """One token bucket per host."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url: str):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+class Frontier:
+    """Deduplicated FIFO of URLs to fetch, shared by the crawl workers.
+
+    get() blocks until a URL is available and returns None once the crawl is
+    over: `max_pages` URLs handed out, or nothing queued and nothing in flight
+    (a page is in flight until done(url) is called for it, after parsing), or
+    stop() was called.
+    """
+
+    def __init__(self, max_pages: int):
+        self.max_pages = max_pages
+        self.seen: Set[str] = set()
+        self.queue: deque = deque()
+        self.active: Set[str] = set()
+        self.taken = 0
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def add(self, urls: Iterable[str]):
+        with self.cond:
+            for url in urls:
+                if url not in self.seen:
+                    self.seen.add(url)
+                    self.queue.append(url)
+            self.cond.notify_all()
+
+    def get(self) -> Optional[str]:
+        with self.cond:
+            while True:
+                if self.stopped or self.taken >= self.max_pages:
+                    return None
+                if self.queue:
+                    self.taken += 1
+                    url = self.queue.popleft()
+                    self.active.add(url)
+                    return url
+                if not self.active:
+                    return None
+                self.cond.wait()
+
+    def done(self, url: str):
+        with self.cond:
+            self.active.discard(url)
+            self.cond.notify_all()
+
+    def stop(self):
+        """End the crawl early; queued URLs stay pending for a checkpoint."""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def pending(self) -> List[str]:
+        """URLs still to fetch, counting the ones in flight (they restart on resume)."""
+        with self.cond:
+            return list(self.active) + list(self.queue)
+
+
+class ConditionalCache:
+    """ETag / Last-Modified of fetched pages plus their parsed result, so a
+    re-crawl can send conditional requests and reuse the parse on 304."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def headers(self, url: str) -> Dict[str, str]:
+        with self.lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self.lock:
+            entry = self.entries.get(url)
+        return entry['page'] if entry else None
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], page: Dict):
+        if not (etag or last_modified):
+            return
+        with self.lock:
+            self.entries[url] = {'etag': etag, 'last_modified': last_modified, 'page': page}
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+class JsonlWriter:
+    """Append-only page records, one JSON object per line, written once each.
+
+    `resume_at` truncates the file to that many bytes first (the size recorded
+    by the last checkpoint) so records written after it are not duplicated.
+    """
+
+    def __init__(self, path: str, resume_at: int = 0):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = open(path, 'ab')
+        self.f.truncate(resume_at)
+        self.f.seek(0, os.SEEK_END)
+
+    def write(self, record: Dict):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def sync(self) -> int:
+        """Flush to disk; returns the file size."""
+        with self.lock:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            return self.f.tell()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+class Checkpoint:
+    """Visited set and frontier of a crawl, saved every `every_pages` pages or
+    `every_seconds` seconds (whichever comes first) to resume after a crash."""
+
+    def __init__(self, path: str, every_pages: int = 25, every_seconds: float = 30.0):
+        self.path = path
+        self.every_pages = every_pages
+        self.every_seconds = every_seconds
+        self.pages = 0
+        self.saved_at = time.monotonic()
+
+    def due(self) -> bool:
+        self.pages += 1
+        return self.pages >= self.every_pages or time.monotonic() - self.saved_at >= self.every_seconds
+
+    def save(self, base_url: str, visited: Iterable[str], pending: Iterable[str], output_bytes: int):
+        state = {
+            'base_url': base_url,
+            'visited': sorted(visited),
+            'pending': list(pending),
+            'output_bytes': output_bytes,
+            'saved': time.time(),
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.pages = 0
+        self.saved_at = time.monotonic()
+
+    def load(self) -> Optional[Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def compact_jsonl(jsonl_path: str, json_path: str) -> int:
+    """Write the page records of a JSONL file as the final JSON list.
+
+    Pages written twice (re-fetched after a resume) keep their first position
+    and their latest content; a torn last line from a crash is skipped.
+    Returns the number of pages written.
+    """
+    records: Dict[str, Dict] = {}
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['url']] = record
+    tmp = json_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(list(records.values()), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, json_path)
+    return len(records)
+
 
 class DeltaruneScraper:
-    def __init__(self):
-        self.base_url = "https://deltarune.fandom.com/wiki/"  # Changed to Fandom wiki
+    def __init__(self, base_url: str = "https://deltarune.fandom.com/wiki/", jsonl_path: Optional[str] = None,
+                 checkpoint_path: str = 'deltarune_wiki_checkpoint.json', checkpoint_every: int = 25):
+        self.base_url = base_url  # Changed to Fandom wiki
+        self.host = urlparse(base_url).netloc
+        self.output_path = 'deltarune_wiki_data.json'
+        # JSONL mode: each page record is appended once, the crawl checkpointed
+        # for resume, and the JSON output compacted from the JSONL at the end
+        self.jsonl_path = jsonl_path
+        self.checkpoint = Checkpoint(checkpoint_path, checkpoint_every) if jsonl_path else None
+        self.writer: Optional[JsonlWriter] = None
         self.visited_urls: Set[str] = set()
         self.keywords = {
             'ralsei'
@@ -16,6 +298,7 @@ class DeltaruneScraper:
         self.min_content_length = 50  # Reduced minimum length for content
         self.session = requests.Session()
         self.collected_data: List[Dict] = []
+        self.lock = threading.Lock()  # guards visited_urls / collected_data in crawl()
         
         # Set up session with proper headers
         self.session.headers.update({
@@ -24,33 +307,67 @@ class DeltaruneScraper:
             'Accept-Language': 'en-US,en;q=0.5',
         })
 
-    def is_valid_url(self, url: str) -> bool:
-        """Check if URL belongs to the wiki domain and hasn't been visited."""
+    def is_wiki_url(self, url: str) -> bool:
+        """Check if URL is a wiki article page on the wiki's domain."""
         parsed = urlparse(url)
         return (
-            'deltarune.fandom.com' in parsed.netloc and
+            self.host in parsed.netloc and
             '/wiki/' in url and  # Only process wiki article pages
-            not any(x in url for x in ['Special:', 'File:', 'User:', 'Talk:', 'Category:', 'Help:', 'Blog:', 'Template:']) and
+            not any(x in url for x in SKIP_PREFIXES) and
             not url.endswith(('.jpg', '.png', '.gif', '.css', '.js')) and
-            not '#' in url and  # Skip section anchors
-            url not in self.visited_urls
+            not '#' in url  # Skip section anchors
         )
 
+    def is_valid_url(self, url: str) -> bool:
+        """Check if URL belongs to the wiki domain and hasn't been visited."""
+        return self.is_wiki_url(url) and url not in self.visited_urls
+
     def contains_keywords(self, text: str) -> bool:
         """Check if text contains any of the keywords."""
         return any(keyword.lower() in text.lower() for keyword in self.keywords)
 
     def clean_text(self, text: str) -> str:
         """Clean extracted text by removing extra whitespace and special characters."""
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'\[edit\]', '', text)
-        return text.strip()
+        return clean_text(text)
 
     def save_data(self):
         """Save the collected data to a JSON file."""
-        with open('deltarune_wiki_data.json', 'w', encoding='utf-8') as f:
+        with open(self.output_path, 'w', encoding='utf-8') as f:
             json.dump(self.collected_data, f, ensure_ascii=False, indent=2)
 
+    def _add_record(self, record: Dict):
+        self.collected_data.append(record)
+        if self.writer is not None:
+            self.writer.write(record)
+
+    def _open_output(self, resume: bool) -> Optional[Dict]:
+        """Open the JSONL output; with `resume`, the last checkpoint (or None)."""
+        if self.jsonl_path is None:
+            return None
+        state = self.checkpoint.load() if resume else None
+        if state is not None and state.get('base_url') != self.base_url:
+            print(f"Checkpoint is for {state.get('base_url')}, starting over")
+            state = None
+        self.writer = JsonlWriter(self.jsonl_path, state['output_bytes'] if state else 0)
+        if state is not None:
+            self.visited_urls.update(state['visited'])
+            print(f"Resuming: {len(state['visited'])} pages done, {len(state['pending'])} to visit")
+        return state
+
+    def _save_checkpoint(self, pending: Iterable[str]):
+        self.checkpoint.save(self.base_url, self.visited_urls, pending, self.writer.sync())
+
+    def _close_output(self, pending: Iterable[str]):
+        """Last checkpoint, then the final JSON (compacted from the JSONL in JSONL mode)."""
+        if self.writer is None:
+            self.save_data()
+            return
+        self._save_checkpoint(pending)
+        self.writer.close()
+        self.writer = None
+        pages = compact_jsonl(self.jsonl_path, self.output_path)
+        print(f"Compacted {pages} pages into {self.output_path}")
+
     def extract_content(self, soup: BeautifulSoup, url: str) -> None:
         """Extract relevant content from the page."""
         main_content = soup.find('div', {'id': 'mw-content-text'})  # Changed to correct content div
@@ -78,13 +395,14 @@ class DeltaruneScraper:
                 print(f"Found content [{len(text)} chars] {'✓' if has_keywords else '✗'} Keywords: {text[:100]}...")
 
         if page_content:  # Only save if we found relevant content
-            self.collected_data.append({
+            self._add_record({
                 'title': title_text,
                 'url': url,
                 'content': page_content
             })
-            # Save immediately after finding content
-            self.save_data()
+            # Save immediately after finding content (JSONL mode already appended it)
+            if self.writer is None:
+                self.save_data()
 
     def scrape_page(self, url: str) -> Set[str]:
         """Scrape a single page and return all found links."""
@@ -106,10 +424,6 @@ class DeltaruneScraper:
             print(f"\nProcessing page: {url}")
             self.extract_content(soup, url)
 
-            # Save data after each page
-            if len(self.collected_data) > 0:
-                self.save_data()
-
             # Find all links on the page
             links = set()
             main_content = soup.find('div', {'id': 'mw-content-text'})
@@ -126,21 +440,191 @@ class DeltaruneScraper:
             print(f"Error scraping {url}: {str(e)}")
             return set()
 
-    def start_scraping(self, max_pages: int = 1000):
-        """Start the scraping process from the base URL."""
-        to_visit = {self.base_url}
+    def start_scraping(self, max_pages: int = 1000, resume: bool = False):
+        """Start the scraping process from the base URL (or the last checkpoint)."""
+        state = self._open_output(resume)
+        to_visit = set(state['pending']) - self.visited_urls if state else {self.base_url}
         
         while to_visit and len(self.visited_urls) < max_pages:
             current_url = to_visit.pop()
             new_links = self.scrape_page(current_url)
             to_visit.update(new_links - self.visited_urls)
+            if self.checkpoint is not None and self.checkpoint.due():
+                self._save_checkpoint(to_visit)
 
         # Save the collected data
-        with open('deltarune_wiki_data.json', 'w', encoding='utf-8') as f:
-            json.dump(self.collected_data, f, ensure_ascii=False, indent=2)
+        self._close_output(to_visit)
+
+    # -- concurrent crawl ------------------------------------------------------
+
+    def _fetch(self, url: str, limiter: HostRateLimiter, cache: ConditionalCache,
+               conditional: bool = True, retries: int = 3):
+        """GET with the rate limiter and conditional headers; None on 304."""
+        for attempt in range(retries + 1):
+            limiter.acquire(url)
+            response = self.session.get(url, timeout=10, headers=cache.headers(url) if conditional else None)
+            if response.status_code == 304:
+                return None
+            if response.status_code in (429, 503) and attempt < retries:
+                # the server asks us to slow down: this worker waits, the others keep their pace
+                retry_after = response.headers.get('Retry-After', '')
+                time.sleep(float(retry_after) if retry_after.isdigit() else 2.0 ** attempt)
+                continue
+            response.raise_for_status()
+            return response
+
+    def _crawl_worker(self, frontier: Frontier, limiter: HostRateLimiter, cache: ConditionalCache,
+                      parsers: Executor, stats: Dict):
+        keywords = sorted(self.keywords)
+        while True:
+            url = frontier.get()
+            if url is None:
+                return
+            # once a parse is submitted its callback marks the URL done; until then this thread does
+            handed_off = False
+            try:
+                try:
+                    response = self._fetch(url, limiter, cache)
+                    page = cache.get(url) if response is None else None
+                    if response is None and page is None:
+                        # 304 without a cached parse: fetch unconditionally
+                        response = self._fetch(url, limiter, cache, conditional=False)
+                except Exception as e:
+                    print(f"Error scraping {url}: {str(e)}")
+                    self._count(stats, 'errors')
+                    continue
+                if response is None:
+                    self._count(stats, 'not_modified')
+                    handed_off = True  # _page_parsed calls done()
+                    self._page_parsed(url, page, frontier)
+                    continue
+                self._count(stats, 'fetched')
+                etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+                def on_parsed(f, url=url, etag=etag, last_modified=last_modified):
+                    try:
+                        page = f.result()
+                    except Exception as e:
+                        print(f"Error parsing {url}: {str(e)}")
+                        self._count(stats, 'errors')
+                        frontier.done(url)
+                        return
+                    cache.put(url, etag, last_modified, page)
+                    self._page_parsed(url, page, frontier)
+
+                # parse off the I/O thread; the worker moves on to its next URL
+                try:
+                    future = parsers.submit(parse_page, response.text, url, keywords, self.min_content_length)
+                except (BrokenExecutor, RuntimeError) as e:
+                    # a parser process died (or the pool shut down): nothing more can be parsed
+                    print(f"Error parsing {url}: {str(e)}; stopping the crawl")
+                    self._count(stats, 'errors')
+                    # not done(): the page stays in flight, so the checkpoint lists it for --resume
+                    handed_off = True
+                    frontier.stop()
+                    continue
+                handed_off = True
+                future.add_done_callback(on_parsed)
+            finally:
+                if not handed_off:
+                    frontier.done(url)
+
+    def _count(self, stats: Dict, key: str):
+        with self.lock:
+            stats[key] += 1
+
+    def _page_parsed(self, url: str, page: Dict, frontier: Frontier):
+        try:
+            if not page['has_main']:
+                print(f"No main content found for {url}")
+            # links go into the frontier before the page counts as visited, so a
+            # checkpoint never holds a visited page whose links are lost
+            frontier.add(link for link in page['links'] if self.is_wiki_url(link))
+            with self.lock:
+                if page['content']:
+                    self._add_record({'title': page['title'], 'url': url, 'content': page['content']})
+                self.visited_urls.add(url)
+                if self.checkpoint is not None and self.checkpoint.due():
+                    self._save_checkpoint(frontier.pending())
+        finally:
+            frontier.done(url)
+
+    def crawl(self, max_pages: int = 1000, workers: int = 8, rate: float = 4.0, burst: Optional[float] = None,
+              parse_workers: Optional[int] = None, cache_path: Optional[str] = 'deltarune_wiki_http_cache.json',
+              resume: bool = False) -> Dict:
+        """Concurrent crawl from the base URL (or, with `resume`, the last checkpoint).
+
+        `workers` threads share one pooled session and fetch from a
+        deduplicated frontier, at most `rate` requests per second per host
+        (bursts of `burst`, default `workers`). Pages are parsed in
+        `parse_workers` processes (0: one parser thread). With `cache_path`,
+        ETag / Last-Modified validators are kept between runs and unchanged
+        pages come back as 304s. Returns crawl stats.
+        """
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        limiter = HostRateLimiter(rate, burst or workers)
+        cache = ConditionalCache(cache_path)
+        frontier = Frontier(max_pages)
+        state = self._open_output(resume)
+        if state is not None:
+            frontier.seen.update(self.visited_urls)
+            frontier.taken = len(self.visited_urls)
+            frontier.add(state['pending'])
+        else:
+            frontier.add([self.base_url])
+        stats = {'fetched': 0, 'not_modified': 0, 'errors': 0}
+
+        start = time.perf_counter()
+        if parse_workers == 0:
+            parsers = ThreadPoolExecutor(max_workers=1, thread_name_prefix='parse')
+        else:
+            parsers = ProcessPoolExecutor(max_workers=parse_workers or min(4, os.cpu_count() or 1))
+        with parsers:
+            threads = [threading.Thread(target=self._crawl_worker, name=f'crawl-{i}',
+                                        args=(frontier, limiter, cache, parsers, stats))
+                       for i in range(workers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        stats['pages'] = len(self.visited_urls)
+        stats['stopped'] = frontier.stopped
+        stats['seconds'] = round(time.perf_counter() - start, 2)
+
+        cache.save()
+        self._close_output(frontier.pending())
+        return stats
+
 
 if __name__ == "__main__":
-    scraper = DeltaruneScraper()
-    scraper.start_scraping()
+    parser = argparse.ArgumentParser(description='Scrape Ralsei content from the Deltarune wiki.')
+    parser.add_argument('--base-url', default="https://deltarune.fandom.com/wiki/")
+    parser.add_argument('--max-pages', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=0, help='concurrent crawl with N fetch threads (0: one page at a time)')
+    parser.add_argument('--rate', type=float, default=4.0, help='requests per second per host (concurrent crawl)')
+    parser.add_argument('--parse-workers', type=int, default=None, help='parser processes (0: one parser thread)')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='append pages to deltarune_wiki_data.jsonl and checkpoint the crawl')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint (implies --jsonl)')
+    parser.add_argument('--checkpoint-every', type=int, default=25, help='pages between checkpoints')
+    parser.add_argument('--compact', action='store_true',
+                        help='only rebuild deltarune_wiki_data.json from deltarune_wiki_data.jsonl')
+    args = parser.parse_args()
+
+    if args.compact:
+        pages = compact_jsonl('deltarune_wiki_data.jsonl', 'deltarune_wiki_data.json')
+        print(f"Compacted {pages} pages into 'deltarune_wiki_data.json'")
+        raise SystemExit(0)
+
+    jsonl_path = 'deltarune_wiki_data.jsonl' if args.jsonl or args.resume else None
+    scraper = DeltaruneScraper(args.base_url, jsonl_path=jsonl_path, checkpoint_every=args.checkpoint_every)
+    if args.workers > 0:
+        stats = scraper.crawl(args.max_pages, workers=args.workers, rate=args.rate,
+                              parse_workers=args.parse_workers, resume=args.resume)
+        print(f"Crawl stats: {stats}")
+    else:
+        scraper.start_scraping(args.max_pages, resume=args.resume)
     print(f"Scraping completed. Visited {len(scraper.visited_urls)} pages.")
     print(f"Collected data saved to 'deltarune_wiki_data.json'")
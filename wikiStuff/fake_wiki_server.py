@@ -0,0 +1,129 @@
+"""Local stand-in for the Deltarune wiki, for testing DeltaruneScraper offline.
+
+Serves canned article pages rebuilt from deltarune_wiki_data.json (same
+markup the scraper looks for: h1#firstHeading, div#mw-content-text), linked
+to each other through the page titles mentioned in their text, plus a few
+links the scraper must skip (Special:, File:, anchors). Pages carry an ETag
+and Last-Modified and answer conditional requests with 304.
+
+Options simulate a slow or strict server: --latency adds a delay to every
+response, --max-rate answers 429 (Retry-After: 1) beyond that many requests
+per second. GET /__stats returns request counters.
+
+Usage:
+    python fake_wiki_server.py [--port 8000] [--latency 0.2] [--max-rate 20]
+    python deltarune_scraper.py --base-url http://127.0.0.1:8000/wiki/ --workers 8
+"""
+from email.utils import formatdate
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote, urlparse
+import argparse
+import hashlib
+import json
+import threading
+import time
+
+LAST_MODIFIED = formatdate(1700000000, usegmt=True)
+
+
+def slug(title: str) -> str:
+    return quote(title.replace(' ', '_'))
+
+
+def build_pages(records: List[Dict]) -> Dict[str, str]:
+    """{path: html} for the index page (/wiki/) and one page per record."""
+    titles = [r['title'] for r in records]
+    pages = {}
+    for i, record in enumerate(records):
+        text = ' '.join(e['content'] for e in record['content'])
+        mentioned = [t for t in titles if t != record['title'] and t in text]
+        # the next page too, so every page is reachable from the index
+        mentioned.append(titles[(i + 1) % len(titles)])
+        body = ''.join(f"<{e['type']}>{escape(e['content'])}</{e['type']}>" for e in record['content'])
+        links = ''.join(f'<li><a href="/wiki/{slug(t)}">{escape(t)}</a></li>' for t in mentioned)
+        noise = ('<a href="/wiki/Special:Random">random</a> <a href="/wiki/File:Ralsei.png">image</a> '
+                 f'<a href="/wiki/{slug(record["title"])}#Trivia">trivia</a>')
+        pages['/wiki/' + slug(record['title'])] = (
+            f'<html><head><title>{escape(record["title"])}</title></head><body>'
+            f'<h1 id="firstHeading">{escape(record["title"])}</h1>'
+            f'<div id="mw-content-text">{body}<ul>{links}</ul>{noise}</div></body></html>'
+        )
+    index_links = ''.join(f'<a href="/wiki/{slug(t)}">{escape(t)}</a> ' for t in titles[::10])
+    pages['/wiki/'] = ('<html><body><h1 id="firstHeading">Deltarune Wiki</h1>'
+                       f'<div id="mw-content-text"><p>Welcome.</p>{index_links}</div></body></html>')
+    return pages
+
+
+class FakeWikiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+        if path == '/__stats':
+            return self._send(200, json.dumps(server.stats).encode(), {'Content-Type': 'application/json'})
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.stats['requests'] += 1
+            now = time.monotonic()
+            server.recent = [t for t in server.recent if now - t < 1.0] + [now]
+            limited = server.max_rate and len(server.recent) > server.max_rate
+            if limited:
+                server.stats['throttled'] += 1
+        if limited:
+            return self._send(429, b'slow down', {'Retry-After': '1'})
+
+        html = server.pages.get(path) or server.pages.get(slug(unquote(path)))
+        if html is None:
+            return self._send(404, b'not found')
+        etag = '"' + hashlib.md5(html.encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag or self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+            with server.lock:
+                server.stats['not_modified'] += 1
+            return self._send(304, headers={'ETag': etag, 'Last-Modified': LAST_MODIFIED})
+        self._send(200, html.encode('utf-8'), {'Content-Type': 'text/html; charset=utf-8',
+                                               'ETag': etag, 'Last-Modified': LAST_MODIFIED})
+
+
+def make_server(records: List[Dict], port: int = 8000, latency: float = 0.0,
+                max_rate: float = 0.0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeWikiHandler)
+    server.daemon_threads = True
+    server.pages = build_pages(records)
+    server.latency = latency
+    server.max_rate = max_rate
+    server.lock = threading.Lock()
+    server.recent = []
+    server.stats = {'requests': 0, 'not_modified': 0, 'throttled': 0}
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve canned Deltarune wiki pages locally.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--data', default='deltarune_wiki_data.json')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--max-rate', type=float, default=0.0, help='429 above this many requests/second (0: off)')
+    args = parser.parse_args()
+
+    with open(args.data, 'r', encoding='utf-8') as f:
+        server = make_server(json.load(f), args.port, args.latency, args.max_rate)
+    print(f'Serving {len(server.pages)} pages on http://127.0.0.1:{server.server_port}/wiki/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass